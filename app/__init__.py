@@ -11,10 +11,11 @@ from datetime import timedelta
 from dotenv import load_dotenv
 import os
 
-from app.database import create_users
-from app.database import create_friendships
-from app.database import create_friend_requests
-from app.database import create_chats
+from app.auth import token_cache
+from app.database import add_observer
+from app.message_segment import open_segments
+from app.passwords import hasher
+from app.repositories import configure_storage, storage
 
 
 from app.routes import register_routes
@@ -30,14 +31,54 @@ socketio = SocketIO(application, cors_allowed_origins="*", async_mode='eventlet'
 jwt = JWTManager(application)
 
 def create_app():
-    create_users()
-    create_friendships()
-    create_friend_requests()
-    # create_chats()
-
     load_dotenv()
 
+    # Password hashes run in a bounded thread pool off the hub (see
+    # app/passwords.py): HASH_WORKERS at a time (default: CPU count, 0 hashes
+    # inline) with up to HASH_QUEUE waiting; beyond that logins get a 503.
+    # HASH_METHOD sets the hash cost (e.g. scrypt:65536:8:1), or
+    # HASH_TIME_BUDGET_MS picks the strongest HASH_FAMILY cost that fits the
+    # budget on this machine at startup. Older hashes are upgraded on login.
+    workers = os.getenv("HASH_WORKERS")
+    hasher.configure(int(workers) if workers else None, int(os.getenv("HASH_QUEUE", "64")))
+    if os.getenv("HASH_METHOD"):
+        hasher.set_method(os.getenv("HASH_METHOD"))
+    elif os.getenv("HASH_TIME_BUDGET_MS"):
+        timings = hasher.tune(int(os.getenv("HASH_TIME_BUDGET_MS")) / 1000, os.getenv("HASH_FAMILY", "scrypt"))
+        print(f"Password hashing: tuned to {hasher.method} "
+              f"({', '.join(f'{method} {seconds * 1000:.0f} ms' for method, seconds in timings)})")
+
+    # STORAGE_BACKEND picks where data lives (memory, sqlite or postgres, see
+    # app/repositories.py); the SQL backends persist to DATABASE_URL and
+    # reload from it on startup. WAL_DIR adds a local write-ahead log of chat
+    # mutations on top of any backend (see app/wal.py); with SNAPSHOT_DIR (only
+    # together with WAL_DIR) the memory backend starts from the latest snapshot
+    # plus the log tail, and HISTORY_DIR moves the history of idle chats into
+    # memory-mapped files.
+    configure_storage(os.getenv("STORAGE_BACKEND", "memory"), os.getenv("DATABASE_URL"),
+                      max_batch=int(os.getenv("PERSISTENCE_MAX_BATCH", "500")),
+                      max_delay=int(os.getenv("PERSISTENCE_MAX_DELAY_MS", "50")) / 1000,
+                      wal_dir=os.getenv("WAL_DIR"),
+                      wal_durability=os.getenv("WAL_DURABILITY", "batched"),
+                      snapshot_dir=os.getenv("SNAPSHOT_DIR"),
+                      history_dir=os.getenv("HISTORY_DIR"),
+                      history_idle_seconds=int(os.getenv("HISTORY_IDLE_S", "3600")))
+    # At most HISTORY_MAX_OPEN_SEGMENTS sealed segments stay memory-mapped;
+    # the least recently read are unmapped (see app/message_segment.py).
+    open_segments.max_open = int(os.getenv("HISTORY_MAX_OPEN_SEGMENTS", "256"))
+    # Protected routes cache up to AUTH_TOKEN_CACHE_SIZE verified tokens (0
+    # disables it, see app/auth.py); deleting a user drops theirs at once.
+    token_cache.max_size = int(os.getenv("AUTH_TOKEN_CACHE_SIZE", "4096"))
+    add_observer(token_cache)
+
+    if storage.snapshots is not None:
+        socketio.start_background_task(storage.snapshots.run_periodically,
+                                       int(os.getenv("SNAPSHOT_INTERVAL_S", "300")))
+    if storage.history is not None:
+        socketio.start_background_task(storage.history.run_periodically,
+                                       int(os.getenv("HISTORY_SEAL_INTERVAL_S", "60")))
+
     # ensure our socket handlers get registered
     import app.socket_events  
 
-    register_routes(application)
\ No newline at end of file
+    register_routes(application)
@@ -0,0 +1,125 @@
+"""
+Authentication of protected requests.
+
+authenticate_request() resolves the caller once per request: it verifies
+the bearer token, looks up its user and keeps both in flask.g, so handlers
+read them back with get_jwt_identity() / current_user() for free.
+
+Verifying a token's signature is the expensive part, and clients send the
+same token on every request for hours. TokenCache remembers the decoded
+header and claims of tokens that passed verification, keyed by the whole
+token (so a hit means the exact signed bytes were verified before), in LRU
+order and only until the token's own `exp`. A cache hit fills in the same
+flask.g entries flask_jwt_extended sets after verifying, so get_jwt(),
+get_jwt_identity() and get_current_user() work unchanged. Deleting a user
+drops their cached tokens at once (the cache is a store observer), and the
+per-request user lookup refuses tokens of deleted users regardless.
+"""
+
+import time
+from collections import OrderedDict
+from typing import Optional
+
+from flask import g, request
+from flask_jwt_extended import get_jwt, get_jwt_header, verify_jwt_in_request
+from flask_jwt_extended.config import config
+
+from app.repositories import storage
+from app.user import User
+
+
+class TokenCache:
+
+    def __init__(self, max_size: int = 4096):
+        self.max_size = max_size
+        self._entries: OrderedDict[str, tuple] = OrderedDict()  # token -> (header, claims), oldest first
+        self._by_user: dict = {}  # identity -> set of tokens
+        self.hits = self.misses = 0
+
+    def get(self, token: str) -> Optional[tuple]:
+        """(header, claims) of a verified, unexpired token, or None."""
+        entry = self._entries.get(token)
+        if entry is None:
+            self.misses += 1
+            return None
+        expires = entry[1].get("exp")
+        if expires is not None and expires <= time.time():
+            self._drop(token)
+            self.misses += 1
+            return None
+        self._entries.move_to_end(token)
+        self.hits += 1
+        return entry
+
+    def put(self, token: str, header: dict, claims: dict):
+        if self.max_size <= 0:
+            return
+        self._entries[token] = (header, claims)
+        self._entries.move_to_end(token)
+        self._by_user.setdefault(claims.get(config.identity_claim_key), set()).add(token)
+        while len(self._entries) > self.max_size:
+            self._drop(next(iter(self._entries)))
+
+    def _drop(self, token: str):
+        _, claims = self._entries.pop(token)
+        identity = claims.get(config.identity_claim_key)
+        tokens = self._by_user.get(identity)
+        if tokens is not None:
+            tokens.discard(token)
+            if not tokens:
+                del self._by_user[identity]
+
+    def invalidate_user(self, user_id):
+        for token in list(self._by_user.get(user_id, ())):
+            self._drop(token)
+
+    def clear(self):
+        self._entries.clear()
+        self._by_user.clear()
+
+    # Store observer: forget a deleted user's tokens right away
+    def user_deleted(self, user: User):
+        self.invalidate_user(user.userId)
+
+    def __len__(self):
+        return len(self._entries)
+
+
+# The process-wide cache; create_app() sizes it from AUTH_TOKEN_CACHE_SIZE
+token_cache = TokenCache()
+
+def _bearer_token() -> Optional[str]:
+    value = request.headers.get(config.header_name, "")
+    prefix = f"{config.header_type} " if config.header_type else ""
+    if prefix and not value.startswith(prefix):
+        return None
+    return value[len(prefix):].strip() or None
+
+def authenticate_request() -> Optional[User]:
+    """
+    Verifies the request's access token, from the cache when possible, and
+    stores the caller in g.current_user. Returns the user, or None if the
+    token is valid but its user no longer exists. Raises flask_jwt_extended's
+    errors for missing or invalid tokens, as jwt_required() does.
+    """
+    token = _bearer_token()
+    cached = token_cache.get(token) if token else None
+    if cached is not None:
+        header, claims = cached
+        g._jwt_extended_jwt_header = header
+        g._jwt_extended_jwt = claims
+        g._jwt_extended_jwt_location = "headers"
+    elif verify_jwt_in_request() is None:
+        g.current_user = None  # Exempt method (e.g. OPTIONS): no token checked
+        return None
+    elif token:
+        token_cache.put(token, get_jwt_header(), get_jwt())
+
+    g.current_user = storage.users.get(get_jwt()[config.identity_claim_key])
+    # What flask_jwt_extended keeps after a user_lookup_loader, so get_current_user() works on hits and misses
+    g._jwt_extended_jwt_user = {"loaded_user": g.current_user}
+    return g.current_user
+
+def current_user() -> Optional[User]:
+    """The authenticated user of the current request (see authenticate_request)."""
+    return g.get("current_user")
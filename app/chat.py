@@ -1,90 +1,291 @@
 import datetime
+from bisect import bisect_left
+from collections import OrderedDict
 from enum import Enum
 import uuid
 from app.chat_member import ChatMember
 from app.message import Message
-from typing import List, Optional
+from app.message_log import MessageLog, to_epoch_micros
+from typing import Dict, List, Optional
 
 class ChatType(Enum):
     ONE_ON_ONE = "one_on_one"
     GROUP = "group"
 
+def normalize_user_id(user_id) -> Optional[int]:
+    """User ids reach chats as ints (JWT) or strings (REST bodies, socket auth); key everything by int."""
+    try:
+        return int(user_id)
+    except (TypeError, ValueError):
+        return None
+
 class Chat:
-    def __init__(self, chat_type, name=None):
-        self.chat_id = str(uuid.uuid4())
+    def __init__(self, chat_type, name=None, chat_id: Optional[str] = None,
+                 created_at: Optional[datetime.datetime] = None):
+        self.chat_id = chat_id if chat_id else str(uuid.uuid4())
         self.name = name if chat_type == ChatType.GROUP else None
         self.chat_type = chat_type
-        self.created_at = datetime.datetime.now(datetime.UTC)
-        self.members = []
-        self.messages = []
+        self.created_at = created_at if created_at else datetime.datetime.now(datetime.UTC)
+        self.last_activity = to_epoch_micros(self.created_at)  # Bumped by the ChatStore on new messages
+        self.members: Dict[int, ChatMember] = {}  # normalized user_id -> ChatMember
+        self.messages = MessageLog(self.chat_id)  # Columnar; indexing yields Message views
+        self._unread_counts = {}  # int user_id -> number of unread messages
+        self._store = None  # Set by the ChatStore this chat is indexed in
+        # Bumped on every mutation (message, member joined, watermark moved); used by delta sync
+        self.revision = 0
+        self._member_changes = OrderedDict()  # user_id -> None, least recently changed first
+
+    def add_member(self, user_id, joined_at: Optional[datetime.datetime] = None) -> Optional[ChatMember]:
+        """
+        Adds a member in O(1). Returns the new ChatMember, or None if already a member.
+        `joined_at` is only passed when re-applying a logged join.
+        """
+        uid = normalize_user_id(user_id)
+        if uid is None:
+            raise ValueError(f"Invalid user id: {user_id!r}")
+        if uid in self.members:
+            return None
+
+        member = ChatMember(uid, self.chat_id)
+        if joined_at is not None:
+            member.joined_at = joined_at
+        self.members[uid] = member
+        # Anything already in the chat that someone else sent is unread for the newcomer
+        self._unread_counts[uid] = sum(
+            1 for position in range(len(self.messages))
+            if self.messages.sender_at(position) != uid
+        )
+        self._member_changed(member)
+        if self._store is not None:
+            self._store._on_member_added(self, uid)
+        return member
+
+    # --- Restoring persisted state (no store notifications) ---
+
+    def restore_member(self, user_id: int, joined_at: datetime.datetime, last_read_seq: int = 0,
+                       last_read_message_id: Optional[str] = None,
+                       last_read_at: Optional[datetime.datetime] = None) -> ChatMember:
+        member = ChatMember(user_id, self.chat_id)
+        member.joined_at = joined_at
+        member.last_read_seq = last_read_seq
+        member.last_read_message_id = last_read_message_id
+        member.last_read_at = last_read_at
+        self.members[member.user_id] = member
+        self._member_changes[member.user_id] = None
+        return member
+
+    def finish_restore(self, unread_counts: Optional[Dict[int, int]] = None):
+        """
+        Rebuild derived state once members and messages are restored: unread
+        counters (unless a snapshot already carries them), last activity and
+        revisions. Revisions restart from the current epoch microseconds, so
+        they are higher than anything a client saw before the restart and its
+        next sync re-sends member state.
+        """
+        if unread_counts is not None:
+            self._unread_counts = dict(unread_counts)
+        else:
+            own_after_watermark = {uid: 0 for uid in self.members}
+            for position in range(len(self.messages)):
+                sender = self.messages.sender_at(position)
+                member = self.members.get(sender)
+                if member is not None and position >= member.last_read_seq:
+                    own_after_watermark[sender] += 1
+            for uid, member in self.members.items():
+                self._unread_counts[uid] = (self.last_seq() - member.last_read_seq) - own_after_watermark[uid]
 
-    def add_member(self, user_id):
-        if user_id not in [m.user_id for m in self.members]:
-            member = ChatMember(user_id, self.chat_id)
-            self.members.append(member)
+        if self.messages:
+            self.last_activity = max(self.last_activity, self.messages.sent_at_micros(len(self.messages) - 1))
+        self.revision = to_epoch_micros(datetime.datetime.now(datetime.UTC))
+        for member in self.members.values():
+            member.revision = self.revision
+
+    def has_member(self, user_id) -> bool:
+        return normalize_user_id(user_id) in self.members
+
+    def member_ids(self) -> List[int]:
+        return list(self.members)
+
+    def _member_changed(self, member: ChatMember):
+        """Stamp a member with a new revision and move it to the end of the change order."""
+        self.revision += 1
+        member.revision = self.revision
+        self._member_changes.pop(member.user_id, None)
+        self._member_changes[member.user_id] = None
 
     def add_message(self, sender_id, text):
-        msg = Message(self.chat_id, sender_id, text)
-        self.messages.append(msg)
+        return self._message_added(self.messages.append(sender_id, text))
+
+    def replay_message(self, message_id: str, sender_id, text: str, sent_at: datetime.datetime) -> Message:
+        """Re-applies a logged message with its original id and timestamp, notifying the store like add_message."""
+        return self._message_added(self.messages.restore(message_id, sender_id, text, sent_at))
+
+    def _message_added(self, msg: Message) -> Message:
+        self.revision += 1
+
+        sender = msg.sender_id
+        for uid in self._unread_counts:
+            if uid != sender:
+                self._unread_counts[uid] += 1
+        if self._store is not None:
+            self._store._on_message_added(self, msg)
         return msg
 
     def get_member(self, user_id: str) -> Optional[ChatMember]:
         """Get a specific member by user ID"""
-        return next((m for m in self.members if m.user_id == user_id), None)
+        return self.members.get(normalize_user_id(user_id))
+
+    def mark_read_up_to(self, user_id: str, seq: int) -> bool:
+        """
+        Move the member's read watermark forward to `seq`: every message with
+        a sequence number <= seq counts as seen by this user.
+        Returns True if the watermark moved, False otherwise.
+        """
+        member = self.get_member(user_id)
+        seq = min(seq, self.last_seq())
+        if not member or seq <= member.last_read_seq:
+            return False
+
+        uid = member.user_id
+        if seq == self.last_seq():
+            self._unread_counts[uid] = 0
+        else:
+            # Only the messages between the old and new watermark need recounting
+            newly_read = sum(
+                1 for position in range(member.last_read_seq, seq)
+                if self.messages.sender_at(position) != uid
+            )
+            self._unread_counts[uid] = max(0, self._unread_counts.get(uid, 0) - newly_read)
+
+        last_read = self.messages[seq - 1]
+        member.mark_as_read(last_read.message_id, last_read.seq)
+        self._member_changed(member)
+        if self._store is not None:
+            self._store._on_read(self, member)
+        return True
 
     def mark_message_seen(self, user_id: str, message: Message):
         """
-        Mark a single message as seen by user.
-        Returns True if newly marked, False if already present.
+        Mark a message (and everything before it) as seen by user.
+        Returns True if newly marked, False if already seen.
         """
-        if user_id == message.sender_id:
+        if int(user_id) == int(message.sender_id):
             return False  # sender doesn't count
-        if user_id not in message.seen_by:
-            message.seen_by.append(int(user_id))
-            return True
-        return False
+        return self.mark_read_up_to(user_id, message.seq)
     
-    def mark_all_as_seen(self, user_id: str):
+    def mark_all_as_seen(self, user_id: str) -> Optional[Message]:
+        """
+        Mark all current messages in chat as seen by this user in O(1).
+        Returns the newest message if the watermark moved, None otherwise.
+        """
+        if self.mark_read_up_to(user_id, self.last_seq()):
+            return self.get_last_message()
+        return None
+
+    def read_watermarks(self) -> tuple:
         """
-        Mark all current messages in chat as seen by this user.
-        Returns list of messages newly marked.
+        (seqs, user_ids): every member's read watermark in ascending order,
+        with the member it belongs to. Build it once per page and pass it to
+        message_to_dict, so each message's seenBy is a bisect and a slice
+        instead of a scan of all members.
         """
-        newly_seen = []
-        for msg in self.messages:
-            if self.mark_message_seen(user_id, msg):
-                newly_seen.append(msg)
-        return newly_seen
+        ordered = sorted(self.members.values(), key=lambda m: m.last_read_seq)
+        return [m.last_read_seq for m in ordered], [m.user_id for m in ordered]
+
+    def seen_by(self, message: Message, watermarks: Optional[tuple] = None) -> List[int]:
+        """Derive who has seen a message from the sender and the members' read watermarks."""
+        seqs, user_ids = watermarks if watermarks is not None else self.read_watermarks()
+        sender = int(message.sender_id)
+        return [sender] + [uid for uid in user_ids[bisect_left(seqs, message.seq):] if uid != sender]
+
+    def message_to_dict(self, message: Message, watermarks: Optional[tuple] = None) -> dict:
+        """Serialize a message together with its derived seenBy list (see read_watermarks)."""
+        msg_dict = message.to_dict()
+        msg_dict["seenBy"] = self.seen_by(message, watermarks)
+        return msg_dict
 
     def get_unread_count(self, user_id: str) -> int:
         """
-        Count how many messages in this chat:
-          - were not sent by `user_id`, and
-          - have not yet been seen by `user_id`.
+        How many messages in this chat were sent by someone else and are
+        past `user_id`'s read watermark. Maintained incrementally by
+        add_message and mark_read_up_to, so this is O(1).
         """
-        count = 0
-        for msg in self.messages:
-            # skip messages I sent
-            if msg.sender_id == int(user_id):
-                continue
-            # if my ID is not yet in seen_by, it’s unread
-            if int(user_id) not in msg.seen_by and str(user_id) not in msg.seen_by:
-                count += 1
-        return count
+        return self._unread_counts.get(normalize_user_id(user_id), 0)
 
     def get_last_message(self) -> Optional[Message]:
         """Get the last message in the chat"""
         return self.messages[-1] if self.messages else None
 
     def get_members(self):
-        return [m.to_dict() for m in self.members]
+        return [m.to_dict() for m in self.members.values()]
+
+    def page_bounds(self, before: Optional[int] = None, after: Optional[int] = None,
+                    limit: Optional[int] = None) -> tuple:
+        """
+        Translate a sequence-number cursor into [start, end) positions.
+          - after=S: messages with seq > S, oldest first (the `limit` right after S)
+          - before=S: messages with seq < S (the `limit` right before S)
+          - neither: the latest `limit` messages (everything if no limit)
+        """
+        start = max(0, after) if after is not None else 0
+        end = len(self.messages)
+        if before is not None:
+            end = max(0, min(end, before - 1))
+        start = min(start, end)
+        if limit is not None:
+            if after is not None:
+                end = min(end, start + limit)
+            else:
+                start = max(start, end - limit)
+        return start, end
 
-    def get_messages(self):
-        return [m.to_dict() for m in self.messages]
+    def get_messages(self, before: Optional[int] = None, after: Optional[int] = None,
+                     limit: Optional[int] = None):
+        """Serialize a page of history in O(page size); see page_bounds for the cursor semantics."""
+        start, end = self.page_bounds(before, after, limit)
+        watermarks = self.read_watermarks()
+        return [self.message_to_dict(m, watermarks) for m in self.messages[start:end]]
     
-    def get_message_by_id(self, messageId):
-        for msg in self.messages:
-            if msg.message_id == messageId:
-                return msg
+    def changes_since(self, user_id, last_seq: Optional[int] = None, revision: int = 0,
+                      limit: Optional[int] = None) -> dict:
+        """
+        Everything a client at (last_seq, revision) is missing: messages with
+        seq > last_seq (at most `limit`, oldest first) and members that joined
+        or moved their read watermark after `revision`. Without a last_seq the
+        latest `limit` messages are returned. Cost is O(changes).
+        """
+        start, end = self.page_bounds(after=last_seq, limit=limit)
+
+        changed_members = []
+        for uid in reversed(self._member_changes):
+            member = self.members[uid]
+            if member.revision <= revision:
+                break
+            changed_members.append(member.to_dict())
+        changed_members.reverse()
+        watermarks = self.read_watermarks()
+
+        return {
+            "chat": self.to_dict(user_id),
+            "revision": self.revision,
+            "messages": [self.message_to_dict(m, watermarks) for m in self.messages[start:end]],
+            "hasMoreBefore": start > 0 and last_seq is None,
+            "hasMoreAfter": end < self.last_seq(),
+            "members": changed_members,
+        }
+
+    def get_message_by_id(self, messageId) -> Optional[Message]:
+        position = self.messages.position_of(messageId)
+        return self.messages[position] if position is not None else None
+
+    def get_message_by_seq(self, seq: int) -> Optional[Message]:
+        """Messages are numbered 1..N in send order, so seq maps straight to a position."""
+        if not isinstance(seq, int) or seq < 1 or seq > len(self.messages):
+            return None
+        return self.messages[seq - 1]
+
+    def last_seq(self) -> int:
+        return len(self.messages)
 
     def to_dict(self, user_id: str = None):
         """Convert to dict with optional unread count for specific user"""
@@ -92,13 +293,14 @@ class Chat:
             "chatId": self.chat_id,
             "name": self.name,
             "chatType": self.chat_type.value,
-            "createdAt": self.created_at.isoformat()
+            "createdAt": self.created_at.isoformat(),
+            "lastActivity": self.last_activity
         }
         
         if user_id:
             base_dict["unreadCount"] = self.get_unread_count(user_id)
             last_message = self.get_last_message()
             if last_message:
-                base_dict["lastMessage"] = last_message.to_dict()
+                base_dict["lastMessage"] = self.message_to_dict(last_message)
         
         return base_dict
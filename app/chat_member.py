@@ -7,11 +7,14 @@ class ChatMember:
         self.chat_id = chat_id
         self.joined_at = datetime.datetime.now(datetime.UTC)
         self.last_read_message_id: Optional[str] = None
+        self.last_read_seq: int = 0  # Read watermark: every message with seq <= this is read
         self.last_read_at: Optional[datetime.datetime] = None
+        self.revision: int = 0  # Chat revision at which this member last changed
 
-    def mark_as_read(self, message_id: str):
-        """Mark messages as read up to the given message ID"""
+    def mark_as_read(self, message_id: str, seq: int):
+        """Mark messages as read up to the given message ID / sequence number"""
         self.last_read_message_id = message_id
+        self.last_read_seq = seq
         self.last_read_at = datetime.datetime.now(datetime.UTC)
 
     def to_dict(self):
@@ -20,5 +23,6 @@ class ChatMember:
             "chatId": self.chat_id,
             "joinedAt": self.joined_at.isoformat(),
             "lastReadMessageId": self.last_read_message_id,
+            "lastReadSeq": self.last_read_seq,
             "lastReadAt": self.last_read_at.isoformat() if self.last_read_at else None
         }
\ No newline at end of file
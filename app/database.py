@@ -1,20 +1,510 @@
 from collections import defaultdict
-from app.chat import Chat, ChatType
+from sortedcontainers import SortedList
+from app.chat import Chat, ChatType, normalize_user_id
 from app.message import Message
 from app.user import User, Role
 from app.friendship import Friendship
 from app.friendrequest import FriendRequest, RequestStatus
+from app.sequence import IdSequence
+from app.search import UserSearchIndex
+import atexit
 import datetime
 
-users = []
-friendships = []
-friendrequests = []
-chats = {}
-user_chats = defaultdict(list)
-one_on_one_index = {}  # (user1_id, user2_id) -> chat_id
-
-def get_user_pair_key(user1_id, user2_id):
-    return tuple(sorted([str(user1_id), str(user2_id)]))  # Always in the same order
+# Objects notified of every store mutation (e.g. a persistence backend). An
+# observer implements whichever of these methods it cares about:
+#   user_saved(user), user_deleted(user),
+#   friendship_saved(friendship), friendship_deleted(friendship),
+#   friend_request_saved(request), friend_request_deleted(request),
+#   chat_created(chat), member_saved(chat, member), message_added(chat, message)
+_observers = []
+
+def add_observer(observer):
+    _observers.append(observer)
+
+def remove_observer(observer):
+    if observer in _observers:
+        _observers.remove(observer)
+
+def _notify(event: str, *args):
+    for observer in _observers:
+        handler = getattr(observer, event, None)
+        if handler is not None:
+            handler(*args)
+
+
+class UserStore:
+    """
+    In-memory user storage with hash indexes by id, username and email.
+    Usernames and emails are indexed case-folded, so lookups stay
+    case-insensitive while costing O(1) regardless of the number of users.
+    Names and usernames are also kept in a UserSearchIndex for typeahead.
+    """
+
+    def __init__(self):
+        self._by_id: dict[int, User] = {}
+        self._by_username: dict[str, User] = {}
+        self._by_email: dict[str, User] = {}
+        self.search_index = UserSearchIndex()
+
+    @staticmethod
+    def _fold(value: str) -> str:
+        return value.casefold()
+
+    def add(self, user: User):
+        """Adds a user to the store. Raises ValueError on a duplicate id, username or email."""
+        username_key = self._fold(user.username)
+        email_key = self._fold(user.email)
+        if user.userId in self._by_id:
+            raise ValueError(f"User with ID {user.userId} already exists.")
+        if username_key in self._by_username:
+            raise ValueError(f"Username '{user.username}' already exists.")
+        if email_key in self._by_email:
+            raise ValueError(f"Email '{user.email}' already registered.")
+
+        self._by_id[user.userId] = user
+        self._by_username[username_key] = user
+        self._by_email[email_key] = user
+        self.search_index.add(user.userId, user.username, user.name)
+        _notify("user_saved", user)
+
+    def remove(self, user: User):
+        """Removes a user and all of its index entries."""
+        if self._by_id.pop(user.userId, None) is None:
+            return
+        self._by_username.pop(self._fold(user.username), None)
+        self._by_email.pop(self._fold(user.email), None)
+        self.search_index.remove(user.userId)
+        _notify("user_deleted", user)
+
+    def rename(self, user: User, new_name: str):
+        """Changes the display name of a user, keeping the store consistent."""
+        user.name = new_name
+        self.search_index.add(user.userId, user.username, new_name)
+        _notify("user_saved", user)
+
+    def update(self, user: User):
+        """Call after changing non-indexed fields (status, password) so observers see the change."""
+        _notify("user_saved", user)
+
+    def get_by_id(self, user_id: int) -> User | None:
+        return self._by_id.get(user_id)
+
+    def get_by_username(self, username: str) -> User | None:
+        return self._by_username.get(self._fold(username))
+
+    def get_by_email(self, email: str) -> User | None:
+        return self._by_email.get(self._fold(email))
+
+    def clear(self):
+        self._by_id.clear()
+        self._by_username.clear()
+        self._by_email.clear()
+        self.search_index.clear()
+
+    def __iter__(self):
+        return iter(list(self._by_id.values()))
+
+    def __len__(self):
+        return len(self._by_id)
+
+    def __contains__(self, user_id: int) -> bool:
+        return user_id in self._by_id
+
+
+class FriendshipStore:
+    """
+    In-memory friendship storage kept as an adjacency structure:
+    user id -> set of friend ids, plus (min id, max id) -> Friendship.
+    Friend checks are O(1) and listing friends is O(degree).
+    """
+
+    def __init__(self):
+        self._by_pair: dict[tuple[int, int], Friendship] = {}
+        self._adjacency: dict[int, set[int]] = defaultdict(set)
+
+    @staticmethod
+    def _pair(user1_id: int, user2_id: int) -> tuple[int, int]:
+        return (min(user1_id, user2_id), max(user1_id, user2_id))
+
+    def add(self, friendship: Friendship):
+        """Adds a friendship. Raises ValueError if the two users are already friends."""
+        key = self._pair(friendship.user1Id, friendship.user2Id)
+        if key in self._by_pair:
+            raise ValueError(f"Users {key[0]} and {key[1]} are already friends.")
+        self._by_pair[key] = friendship
+        self._adjacency[friendship.user1Id].add(friendship.user2Id)
+        self._adjacency[friendship.user2Id].add(friendship.user1Id)
+        _notify("friendship_saved", friendship)
+
+    def remove(self, friendship: Friendship):
+        key = self._pair(friendship.user1Id, friendship.user2Id)
+        if self._by_pair.pop(key, None) is None:
+            return
+        self._discard_edge(friendship.user1Id, friendship.user2Id)
+        self._discard_edge(friendship.user2Id, friendship.user1Id)
+        _notify("friendship_deleted", friendship)
+
+    def _discard_edge(self, user_id: int, friend_id: int):
+        friend_ids = self._adjacency.get(user_id)
+        if friend_ids is not None:
+            friend_ids.discard(friend_id)
+            if not friend_ids:
+                del self._adjacency[user_id]
+
+    def remove_user(self, user_id: int):
+        """Removes every friendship involving the given user in O(degree)."""
+        for friend_id in list(self._adjacency.get(user_id, ())):
+            self.remove(self._by_pair[self._pair(user_id, friend_id)])
+
+    def find(self, user1_id: int, user2_id: int) -> Friendship | None:
+        return self._by_pair.get(self._pair(user1_id, user2_id))
+
+    def are_friends(self, user1_id: int, user2_id: int) -> bool:
+        return self._pair(user1_id, user2_id) in self._by_pair
+
+    def friend_ids(self, user_id: int) -> set[int]:
+        """Returns a copy of the set of friend ids for a user."""
+        return set(self._adjacency.get(user_id, ()))
+
+    def clear(self):
+        self._by_pair.clear()
+        self._adjacency.clear()
+
+    def __iter__(self):
+        return iter(list(self._by_pair.values()))
+
+    def __len__(self):
+        return len(self._by_pair)
+
+
+class FriendRequestStore:
+    """
+    In-memory friend request storage indexed by id, by unordered user pair
+    for PENDING requests, and by receiver/sender with per-status buckets.
+    Requests notify the store when their status changes (accept, reject,
+    cancel), so pending checks are O(1) and inbox listings are O(k).
+    """
+
+    def __init__(self):
+        self._by_id: dict[int, FriendRequest] = {}
+        self._pending_by_pair: dict[tuple[int, int], FriendRequest] = {}
+        # user id -> status -> {requestId: FriendRequest}, insertion ordered
+        self._by_receiver = defaultdict(lambda: defaultdict(dict))
+        self._by_sender = defaultdict(lambda: defaultdict(dict))
+
+    @staticmethod
+    def _pair(user1_id: int, user2_id: int) -> tuple[int, int]:
+        return (min(user1_id, user2_id), max(user1_id, user2_id))
+
+    def add(self, friend_request: FriendRequest):
+        """Adds a request. Raises ValueError on a duplicate id or a second PENDING request for a pair."""
+        if friend_request.requestId in self._by_id:
+            raise ValueError(f"Friend request with ID {friend_request.requestId} already exists.")
+        pair = self._pair(friend_request.senderId, friend_request.receiverId)
+        if friend_request.status == RequestStatus.PENDING and pair in self._pending_by_pair:
+            raise ValueError("A pending friend request already exists between these users.")
+
+        self._by_id[friend_request.requestId] = friend_request
+        self._index(friend_request, friend_request.status)
+        friend_request._store = self
+        _notify("friend_request_saved", friend_request)
+
+    def remove(self, friend_request: FriendRequest):
+        if self._by_id.pop(friend_request.requestId, None) is None:
+            return
+        self._unindex(friend_request, friend_request.status)
+        friend_request._store = None
+        _notify("friend_request_deleted", friend_request)
+
+    def remove_user(self, user_id: int):
+        """Removes every request sent or received by the given user."""
+        to_remove = []
+        for buckets in (self._by_receiver.get(user_id, {}), self._by_sender.get(user_id, {})):
+            for bucket in buckets.values():
+                to_remove.extend(bucket.values())
+        for friend_request in to_remove:
+            self.remove(friend_request)
+
+    def _index(self, friend_request: FriendRequest, status: RequestStatus):
+        if status == RequestStatus.PENDING:
+            pair = self._pair(friend_request.senderId, friend_request.receiverId)
+            self._pending_by_pair[pair] = friend_request
+        self._by_receiver[friend_request.receiverId][status][friend_request.requestId] = friend_request
+        self._by_sender[friend_request.senderId][status][friend_request.requestId] = friend_request
+
+    def _unindex(self, friend_request: FriendRequest, status: RequestStatus):
+        if status == RequestStatus.PENDING:
+            pair = self._pair(friend_request.senderId, friend_request.receiverId)
+            if self._pending_by_pair.get(pair) is friend_request:
+                del self._pending_by_pair[pair]
+        for index, user_id in ((self._by_receiver, friend_request.receiverId),
+                               (self._by_sender, friend_request.senderId)):
+            buckets = index.get(user_id)
+            if buckets is None:
+                continue
+            bucket = buckets.get(status)
+            if bucket is not None:
+                bucket.pop(friend_request.requestId, None)
+                if not bucket:
+                    del buckets[status]
+            if not buckets:
+                del index[user_id]
+
+    def _on_status_change(self, friend_request: FriendRequest, old_status: RequestStatus):
+        """Called by FriendRequest when its status changes."""
+        self._unindex(friend_request, old_status)
+        self._index(friend_request, friend_request.status)
+        _notify("friend_request_saved", friend_request)
+
+    def get_by_id(self, request_id: int) -> FriendRequest | None:
+        return self._by_id.get(request_id)
+
+    def find_pending(self, user1_id: int, user2_id: int) -> FriendRequest | None:
+        return self._pending_by_pair.get(self._pair(user1_id, user2_id))
+
+    def incoming(self, user_id: int, status: RequestStatus = RequestStatus.PENDING) -> list[FriendRequest]:
+        """Requests received by a user with the given status, oldest first."""
+        buckets = self._by_receiver.get(user_id)
+        return list(buckets.get(status, {}).values()) if buckets else []
+
+    def outgoing(self, user_id: int, status: RequestStatus = RequestStatus.PENDING) -> list[FriendRequest]:
+        """Requests sent by a user with the given status, oldest first."""
+        buckets = self._by_sender.get(user_id)
+        return list(buckets.get(status, {}).values()) if buckets else []
+
+    def clear(self):
+        for friend_request in self._by_id.values():
+            friend_request._store = None
+        self._by_id.clear()
+        self._pending_by_pair.clear()
+        self._by_receiver.clear()
+        self._by_sender.clear()
+
+    def __iter__(self):
+        return iter(list(self._by_id.values()))
+
+    def __len__(self):
+        return len(self._by_id)
+
+
+class ChatStore:
+    """
+    In-memory chat storage and the single authoritative user -> chat ids index.
+    Chats notify the store when members join, so the index never drifts from
+    the real membership. One-on-one chats are also indexed by their user pair.
+
+    Each user also gets a materialized inbox: a sorted list of
+    (last_activity, chat_id) updated in O(log n) whenever a message is added,
+    so the most recently active chats can be paged without sorting.
+    """
+
+    def __init__(self):
+        self._by_id: dict[str, Chat] = {}
+        self._by_user: dict[int, set[str]] = defaultdict(set)
+        self._one_on_one: dict[tuple[int, int], str] = {}
+        self._inbox: dict[int, SortedList] = {}  # user id -> (last_activity, chat_id), ascending
+        self._activity_clock = 0  # Strictly increasing epoch micros handed out as last_activity
+        self._member_listeners = []  # callables (chat, user_id) run when someone joins a chat
+
+    def add_member_listener(self, listener):
+        """Registers a callable invoked as listener(chat, user_id) for every member that joins a stored chat."""
+        self._member_listeners.append(listener)
+
+    @staticmethod
+    def _pair(user1_id, user2_id) -> tuple[int, int]:
+        u1, u2 = normalize_user_id(user1_id), normalize_user_id(user2_id)
+        return (min(u1, u2), max(u1, u2))
+
+    def add(self, chat: Chat):
+        """Adds a chat and indexes all of its current members."""
+        if chat.chat_id in self._by_id:
+            raise ValueError(f"Chat with ID {chat.chat_id} already exists.")
+        self._by_id[chat.chat_id] = chat
+        chat._store = self
+        self._activity_clock = max(self._activity_clock, chat.last_activity)
+        _notify("chat_created", chat)
+        for user_id in chat.member_ids():
+            self._on_member_added(chat, user_id)
+
+    def _on_member_added(self, chat: Chat, user_id: int):
+        """Called by Chat.add_member for chats owned by this store."""
+        self._by_user[user_id].add(chat.chat_id)
+        self._inbox.setdefault(user_id, SortedList()).add((chat.last_activity, chat.chat_id))
+        if chat.chat_type == ChatType.ONE_ON_ONE and len(chat.members) == 2:
+            self._one_on_one[self._pair(*chat.member_ids())] = chat.chat_id
+        _notify("member_saved", chat, chat.members[user_id])
+        for listener in self._member_listeners:
+            listener(chat, user_id)
+
+    def _on_read(self, chat: Chat, member):
+        """Called by Chat.mark_read_up_to when a member's read watermark moves."""
+        _notify("member_saved", chat, member)
+
+    def _next_activity(self, at: int) -> int:
+        """`at` (epoch micros), or just past the last value handed out if the clock has passed it."""
+        self._activity_clock = max(at, self._activity_clock + 1)
+        return self._activity_clock
+
+    def _on_message_added(self, chat: Chat, message: Message):
+        """
+        Called by Chat.add_message / replay_message: moves the chat to the top
+        of every member's inbox. Activity follows the message's own send
+        time, so replaying logged messages restores the original order.
+        """
+        old_key = (chat.last_activity, chat.chat_id)
+        chat.last_activity = self._next_activity(chat.messages.sent_at_micros(message.seq - 1))
+        new_key = (chat.last_activity, chat.chat_id)
+        for user_id in chat.member_ids():
+            inbox = self._inbox[user_id]
+            inbox.discard(old_key)
+            inbox.add(new_key)
+        _notify("message_added", chat, message)
+
+    def get(self, chat_id: str) -> Chat | None:
+        return self._by_id.get(chat_id)
+
+    def find_one_on_one(self, user1_id, user2_id) -> Chat | None:
+        chat_id = self._one_on_one.get(self._pair(user1_id, user2_id))
+        return self._by_id.get(chat_id) if chat_id else None
+
+    def chat_ids_for_user(self, user_id) -> set[str]:
+        """Returns a copy of the ids of the chats a user belongs to, in O(own chats)."""
+        return set(self._by_user.get(normalize_user_id(user_id), ()))
+
+    def chats_for_user(self, user_id) -> list[Chat]:
+        return [self._by_id[chat_id] for chat_id in self._by_user.get(normalize_user_id(user_id), ())]
+
+    def recent_chats_for_user(self, user_id, limit: int | None = None,
+                              before: tuple[int, str] | None = None) -> tuple[list[Chat], tuple[int, str] | None]:
+        """
+        A page of the user's chats, most recently active first.
+        `before` is the (last_activity, chat_id) of the last chat already
+        seen; only chats ordered strictly below it are returned, so chats
+        sharing an activity value are neither skipped nor repeated. Also
+        returns the cursor for the next page (None on the last page). Costs
+        O(log n + limit).
+        """
+        inbox = self._inbox.get(normalize_user_id(user_id))
+        if not inbox:
+            return [], None
+        end = inbox.bisect_left(before) if before is not None else len(inbox)
+        start = 0 if limit is None else max(0, end - limit)
+        page = [self._by_id[chat_id] for _, chat_id in reversed(inbox[start:end])]
+        next_before = inbox[start] if start > 0 else None
+        return page, next_before
+
+    def sync_for_user(self, user_id, cursors: dict, limit: int | None = None) -> dict:
+        """
+        Delta sync for a reconnecting client. `cursors` maps chat ids the client
+        already knows to {"lastSeq": n, "revision": r} (a bare int is read as
+        lastSeq). Unchanged chats are skipped in O(1); changed chats report only
+        new messages and member/watermark changes; chats missing from `cursors`
+        are sent in full; known chats the user no longer belongs to are listed
+        in removedChats.
+        """
+        if not isinstance(cursors, dict):
+            raise ValueError("chats must map chat ids to sync cursors.")
+        uid = normalize_user_id(user_id)
+        chat_ids = self._by_user.get(uid, set())
+        changed = []
+        for chat_id in chat_ids:
+            chat = self._by_id[chat_id]
+            cursor = cursors.get(chat_id)
+            if cursor is None:
+                changed.append(chat.changes_since(uid, limit=limit))
+                continue
+            if isinstance(cursor, dict):
+                last_seq, revision = cursor.get("lastSeq", 0), cursor.get("revision", 0)
+            else:
+                last_seq, revision = cursor, 0
+            if not all(isinstance(value, int) and not isinstance(value, bool) for value in (last_seq, revision)):
+                raise ValueError(f"Invalid sync cursor for chat {chat_id}: lastSeq and revision must be integers.")
+            if revision == chat.revision:
+                continue
+            changed.append(chat.changes_since(uid, last_seq, revision, limit))
+
+        return {
+            "chats": changed,
+            "removedChats": [chat_id for chat_id in cursors if chat_id not in chat_ids],
+        }
+
+    def clear(self):
+        for chat in self._by_id.values():
+            chat._store = None
+        self._by_id.clear()
+        self._by_user.clear()
+        self._inbox.clear()
+        self._one_on_one.clear()
+
+    def values(self):
+        return list(self._by_id.values())
+
+    def __getitem__(self, chat_id: str) -> Chat:
+        return self._by_id[chat_id]
+
+    def __contains__(self, chat_id: str) -> bool:
+        return chat_id in self._by_id
+
+    def __iter__(self):
+        return iter(list(self._by_id))
+
+    def __len__(self):
+        return len(self._by_id)
+
+
+users = UserStore()
+friendships = FriendshipStore()
+friendrequests = FriendRequestStore()
+chats = ChatStore()
+
+user_ids = IdSequence("users")
+friendship_ids = IdSequence("friendships")
+friendrequest_ids = IdSequence("friendrequests")
+
+def parse_inbox_cursor(cursor: str) -> tuple[int, str]:
+    """
+    Reads a /get-chats nextBefore cursor, "last_activity:chat_id". A bare
+    last_activity (the older cursor format) pages from before that instant.
+    Raises ValueError if it is malformed.
+    """
+    activity, _, chat_id = cursor.partition(":")
+    return (int(activity), chat_id)
+
+def format_inbox_cursor(key: tuple[int, str]) -> str:
+    return "{}:{}".format(*key)
+
+def seed_id_sequences():
+    """Seeds the ID allocators from the data currently loaded. Run once at startup."""
+    user_ids.seed_from(users, "userId")
+    friendship_ids.seed_from(friendships, "friendshipId")
+    friendrequest_ids.seed_from(friendrequests, "requestId")
+
+def load_persisted_state(database_url: str, max_batch: int = 500, max_delay: float = 0.05):
+    """
+    Attaches the SQL persistence backend. An empty database is filled with the
+    seed data; otherwise the stores are rebuilt from it. Either way every
+    later mutation is written behind to the database, and IDs are drawn from
+    blocks reserved in the database so several processes never collide.
+    """
+    from app.persistence import SqlBackend
+
+    if not database_url:
+        raise ValueError("DATABASE_URL must be set when STORAGE_BACKEND is 'sql'.")
+
+    backend = SqlBackend(database_url, max_batch=max_batch, max_delay=max_delay)
+    if backend.is_empty():
+        add_observer(backend)
+        create_users()
+        create_friendships()
+        create_friend_requests()
+    else:
+        backend.load(users, friendships, friendrequests, chats)
+        add_observer(backend)
+
+    seed_id_sequences()
+    backend.bind_sequences(user_ids, friendship_ids, friendrequest_ids)
+    atexit.register(backend.close)
+    return backend
 
 def create_users():
     user1 = User(
@@ -85,13 +575,13 @@ def create_users():
         role=Role.ADMIN
     )
 
-    users.append(user1)
-    users.append(admin_user)
-    users.append(user2)
-    users.append(user3)
-    users.append(user4)
-    users.append(user5)
-    users.append(user6)
+    users.add(user1)
+    users.add(admin_user)
+    users.add(user2)
+    users.add(user3)
+    users.add(user4)
+    users.add(user5)
+    users.add(user6)
 
 def create_friendships():
 
@@ -118,9 +608,9 @@ def create_friendships():
     )
 
 
-    friendships.append(friendship1)
-    friendships.append(friendship2)
-    friendships.append(friendship3)
+    friendships.add(friendship1)
+    friendships.add(friendship2)
+    friendships.add(friendship3)
 
 def create_friend_requests():
      # Clear list before creating
@@ -169,42 +659,26 @@ def create_friend_requests():
     )
 
 
-    friendrequests.append(friendrequest1)
-    friendrequests.append(friendrequest2)
-    friendrequests.append(friendrequest3)
-    friendrequests.append(friendrequest4)
-    friendrequests.append(friendrequest5)
+    friendrequests.add(friendrequest1)
+    friendrequests.add(friendrequest2)
+    friendrequests.add(friendrequest3)
+    friendrequests.add(friendrequest4)
+    friendrequests.add(friendrequest5)
 
 def create_chats():
     chat = Chat(chat_type=ChatType.ONE_ON_ONE)
     chat.add_member(1)
     chat.add_member(2)
-
-    key = get_user_pair_key(1, 2)
-
-    chats[chat.chat_id] = chat
-    one_on_one_index[key] = chat.chat_id
+    chats.add(chat)
 
     print(chat.chat_id)
 
-    # user_chats[1].append(chat.chat_id)
-    # user_chats[2].append(chat.chat_id)
-    user_chats.setdefault("1", []).append(chat.chat_id)
-    user_chats.setdefault("2", []).append(chat.chat_id)
-
     chat.add_message(1, "Hello, world!")
 
     chat2 = Chat(chat_type=ChatType.ONE_ON_ONE)
     chat2.add_member(1)
     chat2.add_member(3)
-
-    key = get_user_pair_key(1, 3)
-
-    chats[chat2.chat_id] = chat2
-    one_on_one_index[key] = chat2.chat_id
-
-    user_chats.setdefault("1", []).append(chat2.chat_id)
-    user_chats.setdefault("3", []).append(chat2.chat_id)
+    chats.add(chat2)
 
     chat2.add_message(3, "Hello again, world!")
 
@@ -213,12 +687,7 @@ def create_chats():
     chat3.add_member(1)
     chat3.add_member(2)
     chat3.add_member(3)
-
-    chats[chat3.chat_id] = chat3
-
-    user_chats.setdefault("1", []).append(chat3.chat_id)
-    user_chats.setdefault("2", []).append(chat3.chat_id)
-    user_chats.setdefault("3", []).append(chat3.chat_id)
+    chats.add(chat3)
 
     chat3.add_message(1, "Hello group!")
     chat3.add_message(2, "Hello group again!")
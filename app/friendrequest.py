@@ -68,16 +68,30 @@ class FriendRequest:
         self.requestId: int = requestId
         self.senderId: int = senderId
         self.receiverId: int = receiverId
+        self._store = None # Set by the FriendRequestStore this request is indexed in
+        self._status: RequestStatus = RequestStatus.PENDING
 
         if isinstance(status, str):
-            self.status: RequestStatus = RequestStatus.from_string(status)
+            self.status = RequestStatus.from_string(status)
         elif isinstance(status, RequestStatus):
-            self.status: RequestStatus = status
+            self.status = status
         else:
             raise TypeError("status must be a RequestStatus enum instance or a valid status string.")
 
         self.createdAt: datetime.datetime = createdAt if createdAt else datetime.datetime.now()
 
+    @property
+    def status(self) -> RequestStatus:
+        return self._status
+
+    @status.setter
+    def status(self, new_status: RequestStatus):
+        """Updates the status and lets the owning store re-index the request."""
+        old_status = self._status
+        self._status = new_status
+        if self._store is not None and old_status != new_status:
+            self._store._on_status_change(self, old_status)
+
     def __str__(self) -> str:
         """User-friendly string representation."""
         return (f"FriendRequest(id={self.requestId}, sender={self.senderId}, "
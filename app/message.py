@@ -1,22 +1,26 @@
 import datetime
-from typing import List
+from typing import Optional
 import uuid
 
 class Message:
-    def __init__(self, chat_id, sender_id, text):
-        self.message_id = str(uuid.uuid4())
+    __slots__ = ("message_id", "chat_id", "seq", "sender_id", "text", "sent_at")
+
+    def __init__(self, chat_id, sender_id, text, seq: int = 0,
+                 message_id: Optional[str] = None,
+                 sent_at: Optional[datetime.datetime] = None):
+        self.message_id = message_id if message_id else str(uuid.uuid4())
         self.chat_id = chat_id
+        self.seq = seq  # Per-chat sequence number, starting at 1
         self.sender_id = sender_id
         self.text = text
-        self.sent_at = datetime.datetime.now(datetime.UTC)
-        self.seen_by: List[int] = []
+        self.sent_at = sent_at if sent_at else datetime.datetime.now(datetime.UTC)
 
     def to_dict(self):
         return {
             "messageId": self.message_id,
             "chatId": self.chat_id,
+            "seq": self.seq,
             "senderId": self.sender_id,
             "text": self.text,
             "sentAt": self.sent_at.isoformat(),
-            "seenBy": self.seen_by,
         }
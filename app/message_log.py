@@ -0,0 +1,232 @@
+import bisect
+import datetime
+import uuid
+from array import array
+from typing import Iterator, Optional
+
+from app.message import Message
+from app.message_segment import SealedSegment
+
+EPOCH = datetime.datetime(1970, 1, 1, tzinfo=datetime.UTC)
+
+def to_epoch_micros(moment: datetime.datetime) -> int:
+    """Exact conversion of an aware datetime to integer microseconds since the epoch."""
+    delta = moment - EPOCH
+    return (delta.days * 86_400 + delta.seconds) * 1_000_000 + delta.microseconds
+
+def from_epoch_micros(micros: int) -> datetime.datetime:
+    return EPOCH + datetime.timedelta(microseconds=micros)
+
+class MessageLog:
+    """
+    Columnar, append-only message storage for one chat.
+
+    Instead of one Python object per message, the log keeps parallel columns:
+    16-byte UUIDs in a bytearray, sender ids and epoch-microsecond timestamps
+    in int64 arrays, and all texts in one UTF-8 buffer addressed by an offsets
+    array. Indexing returns a freshly materialized Message view, so callers
+    can keep treating the log like a list of messages.
+
+    Older history can be sealed into read-only, memory-mapped segment files
+    (see app/message_segment.py); the in-memory columns then only hold the
+    messages after the last sealed one.
+
+    Message sequence numbers are 1-based positions in the log.
+    """
+
+    def __init__(self, chat_id: str):
+        self.chat_id = chat_id
+        self._segments: list[SealedSegment] = []  # sealed history, oldest first
+        self._segment_starts: list[int] = []      # first position of each segment, for bisect
+        self._sealed = 0                          # messages in segments = position of the first in-memory one
+        self._ids = bytearray()                # 16 bytes per message
+        self._sender_ids = array("q")
+        self._sent_at = array("q")             # epoch microseconds, UTC
+        self._text = bytearray()               # concatenated UTF-8 texts
+        self._text_offsets = array("Q", [0])   # in-memory message i spans [off[i], off[i+1])
+        self._positions: dict[int, int] = {}   # UUID as int -> position, in-memory messages only
+
+    def append(self, sender_id, text: str) -> Message:
+        """Appends a new message and returns its view."""
+        return self._append(uuid.uuid4(), sender_id, text, datetime.datetime.now(datetime.UTC))
+
+    def restore(self, message_id: str, sender_id, text: str, sent_at: datetime.datetime) -> Message:
+        """Appends a previously persisted message, keeping its id and timestamp."""
+        return self._append(uuid.UUID(message_id), sender_id, text, sent_at)
+
+    def _append(self, message_uuid: uuid.UUID, sender_id, text: str, sent_at: datetime.datetime) -> Message:
+        """Raises ValueError for a non-string text. A message that fails to convert leaves the log untouched."""
+        text = "" if text is None else text
+        if not isinstance(text, str):
+            raise ValueError("Message text must be a string.")
+        # Convert everything that can fail first, so a bad message never leaves the columns out of step
+        encoded = text.encode("utf-8")
+        sender = int(sender_id)
+        sent_micros = to_epoch_micros(sent_at)
+        position = self._sealed + len(self._sender_ids)
+
+        self._ids += message_uuid.bytes
+        self._sender_ids.append(sender)
+        self._sent_at.append(sent_micros)
+        self._text += encoded
+        self._text_offsets.append(len(self._text))
+        self._positions[message_uuid.int] = position
+
+        return Message(self.chat_id, sender, text, seq=position + 1,
+                       message_id=str(message_uuid), sent_at=sent_at)
+
+    # --- Sealing ---
+
+    @property
+    def sealed_count(self) -> int:
+        return self._sealed
+
+    def unsealed_count(self) -> int:
+        return len(self._sender_ids)
+
+    def segment_paths(self) -> list:
+        return [segment.path for segment in self._segments]
+
+    def columns(self) -> tuple:
+        """
+        Copies of the in-memory columns (ids, sender ids, sent_at, text, text
+        offsets) as bytes, for snapshots and for writing a segment.
+        """
+        return (bytes(self._ids), self._sender_ids.tobytes(), self._sent_at.tobytes(),
+                bytes(self._text), self._text_offsets.tobytes())
+
+    def seal(self, path: str, count: int):
+        """
+        Swaps the first `count` in-memory messages for the segment at `path`,
+        written from columns() while those were the first in-memory rows.
+        Messages appended in the meantime stay in memory.
+        """
+        segment = SealedSegment(path)
+        if segment.first_position != self._sealed or segment.count != count or count > len(self._sender_ids):
+            raise ValueError(f"Segment {path} does not start the in-memory part of chat {self.chat_id}.")
+
+        for i in range(count):
+            del self._positions[int.from_bytes(self._ids[i * 16:i * 16 + 16], "big")]
+        text_cut = self._text_offsets[count]
+        # Slicing into new buffers (rather than deleting in place) hands the sealed part's memory back
+        self._ids = bytearray(self._ids[count * 16:])
+        self._sender_ids = self._sender_ids[count:]
+        self._sent_at = self._sent_at[count:]
+        self._text = bytearray(self._text[text_cut:])
+        self._text_offsets = array("Q", (offset - text_cut for offset in self._text_offsets[count:]))
+
+        self._segments.append(segment)
+        self._segment_starts.append(segment.first_position)
+        self._sealed += count
+
+    def _attach_segments(self, paths):
+        for path in paths:
+            segment = SealedSegment(path)
+            if segment.first_position != self._sealed:
+                raise ValueError(f"Segment {path} does not continue the history of chat {self.chat_id}.")
+            self._segments.append(segment)
+            self._segment_starts.append(segment.first_position)
+            self._sealed += segment.count
+
+    @classmethod
+    def from_columns(cls, chat_id: str, ids: bytes, sender_ids: bytes, sent_at: bytes,
+                     text: bytes, text_offsets: bytes, segment_paths=()) -> 'MessageLog':
+        """
+        Rebuilds a log from segment_paths() and columns(): the segments are
+        mapped again, the rest is a few memcpys plus the id -> position index.
+        """
+        log = cls(chat_id)
+        log._attach_segments(segment_paths)
+        log._ids = bytearray(ids)
+        log._sender_ids.frombytes(sender_ids)
+        log._sent_at.frombytes(sent_at)
+        log._text = bytearray(text)
+        log._text_offsets = array("Q")
+        log._text_offsets.frombytes(text_offsets)
+        from_bytes, base = int.from_bytes, log._sealed
+        log._positions = {from_bytes(ids[i:i + 16], "big"): base + (i >> 4) for i in range(0, len(ids), 16)}
+        return log
+
+    def _segment_for(self, position: int) -> tuple:
+        """(segment, index within it) for a sealed position."""
+        segment = self._segments[bisect.bisect_right(self._segment_starts, position) - 1]
+        return segment, position - segment.first_position
+
+    # --- Reading ---
+
+    def position_of(self, message_id: str) -> Optional[int]:
+        """Returns the 0-based position of a message id, or None if unknown."""
+        try:
+            message_uuid = uuid.UUID(message_id)
+        except (ValueError, TypeError, AttributeError):
+            return None
+        position = self._positions.get(message_uuid.int)
+        if position is None:
+            for segment in reversed(self._segments):
+                index = segment.find(message_uuid.bytes)
+                if index is not None:
+                    return segment.first_position + index
+        return position
+
+    def sender_at(self, position: int) -> int:
+        """Reads a single column value without materializing the message."""
+        if position >= self._sealed:
+            return self._sender_ids[position - self._sealed]
+        segment, index = self._segment_for(position)
+        return segment.sender_at(index)
+
+    def sent_at_micros(self, position: int) -> int:
+        if position >= self._sealed:
+            return self._sent_at[position - self._sealed]
+        segment, index = self._segment_for(position)
+        return segment.sent_at_micros(index)
+
+    def text_at(self, position: int) -> str:
+        if position >= self._sealed:
+            row = position - self._sealed
+            return self._text[self._text_offsets[row]:self._text_offsets[row + 1]].decode("utf-8")
+        segment, index = self._segment_for(position)
+        return segment.text(index)
+
+    def _materialize(self, position: int) -> Message:
+        if position < self._sealed:
+            segment, index = self._segment_for(position)
+            id_bytes, sender_id, sent_at, text = segment.row(index)
+            return Message(
+                self.chat_id,
+                sender_id,
+                text,
+                seq=position + 1,
+                message_id=str(uuid.UUID(bytes=id_bytes)),
+                sent_at=from_epoch_micros(sent_at),
+            )
+
+        row = position - self._sealed
+        start, end = self._text_offsets[row], self._text_offsets[row + 1]
+        return Message(
+            self.chat_id,
+            self._sender_ids[row],
+            self._text[start:end].decode("utf-8"),
+            seq=position + 1,
+            message_id=str(uuid.UUID(bytes=bytes(self._ids[row * 16:row * 16 + 16]))),
+            sent_at=from_epoch_micros(self._sent_at[row]),
+        )
+
+    def __len__(self) -> int:
+        return self._sealed + len(self._sender_ids)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self._materialize(i) for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if index < 0 or index >= len(self):
+            raise IndexError("message index out of range")
+        return self._materialize(index)
+
+    def __iter__(self) -> Iterator[Message]:
+        for position in range(len(self)):
+            yield self._materialize(position)
+
+    def __bool__(self) -> bool:
+        return len(self) > 0
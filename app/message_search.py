@@ -0,0 +1,168 @@
+"""
+Full-text search over chat history.
+
+MessageSearchIndex keeps one inverted index per chat, mapping each
+case-folded word to the ascending sequence numbers of the messages that
+contain it. Per-chat indexes make scoping a search to the caller's chats
+free, and their hits are already (chat id, seq) pairs that a client can
+open with /get-messages.
+
+A chat is indexed the first time it is searched, and from then on every new
+message is added as it is sent (the index is a store observer). Chats that
+have not been searched for a while are dropped once more than `max_chats`
+are indexed, and rebuilt when searched again, so the index only costs
+memory for chats people actually search. Indexing reads texts through the
+MessageLog, so it works the same for sealed history, and goes in chunks of
+`INDEX_CHUNK` messages with a yield to the eventlet hub in between, so a
+long history does not stall other requests while it is indexed.
+
+Hits are ordered by send time, newest first. Send times come from the wall
+clock and can step backwards, so each hit is ordered by the latest send
+time up to it in its chat (the same as its own send time unless the clock
+stepped back), which never decreases with seq. That keeps every chat's
+hits sorted for merging and lets the nextBefore cursor bisect safely.
+"""
+
+import heapq
+import re
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict, defaultdict
+from functools import partial
+from itertools import islice
+from typing import Iterable, Iterator, Optional
+
+from app.chat import Chat
+from app.message import Message
+from app.offload import yield_to_hub
+
+INDEX_CHUNK = 2000
+
+_WORD = re.compile(r"\w+")
+
+def tokenize(text: str) -> set:
+    return set(_WORD.findall(text.casefold()))
+
+def parse_cursor(cursor: str) -> tuple:
+    """Reads a nextBefore cursor. Raises ValueError if it is malformed."""
+    sent_at, chat_id, seq = cursor.split(":")
+    return (int(sent_at), chat_id, int(seq))
+
+def _contains(posting: array, seq: int) -> bool:
+    index = bisect_left(posting, seq)
+    return index < len(posting) and posting[index] == seq
+
+
+class _ChatIndex:
+    __slots__ = ("postings", "indexed", "latest_sent", "stepped_back")
+
+    def __init__(self):
+        self.postings = defaultdict(partial(array, "I"))  # word -> ascending seqs
+        self.indexed = 0  # messages with seq <= indexed are in the postings
+        self.latest_sent = 0  # latest send time (epoch micros) of the indexed messages
+        self.stepped_back = {}  # seq -> latest_sent, for messages sent earlier than one before them
+
+    def add(self, seq: int, text: str, sent_at: int):
+        for word in tokenize(text):
+            self.postings[word].append(seq)
+        self.indexed = seq
+        if sent_at < self.latest_sent:
+            self.stepped_back[seq] = self.latest_sent
+        else:
+            self.latest_sent = sent_at
+
+    def order_time(self, log, seq: int) -> int:
+        """The latest send time of messages 1..seq: non-decreasing with seq."""
+        return self.stepped_back.get(seq) or log.sent_at_micros(seq - 1)
+
+    def catch_up(self, chat: Chat):
+        log = chat.messages
+        while self.indexed < len(log):
+            # Re-read self.indexed after every yield: another search may have indexed this chat further
+            for position in range(self.indexed, min(self.indexed + INDEX_CHUNK, len(log))):
+                self.add(position + 1, log.text_at(position), log.sent_at_micros(position))
+            if self.indexed < len(log):
+                yield_to_hub()
+
+    def newest_matches(self, words: set, end: int) -> Iterator[int]:
+        """Seqs below `end` of the messages containing every word, newest first."""
+        postings = []
+        for word in words:
+            posting = self.postings.get(word)
+            if posting is None:
+                return
+            postings.append(posting)
+        postings.sort(key=len)
+        shortest, others = postings[0], postings[1:]
+        for i in range(bisect_left(shortest, end) - 1, -1, -1):
+            seq = shortest[i]
+            if all(_contains(posting, seq) for posting in others):
+                yield seq
+
+
+class MessageSearchIndex:
+
+    def __init__(self, max_chats: int = 10_000):
+        self.max_chats = max_chats
+        self._chats: OrderedDict[str, _ChatIndex] = OrderedDict()  # least recently searched first
+
+    def message_added(self, chat: Chat, message: Message):
+        index = self._chats.get(chat.chat_id)
+        # Only extend an index that is complete up to this message; otherwise the next search catches up
+        if index is not None and index.indexed == message.seq - 1:
+            index.add(message.seq, message.text, chat.messages.sent_at_micros(message.seq - 1))
+
+    def _index_for(self, chat: Chat) -> _ChatIndex:
+        index = self._chats.get(chat.chat_id)
+        if index is None:
+            index = self._chats[chat.chat_id] = _ChatIndex()
+            while len(self._chats) > self.max_chats:
+                self._chats.popitem(last=False)
+        else:
+            self._chats.move_to_end(chat.chat_id)
+        index.catch_up(chat)
+        return index
+
+    @staticmethod
+    def _hits(chat: Chat, index: _ChatIndex, words: set, before: Optional[tuple]) -> Iterator[tuple]:
+        """(order time, chat id, seq) of the hits in one chat below the cursor, newest first."""
+        log = chat.messages
+        end = index.indexed + 1
+        if before is not None:
+            if before[1] == chat.chat_id:
+                end = min(end, before[2])
+            # Order times never decrease with seq, so the cursor's time bounds the seqs to look at
+            end = min(end, bisect_right(range(1, end), before[0], key=partial(index.order_time, log)) + 1)
+        for seq in index.newest_matches(words, end):
+            key = (index.order_time(log, seq), chat.chat_id, seq)
+            if before is None or key < before:
+                yield key
+
+    def search(self, chats: Iterable[Chat], query: str, limit: int, before: Optional[str] = None) -> dict:
+        """
+        A page of the messages in `chats` that contain every word of `query`,
+        newest first. Pass the returned nextBefore back as `before` for the
+        next page (None on the last page). Within a chat hits are in seq
+        order, across chats they are merged by send time.
+        """
+        words = tokenize(query)
+        cursor = parse_cursor(before) if before else None
+        chats = {chat.chat_id: chat for chat in chats}
+        if not words:
+            return {"hits": [], "nextBefore": None}
+
+        streams = [self._hits(chat, self._index_for(chat), words, cursor) for chat in chats.values()]
+        page = list(islice(heapq.merge(*streams, reverse=True), limit + 1))
+        next_before = None
+        if len(page) > limit:
+            page = page[:limit]
+            next_before = "{}:{}:{}".format(*page[-1])
+        return {"hits": [self._hit(chats, key) for key in page], "nextBefore": next_before}
+
+    @staticmethod
+    def _hit(chats: dict, key: tuple) -> dict:
+        _, chat_id, seq = key
+        return chats[chat_id].get_message_by_seq(seq).to_dict()
+
+    def __len__(self):
+        return len(self._chats)
@@ -0,0 +1,242 @@
+"""
+Sealed, read-only history segments of a chat's message log.
+
+A segment holds a contiguous run of messages in the same columnar layout as
+MessageLog, written once to a binary file and read back through mmap:
+
+    header         magic, message count, position of the first message, text bytes
+    ids            16 bytes per message (UUID)
+    sender_ids     int64 per message
+    sent_at        int64 per message (epoch microseconds, UTC)
+    text_offsets   uint64 per message + 1, relative to the start of the text
+    sorted_ids     the ids in byte order ...
+    sorted_index   ... and their uint64 index within the segment
+    text           concatenated UTF-8 texts
+
+Nothing is decoded up front: reads index straight into the mapped pages, so
+a sealed segment costs the Python heap a few small objects regardless of
+how many messages it holds, and the OS page cache decides what stays hot.
+
+A segment is only mapped while it is being read. At most
+`open_segments.max_open` segments stay mapped (least recently read are
+unmapped first), so sealing the history of ever more idle chats does not
+run the process into the file descriptor or mapping count limits.
+"""
+
+import mmap
+import os
+import struct
+import time
+import traceback
+from array import array
+from collections import OrderedDict
+from typing import Optional
+
+from app.offload import run_off_hub
+
+MAGIC = b"MSGSEG1\0"
+_HEADER = struct.Struct("<8sQQQ")  # magic, count, first position, text length
+SEGMENT_SUFFIX = ".seg"
+
+def write_segment(path: str, first_position: int, ids: bytes, sender_ids: bytes, sent_at: bytes,
+                  text: bytes, text_offsets: bytes):
+    """
+    Writes a segment atomically (temp file, fsync, rename). Columns are raw
+    bytes as produced by MessageLog; text_offsets must start at 0.
+    """
+    count = len(ids) // 16
+    order = sorted(range(count), key=lambda i: ids[i * 16:i * 16 + 16])
+    sorted_ids = b"".join(ids[i * 16:i * 16 + 16] for i in order)
+
+    temp_path = path + ".tmp"
+    with open(temp_path, "wb") as segment:
+        segment.write(_HEADER.pack(MAGIC, count, first_position, len(text)))
+        for column in (ids, sender_ids, sent_at, text_offsets, sorted_ids, array("Q", order).tobytes(), text):
+            segment.write(column)
+        segment.flush()
+        os.fsync(segment.fileno())
+    os.replace(temp_path, path)
+
+
+class OpenSegments:
+    """The segments currently mapped; past `max_open` the least recently read one is unmapped."""
+
+    def __init__(self, max_open: int = 256):
+        self.max_open = max_open
+        self.reads = 0  # bumped on every read; a segment's last_read is the value at its latest read
+        self._open: set['SealedSegment'] = set()
+
+    def opened(self, segment: 'SealedSegment'):
+        self._open.add(segment)
+        # Opening is rare next to reads, so finding the coldest here beats reordering on every read
+        while len(self._open) > max(1, self.max_open):
+            min(self._open, key=lambda candidate: candidate.last_read).close()
+
+    def closed(self, segment: 'SealedSegment'):
+        self._open.discard(segment)
+
+    def __len__(self):
+        return len(self._open)
+
+
+# The process-wide set of mapped segments; create_app() sizes it from HISTORY_MAX_OPEN_SEGMENTS
+open_segments = OpenSegments()
+
+
+class SealedSegment:
+    """
+    Read-only view of a segment file. Indexes are relative to the segment's
+    first message. The file is mapped on first read and may be unmapped
+    again by open_segments at any time; the next read maps it back.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, "rb") as segment:
+            magic, count, first_position, text_length = _HEADER.unpack(segment.read(_HEADER.size))
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not a message segment.")
+        self.count = count
+        self.first_position = first_position
+        self._text_length = text_length
+        self._map = None
+        self.last_read = 0
+
+    def _mapped(self) -> 'SealedSegment':
+        open_segments.reads += 1
+        self.last_read = open_segments.reads
+        if self._map is None:
+            self._open()
+        return self
+
+    def _open(self):
+        with open(self.path, "rb") as segment:
+            self._map = mmap.mmap(segment.fileno(), 0, access=mmap.ACCESS_READ)
+        self._views = [memoryview(self._map)]
+        offset = _HEADER.size
+        def take(length, format="B"):
+            nonlocal offset
+            column = self._views[0][offset:offset + length]
+            offset += length
+            self._views.append(column)
+            if format != "B":
+                column = column.cast(format)
+                self._views.append(column)
+            return column
+
+        count = self.count
+        self._ids = take(16 * count)
+        self._sender_ids = take(8 * count, "q")
+        self._sent_at = take(8 * count, "q")
+        self._text_offsets = take(8 * (count + 1), "Q")
+        self._sorted_ids = take(16 * count)
+        self._sorted_index = take(8 * count, "Q")
+        self._text = take(self._text_length)
+        open_segments.opened(self)
+
+    @property
+    def is_open(self) -> bool:
+        return self._map is not None
+
+    def close(self):
+        """Unmaps the file (reads map it again)."""
+        if self._map is None:
+            return
+        for view in reversed(self._views):
+            view.release()
+        self._views = self._ids = self._sender_ids = self._sent_at = None
+        self._text_offsets = self._sorted_ids = self._sorted_index = self._text = None
+        self._map.close()
+        self._map = None
+        open_segments.closed(self)
+
+    @property
+    def end_position(self) -> int:
+        """Exclusive end: position of the first message after this segment."""
+        return self.first_position + self.count
+
+    def id_bytes(self, index: int) -> bytes:
+        return bytes(self._mapped()._ids[index * 16:index * 16 + 16])
+
+    def sender_at(self, index: int) -> int:
+        return self._mapped()._sender_ids[index]
+
+    def sent_at_micros(self, index: int) -> int:
+        return self._mapped()._sent_at[index]
+
+    def text(self, index: int) -> str:
+        columns = self._mapped()
+        return bytes(columns._text[columns._text_offsets[index]:columns._text_offsets[index + 1]]).decode("utf-8")
+
+    def row(self, index: int) -> tuple:
+        """(id bytes, sender id, sent_at micros, text) of one message, in a single read."""
+        columns = self._mapped()
+        text = bytes(columns._text[columns._text_offsets[index]:columns._text_offsets[index + 1]]).decode("utf-8")
+        return (bytes(columns._ids[index * 16:index * 16 + 16]), columns._sender_ids[index],
+                columns._sent_at[index], text)
+
+    def find(self, id_bytes: bytes) -> Optional[int]:
+        """Binary search over the sorted ids; returns the index of a message id or None."""
+        sorted_ids = self._mapped()._sorted_ids
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            if bytes(sorted_ids[middle * 16:middle * 16 + 16]) < id_bytes:
+                low = middle + 1
+            else:
+                high = middle
+        if low < self.count and bytes(sorted_ids[low * 16:low * 16 + 16]) == id_bytes:
+            return self._sorted_index[low]
+        return None
+
+
+class HistorySealer:
+    """
+    Moves the history of idle chats out of the Python heap: every chat with
+    no new message for `idle_seconds` and at least `min_messages` unsealed
+    messages gets them written to a segment file in `directory`, which the
+    chat's MessageLog then reads through mmap.
+    """
+
+    def __init__(self, directory: str, chats, idle_seconds: float = 3600, min_messages: int = 1000):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.chats = chats
+        self.idle_seconds = idle_seconds
+        self.min_messages = min_messages
+
+    def seal(self, chat) -> int:
+        """Seals all of a chat's in-memory messages. Returns how many were sealed."""
+        log = chat.messages
+        count, first_position = log.unsealed_count(), log.sealed_count
+        if count == 0:
+            return 0
+        columns = log.columns()  # taken together with count, before the hub can switch away
+        path = os.path.join(self.directory, f"{chat.chat_id}-{first_position:012d}{SEGMENT_SUFFIX}")
+        run_off_hub(write_segment, path, first_position, *columns)
+        log.seal(path, count)
+        return count
+
+    def seal_idle(self) -> tuple:
+        """Seals every idle chat. Returns (chats sealed, messages sealed)."""
+        now = time.time() * 1_000_000
+        idle_before = now - self.idle_seconds * 1_000_000
+        sealed_chats = sealed_messages = 0
+        for chat in list(self.chats.values()):
+            if chat.last_activity > idle_before or chat.messages.unsealed_count() < self.min_messages:
+                continue
+            sealed_messages += self.seal(chat)
+            sealed_chats += 1
+        return sealed_chats, sealed_messages
+
+    def run_periodically(self, interval: float):
+        """Background task: seals idle chats every `interval` seconds."""
+        while True:
+            time.sleep(interval)
+            try:
+                chats, messages = self.seal_idle()
+                if chats:
+                    print(f"History: sealed {messages} messages of {chats} idle chats")
+            except Exception:
+                print("History: sealing idle chats failed")
+                traceback.print_exc()
@@ -0,0 +1,31 @@
+def run_off_hub(fn, *args):
+    """Runs blocking I/O in eventlet's thread pool when running under eventlet, so the hub keeps serving."""
+    try:
+        from eventlet import patcher, tpool
+        if patcher.is_monkey_patched("thread"):
+            return tpool.execute(fn, *args)
+    except ImportError:
+        pass
+    return fn(*args)
+
+def off_hub_lock():
+    """
+    A lock for state shared by functions run through run_off_hub. Those run
+    on real OS threads, where monkey-patched (green) locks cannot block, so
+    this is always an original threading.Lock. Never take it on the hub.
+    """
+    try:
+        from eventlet import patcher
+        return patcher.original("threading").Lock()
+    except ImportError:
+        import threading
+        return threading.Lock()
+
+def yield_to_hub():
+    """Lets other green threads run when running under eventlet; a no-op otherwise."""
+    try:
+        from eventlet import patcher, sleep
+        if patcher.is_monkey_patched("thread"):
+            sleep(0)
+    except ImportError:
+        pass
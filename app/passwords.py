@@ -0,0 +1,118 @@
+"""
+Password hashing off the eventlet hub.
+
+Werkzeug's scrypt hashes take tens to hundreds of milliseconds of CPU. Run
+inline under eventlet they stall every other green thread, socket handlers
+included, for that long. PasswordHasher runs them in eventlet's thread pool
+instead (hashlib releases the GIL while hashing), at most `workers` at a
+time, with up to `max_queue` more callers waiting for a slot. Anything past
+that is refused with HashingBusy, which routes turn into 503, so a login
+storm degrades into quick refusals instead of an ever longer queue.
+
+The hash method (Werkzeug's "scrypt:N:r:p" or "pbkdf2:sha256:iterations")
+is Werkzeug's default unless configured, either explicitly or by tune(),
+which times candidate costs on this machine and picks the strongest that
+fits a per-hash time budget. Hashes made with any other method still
+verify, and User.check_password rehashes them on the next successful login.
+To pick a HASH_METHOD ahead of deployment:
+
+    python -m app.tune_password_hash [--budget-ms 250] [--family scrypt|pbkdf2]
+"""
+
+import os
+import statistics
+import threading
+import time
+
+from werkzeug.security import check_password_hash, generate_password_hash
+
+from app.offload import run_off_hub
+
+
+class HashingBusy(Exception):
+    """Raised when the hashing pool and its queue are full."""
+
+
+# Candidate costs for tune(), weakest first. scrypt needs 128 * N * r bytes
+# per hash (up to 128 MiB here), for every hash running at the same time.
+TUNING_CANDIDATES = {
+    "scrypt": [f"scrypt:{2 ** log_n}:8:1" for log_n in range(14, 18)],
+    "pbkdf2": [f"pbkdf2:sha256:{iterations}" for iterations in (300_000, 600_000, 1_200_000, 2_400_000)],
+}
+
+def method_of(password_hash: str) -> str:
+    """The method and cost a Werkzeug hash was made with, e.g. "scrypt:32768:8:1"."""
+    return password_hash.split("$", 1)[0]
+
+
+class PasswordHasher:
+
+    def __init__(self, workers: int = None, max_queue: int = 64):
+        self.method = None  # None: Werkzeug's default, and no rehashing
+        self.configure(workers, max_queue)
+
+    def configure(self, workers: int = None, max_queue: int = 64):
+        """`workers` defaults to the CPU count; 0 hashes inline on the calling thread."""
+        self.workers = (os.cpu_count() or 1) if workers is None else workers
+        self.max_queue = max_queue
+        self._slots = threading.BoundedSemaphore(max(1, self.workers))
+        self._pending = 0  # hashing or waiting for a slot
+
+    def set_method(self, method: str):
+        """
+        Makes `method` the one new hashes use. It is normalized to the form
+        hashes carry (Werkzeug fills in default costs, so "scrypt" becomes
+        "scrypt:32768:8:1"), which also validates it: raises ValueError.
+        """
+        self.method = method_of(generate_password_hash("probe", method=method))
+
+    def tune(self, budget: float, family: str = "scrypt", rounds: int = 3) -> list:
+        """
+        Times each candidate cost of `family` (median of `rounds` hashes on
+        this thread) and sets the strongest taking at most `budget` seconds,
+        or the weakest if none fits. Returns [(method, seconds)] as measured.
+        """
+        if family not in TUNING_CANDIDATES:
+            raise ValueError(f"Unknown hash family '{family}'. Must be one of {', '.join(TUNING_CANDIDATES)}.")
+        timings = []
+        chosen = TUNING_CANDIDATES[family][0]
+        for method in TUNING_CANDIDATES[family]:
+            samples = []
+            for _ in range(rounds):
+                started = time.perf_counter()
+                generate_password_hash("tuning password", method=method)
+                samples.append(time.perf_counter() - started)
+            timings.append((method, statistics.median(samples)))
+            if timings[-1][1] > budget:
+                break
+            chosen = method
+        self.set_method(chosen)
+        return timings
+
+    def needs_rehash(self, password_hash: str) -> bool:
+        return self.method is not None and method_of(password_hash) != self.method
+
+    def _run(self, fn, *args):
+        if self.workers == 0:
+            return fn(*args)
+        if self._pending >= self.workers + self.max_queue:
+            raise HashingBusy("Too many password checks in progress, try again shortly.")
+        self._pending += 1
+        try:
+            with self._slots:
+                return run_off_hub(fn, *args)
+        finally:
+            self._pending -= 1
+
+    def hash(self, plain_password: str) -> str:
+        if self.method is None:
+            return self._run(generate_password_hash, plain_password)
+        return self._run(generate_password_hash, plain_password, self.method)
+
+    def check(self, password_hash: str, plain_password: str) -> bool:
+        return self._run(check_password_hash, password_hash, plain_password)
+
+
+# The process-wide hasher used by User; create_app() configures it from the environment
+hasher = PasswordHasher()
+
@@ -0,0 +1,424 @@
+"""
+Durable storage for the in-memory stores in app/database.py.
+
+The stores stay the source of truth for reads. SqlBackend registers as a
+store observer and turns every mutation into a row operation on a
+write-behind queue. A single writer drains the queue in batches (bounded
+by size and by time) and writes each batch in one transaction, so a chat
+message never waits for a database round trip. The driver calls block, so
+under eventlet both the batch writes and the occasional ID block
+reservation run in its thread pool (app.offload.run_off_hub) and the hub
+keeps serving sockets while a transaction commits.
+
+Works against PostgreSQL (production, see docker-compose.yml) and SQLite
+(local runs and tests), selected by the database URL.
+"""
+
+import datetime
+import queue
+import threading
+import time
+import traceback
+from typing import Callable, List, Optional, Tuple
+
+from sqlalchemy import (Column, DateTime, Integer, MetaData, String, Table, Text,
+                        bindparam, create_engine, delete, insert, select, update)
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.pool import StaticPool
+
+from app.chat import Chat, ChatType
+from app.friendrequest import FriendRequest
+from app.friendship import Friendship
+from app.offload import off_hub_lock, run_off_hub
+from app.user import User
+
+metadata = MetaData()
+
+users_table = Table(
+    "users", metadata,
+    Column("user_id", Integer, primary_key=True, autoincrement=False),
+    Column("name", String(255), nullable=False),
+    Column("email", String(255), nullable=False),
+    Column("username", String(255), nullable=False),
+    Column("password_hash", String(512), nullable=False),
+    Column("status", Text),
+    Column("role", String(16), nullable=False),
+    Column("created_at", DateTime, nullable=False),
+)
+
+friendships_table = Table(
+    "friendships", metadata,
+    Column("friendship_id", Integer, primary_key=True, autoincrement=False),
+    Column("user1_id", Integer, nullable=False, index=True),
+    Column("user2_id", Integer, nullable=False, index=True),
+    Column("created_at", DateTime, nullable=False),
+)
+
+friend_requests_table = Table(
+    "friend_requests", metadata,
+    Column("request_id", Integer, primary_key=True, autoincrement=False),
+    Column("sender_id", Integer, nullable=False, index=True),
+    Column("receiver_id", Integer, nullable=False, index=True),
+    Column("status", String(16), nullable=False),
+    Column("created_at", DateTime, nullable=False),
+)
+
+chats_table = Table(
+    "chats", metadata,
+    Column("chat_id", String(36), primary_key=True),
+    Column("chat_type", String(16), nullable=False),
+    Column("name", String(255)),
+    Column("created_at", DateTime(timezone=True), nullable=False),
+)
+
+chat_members_table = Table(
+    "chat_members", metadata,
+    Column("chat_id", String(36), primary_key=True),
+    Column("user_id", Integer, primary_key=True, index=True),
+    Column("joined_at", DateTime(timezone=True), nullable=False),
+    Column("last_read_seq", Integer, nullable=False, default=0),
+    Column("last_read_message_id", String(36)),
+    Column("last_read_at", DateTime(timezone=True)),
+)
+
+messages_table = Table(
+    "messages", metadata,
+    Column("chat_id", String(36), primary_key=True),
+    Column("seq", Integer, primary_key=True),
+    Column("message_id", String(36), nullable=False, unique=True),
+    Column("sender_id", Integer, nullable=False),
+    Column("text", Text, nullable=False),
+    Column("sent_at", DateTime(timezone=True), nullable=False),
+)
+
+id_sequences_table = Table(
+    "id_sequences", metadata,
+    Column("name", String(64), primary_key=True),
+    Column("next_id", Integer, nullable=False),
+)
+
+# Row operations queued for the writer: (action, table, row)
+UPSERT, INSERT, DELETE = "upsert", "insert", "delete"
+Operation = Tuple[str, Table, dict]
+
+def _aware(moment: Optional[datetime.datetime]) -> Optional[datetime.datetime]:
+    """SQLite hands timezone-aware columns back naive; they were stored as UTC."""
+    if moment is not None and moment.tzinfo is None:
+        return moment.replace(tzinfo=datetime.UTC)
+    return moment
+
+
+class WriteBehindQueue:
+    """
+    Collects row operations and hands them to `write_batch` in batches.
+    A batch is flushed once it holds `max_batch` operations or `max_delay`
+    seconds after its first operation was queued, whichever comes first, so
+    the persistence lag of any single write is bounded.
+    """
+
+    _STOP = object()
+
+    def __init__(self, write_batch: Callable[[List[Operation]], None],
+                 max_batch: int = 500, max_delay: float = 0.05, max_retries: int = 5):
+        self.write_batch = write_batch
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.max_retries = max_retries
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name="persistence-writer", daemon=True)
+        self._thread.start()
+
+    def put(self, operation: Operation):
+        self._queue.put(operation)
+
+    def flush(self):
+        """Blocks until everything queued so far has been written (or given up on)."""
+        self._queue.join()
+
+    def close(self):
+        """Writes what is left and stops the writer."""
+        self._queue.put(self._STOP)
+        self._thread.join()
+
+    def _run(self):
+        stopping = False
+        while not stopping:
+            first = self._queue.get()
+            if first is self._STOP:
+                self._queue.task_done()
+                return
+
+            batch = [first]
+            deadline = time.monotonic() + self.max_delay
+            while len(batch) < self.max_batch:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    operation = self._queue.get(timeout=timeout)
+                except queue.Empty:
+                    break
+                if operation is self._STOP:
+                    stopping = True
+                    self._queue.task_done()
+                    break
+                batch.append(operation)
+
+            self._write_with_retry(batch)
+            for _ in batch:
+                self._queue.task_done()
+
+    def _write_with_retry(self, batch: List[Operation]):
+        for attempt in range(1, self.max_retries + 1):
+            try:
+                run_off_hub(self.write_batch, batch)
+                return
+            except Exception:
+                print(f"Persistence: writing a batch of {len(batch)} operations failed (attempt {attempt}/{self.max_retries})")
+                traceback.print_exc()
+                time.sleep(min(2 ** attempt * 0.1, 5))
+        print(f"Persistence: giving up on a batch of {len(batch)} operations as a whole")
+        self._write_in_parts(batch)
+
+    def _write_in_parts(self, batch: List[Operation]):
+        """
+        Bisects a batch that keeps failing, one attempt per part, so an
+        operation that cannot be written (a row the schema rejects) is
+        dropped on its own instead of taking the rest of the batch with it.
+        Parts are written in order, so later operations still follow earlier ones.
+        """
+        if len(batch) == 1:
+            action, table, row = batch[0]
+            key = {column.name: row.get(column.name) for column in table.primary_key.columns}
+            print(f"Persistence: dropping {action} on {table.name} {key}")
+            return
+        middle = len(batch) // 2
+        for part in (batch[:middle], batch[middle:]):
+            try:
+                run_off_hub(self.write_batch, part)
+            except Exception:
+                if len(part) == 1:
+                    traceback.print_exc()
+                self._write_in_parts(part)
+
+
+class SqlBackend:
+    """
+    Store observer that persists users, friendships, friend requests, chats,
+    members and messages through a WriteBehindQueue, and reloads them into
+    the in-memory stores at startup.
+    """
+
+    def __init__(self, database_url: str, max_batch: int = 500, max_delay: float = 0.05,
+                 id_block_size: int = 100):
+        if database_url.startswith("sqlite"):
+            engine_args = {"connect_args": {"check_same_thread": False}}
+            if database_url in ("sqlite://", "sqlite:///:memory:"):
+                engine_args["poolclass"] = StaticPool
+        else:
+            engine_args = {"pool_pre_ping": True}
+        self.engine = create_engine(database_url, **engine_args)
+        self.dialect = self.engine.dialect.name
+        if self.dialect not in ("postgresql", "sqlite"):
+            raise ValueError(f"Unsupported database dialect: {self.dialect}")
+
+        metadata.create_all(self.engine)
+        self.id_block_size = id_block_size
+        # Off-hub writes and ID reservations share the engine from different OS threads. Its pool is guarded by
+        # (monkey-patched) green locks, which must never be contended there, so they take turns on this lock.
+        self._engine_lock = off_hub_lock()
+        self.writer = WriteBehindQueue(self._write_batch, max_batch=max_batch, max_delay=max_delay)
+
+    # --- Store observer interface (see app/database.py) ---
+
+    def user_saved(self, user: User):
+        self.writer.put((UPSERT, users_table, {
+            "user_id": user.userId,
+            "name": user.name,
+            "email": user.email,
+            "username": user.username,
+            "password_hash": user._password_hash,
+            "status": user.status,
+            "role": user.role.value,
+            "created_at": user.createdAt,
+        }))
+
+    def user_deleted(self, user: User):
+        self.writer.put((DELETE, users_table, {"user_id": user.userId}))
+
+    def friendship_saved(self, friendship: Friendship):
+        self.writer.put((UPSERT, friendships_table, {
+            "friendship_id": friendship.friendshipId,
+            "user1_id": friendship.user1Id,
+            "user2_id": friendship.user2Id,
+            "created_at": friendship.createdAt,
+        }))
+
+    def friendship_deleted(self, friendship: Friendship):
+        self.writer.put((DELETE, friendships_table, {"friendship_id": friendship.friendshipId}))
+
+    def friend_request_saved(self, friend_request: FriendRequest):
+        self.writer.put((UPSERT, friend_requests_table, {
+            "request_id": friend_request.requestId,
+            "sender_id": friend_request.senderId,
+            "receiver_id": friend_request.receiverId,
+            "status": friend_request.status.value,
+            "created_at": friend_request.createdAt,
+        }))
+
+    def friend_request_deleted(self, friend_request: FriendRequest):
+        self.writer.put((DELETE, friend_requests_table, {"request_id": friend_request.requestId}))
+
+    def chat_created(self, chat: Chat):
+        self.writer.put((UPSERT, chats_table, {
+            "chat_id": chat.chat_id,
+            "chat_type": chat.chat_type.value,
+            "name": chat.name,
+            "created_at": chat.created_at,
+        }))
+
+    def member_saved(self, chat: Chat, member):
+        self.writer.put((UPSERT, chat_members_table, {
+            "chat_id": chat.chat_id,
+            "user_id": member.user_id,
+            "joined_at": member.joined_at,
+            "last_read_seq": member.last_read_seq,
+            "last_read_message_id": member.last_read_message_id,
+            "last_read_at": member.last_read_at,
+        }))
+
+    def message_added(self, chat: Chat, message):
+        self.writer.put((INSERT, messages_table, {
+            "chat_id": chat.chat_id,
+            "seq": message.seq,
+            "message_id": message.message_id,
+            "sender_id": int(message.sender_id),
+            "text": message.text,
+            "sent_at": message.sent_at,
+        }))
+
+    # --- Writing ---
+
+    def _write_batch(self, batch: List[Operation]):
+        """
+        Writes a batch in one transaction. Consecutive operations of the same
+        kind on the same table are sent as one executemany, which SQLAlchemy
+        turns into multi-row INSERT ... VALUES statements; order between runs
+        is preserved so e.g. a delete never overtakes an earlier upsert.
+        """
+        with self._engine_lock, self.engine.begin() as conn:
+            run_start = 0
+            for i in range(1, len(batch) + 1):
+                if i < len(batch) and batch[i][:2] == batch[run_start][:2]:
+                    continue
+                action, table = batch[run_start][:2]
+                rows = [operation[2] for operation in batch[run_start:i]]
+                conn.execute(self._statement(action, table), rows)
+                run_start = i
+
+    def _statement(self, action: str, table: Table):
+        keys = [column.name for column in table.primary_key.columns]
+        if action == INSERT:
+            return insert(table)
+        if action == DELETE:
+            condition = None
+            for key in keys:
+                clause = table.c[key] == bindparam(f"{key}")
+                condition = clause if condition is None else condition & clause
+            return delete(table).where(condition)
+
+        dialect_insert = postgresql.insert if self.dialect == "postgresql" else sqlite.insert
+        statement = dialect_insert(table)
+        return statement.on_conflict_do_update(
+            index_elements=keys,
+            set_={column.name: statement.excluded[column.name]
+                  for column in table.columns if column.name not in keys},
+        )
+
+    def flush(self):
+        self.writer.flush()
+
+    def close(self):
+        self.writer.close()
+        self.engine.dispose()
+
+    # --- ID sequences ---
+
+    def bind_sequences(self, *sequences):
+        """
+        Backs IdSequence allocators with rows of the id_sequences table, so
+        every server process draws disjoint ID blocks. The stored counter is
+        first moved past anything already handed out locally.
+        """
+        with self.engine.begin() as conn:
+            for sequence in sequences:
+                row = conn.execute(select(id_sequences_table.c.next_id)
+                                   .where(id_sequences_table.c.name == sequence.name)).first()
+                if row is None:
+                    conn.execute(insert(id_sequences_table).values(name=sequence.name, next_id=sequence.peek()))
+                elif row.next_id < sequence.peek():
+                    conn.execute(update(id_sequences_table)
+                                 .where(id_sequences_table.c.name == sequence.name)
+                                 .values(next_id=sequence.peek()))
+        for sequence in sequences:
+            sequence.bind(lambda size, name=sequence.name: run_off_hub(self._allocate_ids, name, size),
+                          self.id_block_size)
+
+    def _allocate_ids(self, name: str, size: int) -> int:
+        """Atomically advances a stored sequence by `size` and returns the first ID of the block."""
+        with self._engine_lock, self.engine.begin() as conn:
+            next_id = conn.execute(update(id_sequences_table)
+                                   .where(id_sequences_table.c.name == name)
+                                   .values(next_id=id_sequences_table.c.next_id + size)
+                                   .returning(id_sequences_table.c.next_id)).scalar_one()
+        return next_id - size
+
+    # --- Loading ---
+
+    def is_empty(self) -> bool:
+        with self.engine.connect() as conn:
+            return conn.execute(select(users_table.c.user_id).limit(1)).first() is None
+
+    def load(self, users, friendships, friendrequests, chats):
+        """
+        Rebuilds the in-memory stores from the database. Call before
+        registering this backend as an observer, so nothing is written back.
+        """
+        with self.engine.connect() as conn:
+            for row in conn.execute(select(users_table).order_by(users_table.c.user_id)):
+                users.add(User.restore(
+                    userId=row.user_id, name=row.name, email=row.email, username=row.username,
+                    password_hash=row.password_hash, status=row.status, role=row.role,
+                    createdAt=row.created_at,
+                ))
+
+            for row in conn.execute(select(friendships_table)):
+                friendships.add(Friendship(friendshipId=row.friendship_id, user1Id=row.user1_id,
+                                           user2Id=row.user2_id, createdAt=row.created_at))
+
+            for row in conn.execute(select(friend_requests_table).order_by(friend_requests_table.c.request_id)):
+                friendrequests.add(FriendRequest(requestId=row.request_id, senderId=row.sender_id,
+                                                 receiverId=row.receiver_id, status=row.status,
+                                                 createdAt=row.created_at))
+
+            restored = {}
+            for row in conn.execute(select(chats_table)):
+                restored[row.chat_id] = Chat(ChatType(row.chat_type), name=row.name, chat_id=row.chat_id,
+                                             created_at=_aware(row.created_at))
+
+            for row in conn.execute(select(chat_members_table)):
+                chat = restored.get(row.chat_id)
+                if chat:
+                    chat.restore_member(row.user_id, _aware(row.joined_at), row.last_read_seq,
+                                        row.last_read_message_id, _aware(row.last_read_at))
+
+            messages = conn.execution_options(yield_per=10_000).execute(
+                select(messages_table).order_by(messages_table.c.chat_id, messages_table.c.seq))
+            for row in messages:
+                chat = restored.get(row.chat_id)
+                if chat:
+                    chat.messages.restore(row.message_id, row.sender_id, row.text, _aware(row.sent_at))
+
+        for chat in restored.values():
+            chat.finish_restore()
+            chats.add(chat)
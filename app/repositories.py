@@ -0,0 +1,496 @@
+"""
+Repository layer between the HTTP routes / socket handlers and storage.
+
+Routes and handlers talk to `storage.users`, `storage.friends`,
+`storage.chats` and `storage.messages` instead of the store globals in
+app/database.py, so the storage behind them can be chosen by config
+(STORAGE_BACKEND):
+
+    memory    in-memory stores only, seeded with demo data on startup
+    sqlite    in-memory stores, written behind to a SQLite database
+    postgres  in-memory stores, written behind to PostgreSQL
+
+The SQL backends keep serving reads from the in-memory indexes and only
+differ in where writes end up (see app/persistence.py), so all of them
+share the Memory* repositories below. The abstract interfaces are what a
+backend that reads from the database itself would implement; the shared
+conformance suite in tests/test_repositories.py runs against every backend.
+"""
+
+import atexit
+import time
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from itertools import islice
+from typing import Callable, List, Optional
+
+from app import database
+from app.chat import Chat
+from app.database import (ChatStore, FriendRequestStore, FriendshipStore, UserStore)
+from app.friendrequest import FriendRequest, RequestStatus
+from app.friendship import Friendship
+from app.message import Message
+from app.message_search import MessageSearchIndex
+from app.message_segment import HistorySealer
+from app.sequence import IdSequence
+from app.snapshot import Snapshotter
+from app.user import User
+from app.wal import WriteAheadLog
+
+BACKENDS = ("memory", "sqlite", "postgres")
+
+
+class UserRepo(ABC):
+    """User accounts, looked up by id, username or email (case-insensitive)."""
+
+    @abstractmethod
+    def next_id(self) -> int:
+        ...
+
+    @abstractmethod
+    def add(self, user: User):
+        """Stores a new user. Raises ValueError if the id, username or email is taken."""
+
+    @abstractmethod
+    def get(self, user_id: int) -> Optional[User]:
+        ...
+
+    @abstractmethod
+    def get_by_username(self, username: str) -> Optional[User]:
+        ...
+
+    @abstractmethod
+    def get_by_email(self, email: str) -> Optional[User]:
+        ...
+
+    @abstractmethod
+    def rename(self, user: User, new_name: str):
+        ...
+
+    @abstractmethod
+    def update(self, user: User):
+        """Saves changes made to a user's status or password."""
+
+    @abstractmethod
+    def remove(self, user: User):
+        ...
+
+    @abstractmethod
+    def all(self) -> List[User]:
+        ...
+
+    @abstractmethod
+    def search(self, query: str, limit: int, exclude: Callable[[int], bool] = None) -> List[User]:
+        """
+        Up to `limit` users whose username or name matches `query`, prefix
+        matches first. Users for whom `exclude(user_id)` is true are skipped.
+        """
+
+
+class FriendRepo(ABC):
+    """Friendships and friend requests."""
+
+    @abstractmethod
+    def next_friendship_id(self) -> int:
+        ...
+
+    @abstractmethod
+    def next_request_id(self) -> int:
+        ...
+
+    @abstractmethod
+    def add_friendship(self, friendship: Friendship):
+        ...
+
+    @abstractmethod
+    def remove_friendship(self, friendship: Friendship):
+        ...
+
+    @abstractmethod
+    def find_friendship(self, user1_id: int, user2_id: int) -> Optional[Friendship]:
+        ...
+
+    @abstractmethod
+    def friend_ids(self, user_id: int) -> set:
+        ...
+
+    @abstractmethod
+    def add_request(self, friend_request: FriendRequest):
+        ...
+
+    @abstractmethod
+    def get_request(self, request_id: int) -> Optional[FriendRequest]:
+        ...
+
+    @abstractmethod
+    def find_pending_request(self, user1_id: int, user2_id: int) -> Optional[FriendRequest]:
+        """Finds a PENDING request between two users, regardless of direction."""
+
+    @abstractmethod
+    def incoming(self, user_id: int, status: RequestStatus = RequestStatus.PENDING) -> List[FriendRequest]:
+        ...
+
+    @abstractmethod
+    def outgoing(self, user_id: int, status: RequestStatus = RequestStatus.PENDING) -> List[FriendRequest]:
+        ...
+
+    @abstractmethod
+    def remove_user(self, user_id: int):
+        """Drops every friendship and friend request involving a user."""
+
+
+class ChatRepo(ABC):
+    """Chats and their membership indexes."""
+
+    @abstractmethod
+    def add(self, chat: Chat):
+        ...
+
+    @abstractmethod
+    def get(self, chat_id: str) -> Optional[Chat]:
+        ...
+
+    @abstractmethod
+    def find_one_on_one(self, user1_id, user2_id) -> Optional[Chat]:
+        ...
+
+    @abstractmethod
+    def chats_for_user(self, user_id) -> List[Chat]:
+        ...
+
+    @abstractmethod
+    def recent_chats_for_user(self, user_id, limit: Optional[int] = None, before: Optional[str] = None):
+        """
+        Returns (chats, next_before), most recently active first. Pass
+        next_before back as `before` for the next page (None on the last
+        page). Raises ValueError if `before` is malformed.
+        """
+
+    @abstractmethod
+    def sync_for_user(self, user_id, cursors: dict, limit: Optional[int] = None) -> dict:
+        ...
+
+    @abstractmethod
+    def add_member_listener(self, listener):
+        """Registers listener(chat, user_id), called whenever a user joins a chat."""
+
+
+class MessageRepo(ABC):
+    """Message history and read state of a chat."""
+
+    @abstractmethod
+    def append(self, chat: Chat, sender_id, text: str) -> Message:
+        ...
+
+    @abstractmethod
+    def get_by_id(self, chat: Chat, message_id: str) -> Optional[Message]:
+        ...
+
+    @abstractmethod
+    def page(self, chat: Chat, before: Optional[int] = None, after: Optional[int] = None,
+             limit: Optional[int] = None) -> dict:
+        """Returns {"messages", "hasMoreBefore", "hasMoreAfter"} for a seq cursor page."""
+
+    @abstractmethod
+    def mark_read(self, chat: Chat, user_id, message: Message) -> bool:
+        """Moves a member's read watermark up to message. Returns False if it was already there."""
+
+    @abstractmethod
+    def mark_all_read(self, chat: Chat, user_id) -> Optional[Message]:
+        """Marks the whole chat read. Returns the newest message if the watermark moved."""
+
+    @abstractmethod
+    def unread_count(self, chat: Chat, user_id) -> int:
+        ...
+
+    @abstractmethod
+    def search(self, chats: List[Chat], query: str, limit: int, before: Optional[str] = None) -> dict:
+        """
+        Returns {"hits", "nextBefore"}: messages of `chats` containing every
+        word of `query`, newest first. Raises ValueError on a bad cursor.
+        """
+
+
+class MemoryUserRepo(UserRepo):
+
+    def __init__(self, store: UserStore, ids: IdSequence):
+        self.store = store
+        self.ids = ids
+
+    def next_id(self) -> int:
+        return self.ids.next()
+
+    def add(self, user: User):
+        self.store.add(user)
+
+    def get(self, user_id: int) -> Optional[User]:
+        return self.store.get_by_id(user_id)
+
+    def get_by_username(self, username: str) -> Optional[User]:
+        return self.store.get_by_username(username)
+
+    def get_by_email(self, email: str) -> Optional[User]:
+        return self.store.get_by_email(email)
+
+    def rename(self, user: User, new_name: str):
+        self.store.rename(user, new_name)
+
+    def update(self, user: User):
+        self.store.update(user)
+
+    def remove(self, user: User):
+        self.store.remove(user)
+
+    def all(self) -> List[User]:
+        return list(self.store)
+
+    def search(self, query: str, limit: int, exclude: Callable[[int], bool] = None) -> List[User]:
+        matches = self.store.search_index.search(query)
+        if exclude is not None:
+            matches = (user_id for user_id in matches if not exclude(user_id))
+        return [self.store.get_by_id(user_id) for user_id in islice(matches, limit)]
+
+
+class MemoryFriendRepo(FriendRepo):
+
+    def __init__(self, friendships: FriendshipStore, friendrequests: FriendRequestStore,
+                 friendship_ids: IdSequence, friendrequest_ids: IdSequence):
+        self.friendships = friendships
+        self.friendrequests = friendrequests
+        self.friendship_ids = friendship_ids
+        self.friendrequest_ids = friendrequest_ids
+
+    def next_friendship_id(self) -> int:
+        return self.friendship_ids.next()
+
+    def next_request_id(self) -> int:
+        return self.friendrequest_ids.next()
+
+    def add_friendship(self, friendship: Friendship):
+        self.friendships.add(friendship)
+
+    def remove_friendship(self, friendship: Friendship):
+        self.friendships.remove(friendship)
+
+    def find_friendship(self, user1_id: int, user2_id: int) -> Optional[Friendship]:
+        return self.friendships.find(user1_id, user2_id)
+
+    def friend_ids(self, user_id: int) -> set:
+        return self.friendships.friend_ids(user_id)
+
+    def add_request(self, friend_request: FriendRequest):
+        self.friendrequests.add(friend_request)
+
+    def get_request(self, request_id: int) -> Optional[FriendRequest]:
+        return self.friendrequests.get_by_id(request_id)
+
+    def find_pending_request(self, user1_id: int, user2_id: int) -> Optional[FriendRequest]:
+        return self.friendrequests.find_pending(user1_id, user2_id)
+
+    def incoming(self, user_id: int, status: RequestStatus = RequestStatus.PENDING) -> List[FriendRequest]:
+        return self.friendrequests.incoming(user_id, status)
+
+    def outgoing(self, user_id: int, status: RequestStatus = RequestStatus.PENDING) -> List[FriendRequest]:
+        return self.friendrequests.outgoing(user_id, status)
+
+    def remove_user(self, user_id: int):
+        self.friendships.remove_user(user_id)
+        self.friendrequests.remove_user(user_id)
+
+
+class MemoryChatRepo(ChatRepo):
+
+    def __init__(self, store: ChatStore):
+        self.store = store
+
+    def add(self, chat: Chat):
+        self.store.add(chat)
+
+    def get(self, chat_id: str) -> Optional[Chat]:
+        return self.store.get(chat_id)
+
+    def find_one_on_one(self, user1_id, user2_id) -> Optional[Chat]:
+        return self.store.find_one_on_one(user1_id, user2_id)
+
+    def chats_for_user(self, user_id) -> List[Chat]:
+        return self.store.chats_for_user(user_id)
+
+    def recent_chats_for_user(self, user_id, limit: Optional[int] = None, before: Optional[str] = None):
+        cursor = database.parse_inbox_cursor(before) if before else None
+        page, next_before = self.store.recent_chats_for_user(user_id, limit=limit, before=cursor)
+        return page, database.format_inbox_cursor(next_before) if next_before else None
+
+    def sync_for_user(self, user_id, cursors: dict, limit: Optional[int] = None) -> dict:
+        return self.store.sync_for_user(user_id, cursors, limit)
+
+    def add_member_listener(self, listener):
+        self.store.add_member_listener(listener)
+
+
+class MemoryMessageRepo(MessageRepo):
+    """Messages live in each chat's MessageLog; this just routes to it."""
+
+    def __init__(self, search_index: MessageSearchIndex):
+        self.search_index = search_index
+
+    def append(self, chat: Chat, sender_id, text: str) -> Message:
+        return chat.add_message(sender_id, text)
+
+    def get_by_id(self, chat: Chat, message_id: str) -> Optional[Message]:
+        return chat.get_message_by_id(message_id)
+
+    def page(self, chat: Chat, before: Optional[int] = None, after: Optional[int] = None,
+             limit: Optional[int] = None) -> dict:
+        start, end = chat.page_bounds(before, after, limit)
+        return {
+            "messages": chat.get_messages(before, after, limit),
+            "hasMoreBefore": start > 0,
+            "hasMoreAfter": end < chat.last_seq(),
+        }
+
+    def mark_read(self, chat: Chat, user_id, message: Message) -> bool:
+        return chat.mark_message_seen(user_id, message)
+
+    def mark_all_read(self, chat: Chat, user_id) -> Optional[Message]:
+        return chat.mark_all_as_seen(user_id)
+
+    def unread_count(self, chat: Chat, user_id) -> int:
+        return chat.get_unread_count(user_id)
+
+    def search(self, chats: List[Chat], query: str, limit: int, before: Optional[str] = None) -> dict:
+        return self.search_index.search(chats, query, limit, before)
+
+
+class Storage:
+    """The four repositories the app runs against, plus the optional persistence and history helpers."""
+
+    def __init__(self):
+        self.kind = None
+        self.users: UserRepo = None
+        self.friends: FriendRepo = None
+        self.chats: ChatRepo = None
+        self.messages: MessageRepo = None
+        self.backend = None
+        self.wal = None
+        self.snapshots = None
+        self.history = None
+
+    def flush(self):
+        """Waits until every write so far has reached durable storage (no-op in memory)."""
+        if self.wal is not None:
+            self.wal.flush()
+        if self.backend is not None:
+            self.backend.flush()
+
+
+class StartupReport:
+    """Wall-clock time of each startup phase (loading, log replay), printed once storage is ready."""
+
+    def __init__(self, kind: str):
+        self.kind = kind
+        self.phases = []  # (name, seconds)
+        self.details = {}
+
+    @contextmanager
+    def phase(self, name: str):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases.append((name, time.perf_counter() - started))
+
+    def print(self):
+        timings = ", ".join(f"{name} {seconds:.3f}s" for name, seconds in self.phases)
+        total = sum(seconds for _, seconds in self.phases)
+        print(f"Storage ({self.kind}) ready in {total:.3f}s: {timings}")
+        for name, value in self.details.items():
+            print(f"  {name}: {value}")
+
+
+# The process-wide storage, filled in by configure_storage() at startup
+storage = Storage()
+
+def _backend_for_url(database_url: str) -> str:
+    if database_url and database_url.startswith("sqlite"):
+        return "sqlite"
+    if database_url and database_url.startswith("postgres"):
+        return "postgres"
+    raise ValueError(f"Cannot tell the storage backend from DATABASE_URL '{database_url}'.")
+
+def configure_storage(kind: str = "memory", database_url: Optional[str] = None,
+                      max_batch: int = 500, max_delay: float = 0.05,
+                      wal_dir: Optional[str] = None, wal_durability: str = "batched",
+                      snapshot_dir: Optional[str] = None, history_dir: Optional[str] = None,
+                      history_idle_seconds: float = 3600) -> Storage:
+    """
+    Sets up the process-wide storage. `kind` is one of BACKENDS; "sql" is
+    accepted too and picks sqlite or postgres from the database URL.
+
+    With `wal_dir`, every store mutation is also logged locally (see
+    app/wal.py) and the log is replayed on top of whatever was loaded.
+    With `snapshot_dir` (memory backend only, and only together with
+    `wal_dir`), startup loads the latest snapshot instead of the seed data
+    and replays just the log tail after it (see app/snapshot.py). With `history_dir`, the history of chats idle
+    for `history_idle_seconds` can be sealed to memory-mapped files (see
+    app/message_segment.py). A timing report of the phases is printed.
+    """
+    if kind == "sql":
+        kind = _backend_for_url(database_url)
+    if kind not in BACKENDS:
+        raise ValueError(f"Unknown storage backend '{kind}'. Must be one of {', '.join(BACKENDS)}.")
+    if snapshot_dir and kind != "memory":
+        raise ValueError("Snapshots are only used with the memory backend; SQL backends reload from the database.")
+    if snapshot_dir and not wal_dir:
+        raise ValueError("Snapshots need a write-ahead log (WAL_DIR); without one every change made after the "
+                         "latest snapshot is lost on restart.")
+
+    stores = (database.users, database.friendships, database.friendrequests, database.chats)
+    report = StartupReport(kind)
+    first_segment = 0
+
+    if wal_dir:
+        storage.wal = WriteAheadLog(wal_dir, durability=wal_durability)
+    if snapshot_dir:
+        storage.snapshots = Snapshotter(snapshot_dir, *stores, wal=storage.wal)
+
+    with report.phase("load"):
+        if kind != "memory":
+            if _backend_for_url(database_url) != kind:
+                raise ValueError(f"DATABASE_URL does not point at a {kind} database.")
+            storage.backend = database.load_persisted_state(database_url, max_batch=max_batch, max_delay=max_delay)
+        else:
+            restored = storage.snapshots.restore_latest() if storage.snapshots else None
+            if restored:
+                report.details["snapshot"] = restored
+                first_segment = restored["wal_segment"]
+            else:
+                database.create_users()
+                database.create_friendships()
+                database.create_friend_requests()
+                # database.create_chats()
+
+    if storage.wal is not None:
+        with report.phase("replay"):
+            report.details["replayed records"] = storage.wal.replay_into(*stores, first_segment=first_segment)
+        database.add_observer(storage.wal)
+        atexit.register(storage.wal.close)
+
+    with report.phase("search index"):
+        database.users.search_index.merge_pending()
+
+    if history_dir:
+        storage.history = HistorySealer(history_dir, database.chats, idle_seconds=history_idle_seconds)
+
+    # After replay, which may have brought back entities with higher ids
+    database.seed_id_sequences()
+    report.print()
+
+    storage.kind = kind
+    storage.users = MemoryUserRepo(database.users, database.user_ids)
+    storage.friends = MemoryFriendRepo(database.friendships, database.friendrequests,
+                                       database.friendship_ids, database.friendrequest_ids)
+    storage.chats = MemoryChatRepo(database.chats)
+    message_search = MessageSearchIndex()
+    database.add_observer(message_search)
+    storage.messages = MemoryMessageRepo(message_search)
+    return storage
@@ -2,7 +2,6 @@ from flask import jsonify, request, abort
 from flask_socketio import SocketIO
 from flask_jwt_extended import (
     create_access_token, 
-    jwt_required, 
     get_jwt_identity,
     get_jwt
 )
@@ -12,9 +11,10 @@ import functools
 
 
 # Import data lists and classes
+from app.auth import authenticate_request, current_user
 from app.chat import Chat, ChatType
-from app.database import users, friendships, friendrequests
-from app.database import user_chats, chats, get_user_pair_key, one_on_one_index
+from app.passwords import HashingBusy
+from app.repositories import storage
 from app.user import User, Role
 from app.friendship import Friendship
 from app.friendrequest import FriendRequest, RequestStatus
@@ -26,63 +26,64 @@ from app.friendrequest import FriendRequest, RequestStatus
     traffic to the backend. Ask Vlad for more info.
 """
 
+# Result sizes for /search-users and /search-messages (?limit=N)
+SEARCH_DEFAULT_LIMIT = 20
+SEARCH_MAX_LIMIT = 100
+
+# Longest user name, username, email and chat name: the String(255) columns of app/persistence.py
+MAX_NAME_LENGTH = 255
+
 # --- Helper Functions ---
 
+def too_long(*values) -> bool:
+    """True if any of the string values would not fit a name column."""
+    return any(isinstance(value, str) and len(value) > MAX_NAME_LENGTH for value in values)
+
 def find_user_by_id(user_id: int) -> User | None:
-    """Finds a user in the global 'users' list by their ID."""
-    return next((user for user in users if user.userId == user_id), None)
+    """Finds a user by their ID."""
+    return storage.users.get(user_id)
 
 def find_user_by_username(username: str) -> User | None:
     """Finds a user by username (case-insensitive check)."""
-    return next((user for user in users if user.username.lower() == username.lower()), None)
+    return storage.users.get_by_username(username)
 
 def find_user_by_email(email: str) -> User | None:
     """Finds a user by email (case-insensitive check)."""
-    return next((user for user in users if user.email.lower() == email.lower()), None)
+    return storage.users.get_by_email(email)
 
 def find_friend_request_by_id(request_id: int) -> FriendRequest | None:
     """Finds a friend request by its ID."""
-    return next((req for req in friendrequests if req.requestId == request_id), None)
+    return storage.friends.get_request(request_id)
 
 def find_pending_request(user1_id: int, user2_id: int) -> FriendRequest | None:
     """Finds a PENDING request between two users, regardless of direction."""
-    for req in friendrequests:
-        if req.status == RequestStatus.PENDING:
-            if (req.senderId == user1_id and req.receiverId == user2_id) or \
-               (req.senderId == user2_id and req.receiverId == user1_id):
-                return req
-    return None
+    return storage.friends.find_pending_request(user1_id, user2_id)
 
 def find_friendship(user1_id: int, user2_id: int) -> Friendship | None:
     """Finds an existing friendship between two users."""
-    # Ensure consistent order for lookup, matching the Friendship class logic
-    u1 = min(user1_id, user2_id)
-    u2 = max(user1_id, user2_id)
-    return next((f for f in friendships if f.user1Id == u1 and f.user2Id == u2), None)
+    return storage.friends.find_friendship(user1_id, user2_id)
 
-def get_next_id(data_list: list, id_field_name: str) -> int:
-    """Generates the next available ID for a list of objects."""
-    if not data_list:
-        return 1
-    return max(getattr(item, id_field_name) for item in data_list) + 1
+def hashing_busy_response():
+    """503 for requests refused because the password hashing pool is saturated."""
+    response = jsonify({"error": "Server busy, please retry shortly"})
+    response.headers["Retry-After"] = "1"
+    return response, 503
 
 # --- JWT Auth Middleware ---
 def jwt_auth_required(fn):
     """
     Custom decorator that combines jwt_required with additional checks.
     This will ensure all routes are protected by JWT authentication.
+    The caller is resolved once (see app/auth.py): handlers get it from
+    current_user() and its id from get_jwt_identity(), and tokens seen
+    before skip signature verification.
     """
     @functools.wraps(fn)
-    @jwt_required()  # Require JWT for all routes using this decorator
     def wrapper(*args, **kwargs):
-        # Get the current user ID from the JWT token
-        current_user_id = get_jwt_identity()
-        
-        # Check if the user exists in the database
-        user = find_user_by_id(current_user_id)
-        if not user:
+        # Verify the JWT and check that its user still exists
+        if not authenticate_request():
             return jsonify({"error": "Unauthorized: User not found"}), 401
-            
+
         # Call the original function
         return fn(*args, **kwargs)
     return wrapper
@@ -116,8 +117,14 @@ def register_routes(app):
             user = find_user_by_email(data["email"])
             
         # If user not found or password doesn't match
-        if not user or not user.check_password(data["password"]):
-            return jsonify({"error": "Invalid credentials"}), 401
+        try:
+            hash_method = user.hash_method if user else None
+            if not user or not user.check_password(data["password"]):
+                return jsonify({"error": "Invalid credentials"}), 401
+        except HashingBusy:
+            return hashing_busy_response()
+        if user.hash_method != hash_method:
+            storage.users.update(user)  # The hash was upgraded to the configured cost
             
         # Generare token JWT
         access_token = create_access_token(
@@ -138,7 +145,7 @@ def register_routes(app):
     @app.route("/messaging-api/users", methods=["GET"], strict_slashes=False)
     @jwt_auth_required
     def get_all_users():
-        return jsonify({"users": [user.to_dict() for user in users]})
+        return jsonify({"users": [user.to_dict() for user in storage.users.all()]})
 
     # === User Registration ===
     @app.route("/messaging-api/register", methods=["POST"], strict_slashes=False)
@@ -155,6 +162,8 @@ def register_routes(app):
         # Basic validation
         if not data["name"] or not data["username"] or not data["email"] or "@" not in data["email"]:
              return jsonify({"error": "Invalid name, username, or email format"}), 400
+        if too_long(data["name"], data["username"], data["email"]):
+             return jsonify({"error": f"Name, username and email must be at most {MAX_NAME_LENGTH} characters long"}), 400
         if len(data["password"]) < 6:
              return jsonify({"error": "Password must be at least 6 characters long"}), 400
 
@@ -165,7 +174,7 @@ def register_routes(app):
             return jsonify({"error": f"Email '{data['email']}' already registered"}), 409
 
         try:
-            new_user_id = get_next_id(users, "userId")
+            new_user_id = storage.users.next_id()
             new_user = User(
                 userId=new_user_id,
                 name=data["name"],
@@ -175,8 +184,10 @@ def register_routes(app):
                 role=Role.USER, # Default role
                 status="active" # Default status
             )
-            users.append(new_user)
+            storage.users.add(new_user)
             return jsonify(new_user.to_dict()), 201 # 201 Created
+        except HashingBusy:
+            return hashing_busy_response()
         except (ValueError, TypeError) as e:
              # Catch potential errors from User class validation
              return jsonify({"error": str(e)}), 400
@@ -220,14 +231,14 @@ def register_routes(app):
             return jsonify({"error": "A pending friend request already exists between these users"}), 409
 
         try:
-            new_request_id = get_next_id(friendrequests, "requestId")
+            new_request_id = storage.friends.next_request_id()
             new_request = FriendRequest(
                 requestId=new_request_id,
                 senderId=sender_id,
                 receiverId=receiver_id
                 # Status defaults to PENDING
             )
-            friendrequests.append(new_request)
+            storage.friends.add_request(new_request)
             return jsonify(new_request.to_dict()), 201
         except (ValueError, TypeError) as e:
             return jsonify({"error": str(e)}), 400
@@ -266,13 +277,13 @@ def register_routes(app):
         if friend_request.accept():
             # Create the friendship
             try:
-                new_friendship_id = get_next_id(friendships, "friendshipId")
+                new_friendship_id = storage.friends.next_friendship_id()
                 new_friendship = Friendship(
                     friendshipId=new_friendship_id,
                     user1Id=friend_request.senderId,
                     user2Id=friend_request.receiverId
                 )
-                friendships.append(new_friendship)
+                storage.friends.add_friendship(new_friendship)
                 # Return both the updated request and the new friendship
                 return jsonify({
                     "message": "Friend request accepted",
@@ -347,15 +358,8 @@ def register_routes(app):
         if not target_user:
             return jsonify({"error": f"User with ID {user_id} not found."}), 404
 
-        user_friend_ids = set()
-        for friendship in friendships:
-            if friendship.involves_user(user_id):
-                other_user_id = friendship.get_other_user(user_id)
-                if other_user_id:
-                    user_friend_ids.add(other_user_id)
-
         friend_users = []
-        for friend_id in user_friend_ids:
+        for friend_id in storage.friends.friend_ids(user_id):
             friend_user = find_user_by_id(friend_id)
             if friend_user:
                 friend_users.append(friend_user.to_dict())
@@ -394,21 +398,18 @@ def register_routes(app):
             return jsonify({"error": "These users are not friends"}), 404
 
         # Remove the friendship
-        friendships.remove(friendship_to_remove)
+        storage.friends.remove_friendship(friendship_to_remove)
         return jsonify({"message": f"Friendship between user {user_id} and user {friend_id} removed"}), 200
 
     # === User Account Management ===
     @app.route("/messaging-api/delete-user/<int:user_id>", methods=["DELETE"], strict_slashes=False)
     @jwt_auth_required
     def delete_user(user_id):
-        global users, friendships, friendrequests # Declare modification of globals
-
         # Verify if userId is the same as the authenticated user or admin
         current_user_id = get_jwt_identity()
-        current_user = find_user_by_id(current_user_id)
         
         # Only allow admin or the user themselves to delete the account
-        if current_user.role != Role.ADMIN and current_user_id != user_id:
+        if current_user().role != Role.ADMIN and current_user_id != user_id:
             return jsonify({"error": "Unauthorized: You can only delete your own account unless you're an admin"}), 403
 
         user_to_delete = find_user_by_id(user_id)
@@ -416,19 +417,10 @@ def register_routes(app):
             return jsonify({"error": f"User with ID {user_id} not found"}), 404
 
         # Remove the user
-        users.remove(user_to_delete)
+        storage.users.remove(user_to_delete)
 
-        # Remove associated friendships
-        # Iterate over a copy of the list when removing items
-        friendships_to_keep = [f for f in friendships if not f.involves_user(user_id)]
-        friendships[:] = friendships_to_keep # Modify list in place
-
-        # Remove associated friend requests (sent or received)
-        requests_to_keep = [
-            req for req in friendrequests
-            if req.senderId != user_id and req.receiverId != user_id
-        ]
-        friendrequests[:] = requests_to_keep # Modify list in place
+        # Remove associated friendships and friend requests (sent or received)
+        storage.friends.remove_user(user_id)
 
         return jsonify({"message": f"User {user_id} and associated data deleted successfully"}), 200
 
@@ -440,9 +432,7 @@ def register_routes(app):
         if current_user_id != user_id:
             return jsonify({"error": "Unauthorized: You can only change your own name"}), 403
             
-        user = find_user_by_id(user_id)
-        if not user:
-            return jsonify({"error": f"User with ID {user_id} not found"}), 404
+        user = current_user()  # Resolved once by jwt_auth_required
 
         data = request.get_json()
         if not data or "newName" not in data or not data["newName"]:
@@ -451,8 +441,10 @@ def register_routes(app):
         new_name = data["newName"]
         if not isinstance(new_name, str):
              return jsonify({"error": "'newName' must be a string"}), 400
+        if too_long(new_name):
+             return jsonify({"error": f"'newName' must be at most {MAX_NAME_LENGTH} characters long"}), 400
 
-        user.name = new_name
+        storage.users.rename(user, new_name)
         return jsonify(user.to_dict()), 200
 
     @app.route("/messaging-api/change-password/<int:user_id>", methods=["PATCH"], strict_slashes=False)
@@ -463,9 +455,7 @@ def register_routes(app):
         if current_user_id != user_id:
             return jsonify({"error": "Unauthorized: You can only change your own password"}), 403
             
-        user = find_user_by_id(user_id)
-        if not user:
-            return jsonify({"error": f"User with ID {user_id} not found"}), 404
+        user = current_user()  # Resolved once by jwt_auth_required
 
         data = request.get_json()
         if not data:
@@ -476,8 +466,12 @@ def register_routes(app):
             return jsonify({"error": "Missing 'currentPassword' or 'newPassword' in request body"}), 400
 
         # Verify current password
-        if not user.check_password(data["currentPassword"]):
-            return jsonify({"error": "Current password is incorrect"}), 401
+        try:
+            # No upgrade: the hash is replaced right below anyway
+            if not user.check_password(data["currentPassword"], upgrade=False):
+                return jsonify({"error": "Current password is incorrect"}), 401
+        except HashingBusy:
+            return hashing_busy_response()
 
         # Validate new password
         new_password = data["newPassword"]
@@ -486,7 +480,10 @@ def register_routes(app):
 
         try:
             user.password = new_password # Uses the setter, which hashes
+            storage.users.update(user)
             return jsonify({"message": "Password updated successfully"}), 200
+        except HashingBusy:
+            return hashing_busy_response()
         except ValueError as e: # Catch validation errors from the setter
             return jsonify({"error": str(e)}), 400
 
@@ -499,9 +496,7 @@ def register_routes(app):
         if current_user_id != user_id:
             return jsonify({"error": "Unauthorized: You can only change your own status"}), 403
             
-        user = find_user_by_id(user_id)
-        if not user:
-            return jsonify({"error": f"User with ID {user_id} not found"}), 404
+        user = current_user()  # Resolved once by jwt_auth_required
 
         data = request.get_json()
         if not data or "newStatus" not in data:
@@ -509,6 +504,7 @@ def register_routes(app):
 
         new_status = data["newStatus"]
         user.status = new_status
+        storage.users.update(user)
         return jsonify(user.to_dict()), 200
 
     # --- (Optional) Add a route to view friend requests for a user ---
@@ -517,9 +513,8 @@ def register_routes(app):
     def get_friend_requests_for_user(user_id):
         # Verify if userId is the same as the authenticated user or admin
         current_user_id = get_jwt_identity()
-        current_user = find_user_by_id(current_user_id)
         
-        if current_user_id != user_id and current_user.role != Role.ADMIN:
+        if current_user_id != user_id and current_user().role != Role.ADMIN:
             return jsonify({"error": "Unauthorized: You can only view your own friend requests"}), 403
             
         target_user = find_user_by_id(user_id)
@@ -528,20 +523,18 @@ def register_routes(app):
 
         # Find requests where the user is the receiver (incoming)
         incoming_requests = []
-        for req in friendrequests:
-            if req.receiverId == user_id and req.status == RequestStatus.PENDING:
-                request_data = req.to_dict()
-                # Find the sender user to include their details
-                sender = find_user_by_id(req.senderId)
-                if sender:
-                    request_data["senderName"] = sender.name
-                    request_data["senderUsername"] = sender.username
-                incoming_requests.append(request_data)
+        for req in storage.friends.incoming(user_id, RequestStatus.PENDING):
+            request_data = req.to_dict()
+            # Find the sender user to include their details
+            sender = find_user_by_id(req.senderId)
+            if sender:
+                request_data["senderName"] = sender.name
+                request_data["senderUsername"] = sender.username
+            incoming_requests.append(request_data)
 
         # Find requests where the user is the sender (outgoing)
         outgoing_requests = [
-            req.to_dict() for req in friendrequests
-            if req.senderId == user_id and req.status == RequestStatus.PENDING
+            req.to_dict() for req in storage.friends.outgoing(user_id, RequestStatus.PENDING)
         ]
 
         # Optionally include non-pending requests too
@@ -557,94 +550,117 @@ def register_routes(app):
     @app.route("/messaging-api/search-users", methods=["GET"], strict_slashes=False)
     @jwt_auth_required
     def search_users():
-        query = request.args.get('query', '').lower()
+        query = request.args.get('query', '').strip()
         if not query or len(query) < 2:
             return jsonify({"users": []}), 200
-            
-        # Get current user ID
+        limit = request.args.get("limit", default=SEARCH_DEFAULT_LIMIT, type=int)
+        if limit <= 0:
+            return jsonify({"error": "limit must be a positive integer"}), 400
+        limit = min(limit, SEARCH_MAX_LIMIT)
+
         current_user_id = get_jwt_identity()
-        
-        # Find all users matching the query
-        matching_users = []
-        for user in users:
-            # Skip the current user
-            if user.userId == current_user_id:
-                continue
-                
-            # Check if name or username contains the query
-            if query in user.name.lower() or query in user.username.lower():
-                # Check if already friends
-                is_friend = find_friendship(current_user_id, user.userId) is not None
-                
-                # Skip if already friends
-                if is_friend:
-                    continue
-                    
-                # Check if there's a pending request
-                request_sent = find_pending_request(current_user_id, user.userId) is not None
-                
-                # Add user to results
-                matching_users.append({
-                    "userId": user.userId,
-                    "name": user.name,
-                    "username": user.username,
-                    "requestSent": request_sent
-                })
-        
+        friend_ids = storage.friends.friend_ids(current_user_id)
+
+        # Ranked matches from the search index, skipping the current user and their friends
+        matches = storage.users.search(
+            query, limit, exclude=lambda user_id: user_id == current_user_id or user_id in friend_ids)
+
+        matching_users = [{
+            "userId": user.userId,
+            "name": user.name,
+            "username": user.username,
+            "requestSent": find_pending_request(current_user_id, user.userId) is not None
+        } for user in matches]
+
         return jsonify({"users": matching_users})
     
     @app.route("/messaging-api/get-chats", methods=["GET"], strict_slashes=False)
     @jwt_auth_required
     def get_chats_for_user():
-        user_id = str(get_jwt_identity())
-        chat_ids = user_chats.get(user_id, [])
-        result = []
-        
-        for chat_id in chat_ids:
-            if chat_id in chats:
-                chat = chats[chat_id]
-                chat_dict = chat.to_dict(user_id)  # Pass user_id to include unread count
-                result.append(chat_dict)
-        
-        # Sort chats by last message timestamp (most recent first)
-        result.sort(key=lambda x: x.get('lastMessage', {}).get('sentAt', ''), reverse=True)
+        user_id = get_jwt_identity()
+
+        # Optional paging: ?limit=N&before=<nextBefore of the previous page>
+        limit = request.args.get("limit", type=int)
+        if limit is not None and limit <= 0:
+            return jsonify({"error": "limit must be a positive integer"}), 400
+
+        # The chat store keeps each user's chats ordered by last activity (most recent first)
+        try:
+            page, next_before = storage.chats.recent_chats_for_user(
+                user_id, limit=limit, before=request.args.get("before"))
+        except ValueError:
+            return jsonify({"error": "Invalid before cursor"}), 400
+        result = [chat.to_dict(user_id) for chat in page]  # Pass user_id to include unread count
         
-        return jsonify({"chats": result})
+        return jsonify({"chats": result, "nextBefore": next_before})
 
     @app.route("/messaging-api/get-messages/<string:chat_id>", methods=["GET"])
     @jwt_auth_required
     def get_messages(chat_id):
-        if chat_id not in chats:
+        chat = storage.chats.get(chat_id)
+        if not chat:
             return jsonify({"error": "Chat not found"}), 404
-        return jsonify({"messages": chats[chat_id].get_messages()})
+
+        # Optional cursor pagination over message sequence numbers:
+        # ?limit=N&before=<seq> loads older history, ?limit=N&after=<seq> catches up
+        limit = request.args.get("limit", type=int)
+        before = request.args.get("before", type=int)
+        after = request.args.get("after", type=int)
+        if limit is not None and limit <= 0:
+            return jsonify({"error": "limit must be a positive integer"}), 400
+
+        return jsonify(storage.messages.page(chat, before, after, limit))
+
+    @app.route("/messaging-api/search-messages", methods=["GET"], strict_slashes=False)
+    @jwt_auth_required
+    def search_messages():
+        """
+        Messages containing every word of ?query=, newest first, in the
+        caller's chats (or only in ?chatId=). Each hit carries chatId and seq,
+        so /get-messages/<chatId>?after=<seq - 1> opens history at it.
+        Paged with ?limit=N&before=<nextBefore of the previous page>.
+        """
+        user_id = get_jwt_identity()
+        query = request.args.get("query", "").strip()
+        if not query:
+            return jsonify({"error": "query is required"}), 400
+        limit = request.args.get("limit", default=SEARCH_DEFAULT_LIMIT, type=int)
+        if limit <= 0:
+            return jsonify({"error": "limit must be a positive integer"}), 400
+        limit = min(limit, SEARCH_MAX_LIMIT)
+
+        chat_id = request.args.get("chatId")
+        if chat_id is not None:
+            chat = storage.chats.get(chat_id)
+            if not chat or not chat.has_member(user_id):
+                return jsonify({"error": "Chat not found"}), 404
+            chats = [chat]
+        else:
+            chats = storage.chats.chats_for_user(user_id)
+
+        try:
+            result = storage.messages.search(chats, query, limit, request.args.get("before"))
+        except ValueError:
+            return jsonify({"error": "Invalid before cursor"}), 400
+        return jsonify(result)
 
     @app.route("/messaging-api/get-members/<string:chat_id>", methods=["GET"])
     @jwt_auth_required
     def get_members(chat_id):
         """Get full UserData objects for chat members"""
-        if chat_id not in chats:
+        chat = storage.chats.get(chat_id)
+        if not chat:
             return jsonify({"error": "Chat not found"}), 404
         
-        chat = chats[chat_id]
-        
-        # Get the chat members (which have userIds)
-        chat_members = chat.members  # This gives us ChatMember objects
-        
-        # Look up full user data for each member
+        # Look up full user data for each member (member ids are normalized ints)
         full_members = []
-        for chat_member in chat_members:
-            # Find the full user data by userId
-            # Convert to int since find_user_by_id expects int, but chat_member.user_id might be string
-            try:
-                user_id = int(chat_member.user_id)
-                user = find_user_by_id(user_id)
-                if user:
-                    full_members.append(user.to_dict())
-                else:
-                    # Fallback if user not found - this shouldn't happen in a real app
-                    print(f"Warning: User {chat_member.user_id} not found in users list")
-            except (ValueError, TypeError) as e:
-                print(f"Error converting user_id {chat_member.user_id} to int: {e}")
+        for user_id in chat.member_ids():
+            user = find_user_by_id(user_id)
+            if user:
+                full_members.append(user.to_dict())
+            else:
+                # Fallback if user not found - this shouldn't happen in a real app
+                print(f"Warning: User {user_id} not found in users list")
         
         return jsonify({"members": full_members})
     
@@ -659,11 +675,15 @@ def register_routes(app):
         name = data.get("name", None)
         member_ids = data.get("memberIds", [])
 
-        # Ensure member IDs are strings (matching your user_id type)
+        # Member IDs may arrive as strings or ints; chats key members by int
         member_ids = list(map(str, member_ids))
+        if not all(member_id.isdigit() for member_id in member_ids):
+            return jsonify({"error": "memberIds must be user IDs"}), 400
         
         if chat_type not in ["one_on_one", "group"]:
             return jsonify({"error": "Invalid chat type"}), 400
+        if too_long(name):
+            return jsonify({"error": f"Chat name must be at most {MAX_NAME_LENGTH} characters long"}), 400
 
         # Personal chat must be exactly two members: you and one other
         if chat_type == "one_on_one":
@@ -671,12 +691,11 @@ def register_routes(app):
                 return jsonify({"error": "One-on-one chats must include exactly one *other* user"}), 400
 
             other_id = member_ids[0]
-            key = get_user_pair_key(user_id, other_id)
 
-            if key in one_on_one_index:
-                existing_chat_id = one_on_one_index[key]
+            existing_chat = storage.chats.find_one_on_one(user_id, other_id)
+            if existing_chat:
                 return jsonify({
-                    "chat": chats[existing_chat_id].to_dict(),
+                    "chat": existing_chat.to_dict(),
                     "message": "One-on-one chat already exists"
                 }), 200
 
@@ -684,12 +703,7 @@ def register_routes(app):
             chat = Chat(chat_type=ChatType.ONE_ON_ONE)
             chat.add_member(user_id)
             chat.add_member(other_id)
-
-            chats[chat.chat_id] = chat
-            one_on_one_index[key] = chat.chat_id
-
-            user_chats[user_id].append(chat.chat_id)
-            user_chats[other_id].append(chat.chat_id)
+            storage.chats.add(chat)
 
             return jsonify({"chat": chat.to_dict()}), 201
 
@@ -699,9 +713,7 @@ def register_routes(app):
         for uid in member_ids:
             chat.add_member(uid)
 
-        chats[chat.chat_id] = chat
-        for member in chat.members:
-            user_chats[member.user_id].append(chat.chat_id)
+        storage.chats.add(chat)
 
         return jsonify({"chat": chat.to_dict()}), 201
     
@@ -710,18 +722,15 @@ def register_routes(app):
     @jwt_auth_required
     def get_unread_counts():
         """Get unread message counts for all user's chats"""
-        user_id = str(get_jwt_identity())
-        chat_ids = user_chats.get(user_id, [])
+        user_id = get_jwt_identity()
         
         unread_counts = {}
         total_unread = 0
         
-        for chat_id in chat_ids:
-            if chat_id in chats:
-                chat = chats[chat_id]
-                unread_count = chat.get_unread_count(user_id)
-                unread_counts[chat_id] = unread_count
-                total_unread += unread_count
+        for chat in storage.chats.chats_for_user(user_id):
+            unread_count = storage.messages.unread_count(chat, user_id)
+            unread_counts[chat.chat_id] = unread_count
+            total_unread += unread_count
         
         return jsonify({
             "unreadCounts": unread_counts,
@@ -732,27 +741,38 @@ def register_routes(app):
     @jwt_auth_required
     def get_chat_members(chat_id):
         """Get ChatMember objects (with read status) for a specific chat"""
-        if chat_id not in chats:
+        chat = storage.chats.get(chat_id)
+        if not chat:
             return jsonify({"error": "Chat not found"}), 404
         
-        chat = chats[chat_id]
-        
         # Return the actual ChatMember objects with read status
-        chat_members = []
-        for member in chat.members:
-            chat_members.append(member.to_dict())
-        
-        return jsonify({"members": chat_members})
+        return jsonify({"members": chat.get_members()})
+
+    # === Delta sync for reconnecting clients ===
+    @app.route("/messaging-api/sync", methods=["POST"], strict_slashes=False)
+    @jwt_auth_required
+    def sync():
+        """
+        Body: {"chats": {"<chatId>": {"lastSeq": n, "revision": r}, ...}, "limit": 100}
+        Returns only what changed since those cursors (see ChatStore.sync_for_user).
+        """
+        data = request.get_json(silent=True) or {}
+        limit = data.get("limit")
+        if limit is not None and (not isinstance(limit, int) or isinstance(limit, bool) or limit <= 0):
+            return jsonify({"error": "limit must be a positive integer"}), 400
+
+        try:
+            result = storage.chats.sync_for_user(get_jwt_identity(), data.get("chats", {}), limit)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        return jsonify(result), 200
 
     @app.route("/messaging-api/validate-token", methods=["GET"], strict_slashes=False)
     @jwt_auth_required
     def validate_token():
         """Validate the JWT token and return user data"""
-        current_user_id = get_jwt_identity()
-        user = find_user_by_id(current_user_id)
-        if not user:
-            return jsonify({"error": "Unauthorized: User not found"}), 401
-            
+        # jwt_auth_required has already verified the token and found its user
+        user = current_user()
         return jsonify({
             "user": user.to_dict(),
             "message": "Token is valid"
@@ -0,0 +1,167 @@
+"""
+Typeahead index over users' names and usernames.
+
+Two structures, both over case-folded text and kept up to date by UserStore
+on every add, rename and removal:
+
+  prefix index     the sorted distinct usernames and name terms (the whole
+                   name and each of its words), each mapped to its users; a
+                   prefix query is a range scan starting at the query,
+  gram postings    every two- and three-character substring of a username
+                   or name, mapped to an array of the user ids containing
+                   it; a two-character query reads its own posting, a
+                   longer one scans the shortest posting of its trigrams
+                   and verifies each candidate.
+
+New terms are buffered and merged into the sorted lists in one pass on the
+next search or removal (or by merge_pending() once startup has loaded
+everyone), so loading a million users does not pay for a million sorted
+inserts. Postings are append-only arrays: removed or renamed users leave
+stale ids behind, which verification skips, and the postings are rebuilt
+once stale entries make up half of them.
+"""
+
+from array import array
+from collections import defaultdict
+from functools import partial
+from typing import Iterator
+
+from sortedcontainers import SortedList
+
+# Sorts after every character a case-folded term can contain
+_TERM_END = "\U0010ffff"
+
+def fold(text: str) -> str:
+    return text.casefold()
+
+def trigrams(text: str) -> set:
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+def grams(*texts: str) -> set:
+    """The two- and three-character substrings of `texts`, the keys of the postings."""
+    return {text[i:i + n] for text in texts for n in (2, 3) for i in range(len(text) - n + 1)}
+
+
+class UserSearchIndex:
+
+    def __init__(self):
+        self._fields: dict[int, tuple] = {}  # user id -> (folded username, folded name)
+        self._username_ids: dict[str, int] = {}  # usernames are unique
+        self._name_ids: dict[str, set] = defaultdict(set)
+        self._usernames = SortedList()
+        self._names = SortedList()
+        self._pending_usernames = []
+        self._pending_names = []
+        self._postings: dict[str, array] = defaultdict(partial(array, "q"))
+        self._posting_entries = 0
+        self._stale_entries = 0
+
+    @staticmethod
+    def _name_terms(name: str) -> set:
+        return {name, *name.split()}
+
+    def add(self, user_id: int, username: str, name: str):
+        if user_id in self._fields:
+            self.remove(user_id)
+        username, name = fold(username), fold(name)
+        self._fields[user_id] = (username, name)
+        self._username_ids[username] = user_id
+        self._pending_usernames.append(username)
+        for term in self._name_terms(name):
+            ids = self._name_ids[term]
+            if not ids:
+                self._pending_names.append(term)
+            ids.add(user_id)
+
+        user_grams = grams(username, name)
+        postings = self._postings
+        for gram in user_grams:
+            postings[gram].append(user_id)
+        self._posting_entries += len(user_grams)
+
+    def merge_pending(self):
+        """Moves buffered terms into the sorted lists."""
+        if self._pending_usernames:
+            self._usernames.update(self._pending_usernames)
+            self._pending_usernames = []
+        if self._pending_names:
+            self._names.update(self._pending_names)
+            self._pending_names = []
+
+    def remove(self, user_id: int):
+        fields = self._fields.pop(user_id, None)
+        if fields is None:
+            return
+        self.merge_pending()
+        username, name = fields
+        del self._username_ids[username]
+        self._usernames.discard(username)
+        for term in self._name_terms(name):
+            ids = self._name_ids[term]
+            ids.discard(user_id)
+            if not ids:
+                del self._name_ids[term]
+                self._names.discard(term)
+
+        self._stale_entries += len(grams(username, name))
+        if self._stale_entries * 2 > self._posting_entries:
+            self._rebuild_postings()
+
+    def _rebuild_postings(self):
+        postings = defaultdict(partial(array, "q"))
+        entries = 0
+        for user_id, (username, name) in self._fields.items():
+            user_grams = grams(username, name)
+            for gram in user_grams:
+                postings[gram].append(user_id)
+            entries += len(user_grams)
+        self._postings = postings
+        self._posting_entries = entries
+        self._stale_entries = 0
+
+    def clear(self):
+        self.__init__()
+
+    def search(self, query: str) -> Iterator[int]:
+        """
+        Yields the ids of matching users, best first: username prefix
+        matches, then name (or name word) prefix matches, then substring
+        matches. Lazy, so taking the first k costs roughly k steps plus one
+        posting scan. Single-character queries only match prefixes. The
+        index must not change while the iterator is in use, so consume it
+        without yielding to other green threads.
+        """
+        query = fold(query.strip())
+        if not query:
+            return
+        self.merge_pending()
+        seen = set()
+        for username in self._usernames.irange(query, query + _TERM_END):
+            user_id = self._username_ids.get(username)
+            if user_id is not None and user_id not in seen:
+                seen.add(user_id)
+                yield user_id
+        for term in self._names.irange(query, query + _TERM_END):
+            for user_id in self._name_ids.get(term, ()):
+                if user_id not in seen:
+                    seen.add(user_id)
+                    yield user_id
+
+        if len(query) < 2:
+            return
+        postings = []
+        for gram in trigrams(query) or {query}:  # a two-character query is a gram itself
+            posting = self._postings.get(gram)
+            if posting is None:
+                return
+            postings.append(posting)
+        for user_id in min(postings, key=len):
+            if user_id in seen:
+                continue
+            fields = self._fields.get(user_id)
+            if fields is not None and (query in fields[0] or query in fields[1]):
+                seen.add(user_id)
+                yield user_id
+
+    def __len__(self):
+        return len(self._fields)
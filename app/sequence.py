@@ -0,0 +1,79 @@
+import threading
+from typing import Callable, Iterable, Optional
+
+class IdSequence:
+    """
+    Monotonic integer ID allocator for one entity type.
+
+    IDs are handed out in O(1) from an in-process counter. The counter is
+    seeded once at startup from existing data (see seed_from). When a
+    persistent backend is in use, a block source can be bound: it is called
+    with a block size and must return the first ID of a freshly reserved
+    range (e.g. a database sequence advanced by that many values), so several
+    server processes never hand out the same ID.
+    """
+
+    def __init__(self, name: str, block_size: int = 1):
+        if block_size <= 0:
+            raise ValueError("block_size must be a positive integer.")
+        self.name = name
+        self.block_size = block_size
+        self._lock = threading.Lock()
+        self._next = 1
+        self._limit: Optional[int] = None # Exclusive end of the current block, if backed
+        self._block_source: Optional[Callable[[int], int]] = None
+
+    def bind(self, block_source: Callable[[int], int], block_size: Optional[int] = None):
+        """Backs this sequence with an external allocator (e.g. a database sequence)."""
+        with self._lock:
+            self._block_source = block_source
+            if block_size is not None:
+                self.block_size = block_size
+            self._limit = self._next # Force a block fetch on next allocation
+
+    def seed(self, last_id: int):
+        """Ensures the next ID handed out is greater than last_id."""
+        with self._lock:
+            if last_id >= self._next:
+                self._next = last_id + 1
+                if self._limit is not None:
+                    self._limit = self._next
+
+    def seed_from(self, items: Iterable, id_field_name: str):
+        """Seeds the sequence from existing objects. Meant to run once at startup."""
+        self.seed(max((getattr(item, id_field_name) for item in items), default=0))
+
+    def next(self) -> int:
+        """Returns the next ID."""
+        return self.reserve(1).start
+
+    def reserve(self, count: int) -> range:
+        """
+        Reserves a contiguous block of `count` IDs, e.g. for bulk imports.
+        Returns the reserved IDs as a range.
+        """
+        if count <= 0:
+            raise ValueError("count must be a positive integer.")
+        with self._lock:
+            if self._limit is not None and self._next + count > self._limit:
+                self._refill(count)
+            start = self._next
+            self._next += count
+            return range(start, start + count)
+
+    def _refill(self, count: int):
+        size = max(count, self.block_size)
+        while True:
+            start = self._block_source(size)
+            # Never go backwards if the external sequence lags local seeding
+            self._next = max(self._next, start)
+            self._limit = start + size
+            if self._next + count <= self._limit:
+                return
+
+    def peek(self) -> int:
+        """Returns the ID the next allocation would get, without allocating it."""
+        return self._next
+
+    def __repr__(self) -> str:
+        return f"IdSequence(name={self.name!r}, next={self._next!r})"
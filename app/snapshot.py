@@ -0,0 +1,172 @@
+"""
+Compact snapshots of the in-memory stores, for fast startup.
+
+A snapshot is one pickled file holding users, friendships, friend requests
+and chats as plain tuples, with every chat's messages stored as the raw
+MessageLog columns, so loading millions of messages is mostly memcpy.
+Sealed history segments are immutable files and are referenced by path.
+
+Taking a snapshot (Snapshotter.take):
+
+  1. the write-ahead log rolls to a new segment; the snapshot's log tail
+     starts there,
+  2. the stores are copied into plain data on the hub (columns are copied
+     as bytes, so this is short),
+  3. pickling, writing and fsyncing happen in eventlet's thread pool,
+  4. older snapshots and the log segments no kept snapshot needs are deleted.
+
+Mutations between steps 1 and 2 end up both in the snapshot and in the tail;
+log replay is idempotent, so that is harmless.
+
+On startup, restore_latest() loads the newest readable snapshot and the
+caller replays the log from the snapshot's segment on.
+"""
+
+import datetime
+import os
+import pickle
+import time
+import traceback
+from typing import Optional
+
+from app.chat import Chat, ChatType
+from app.friendrequest import FriendRequest
+from app.friendship import Friendship
+from app.message_log import MessageLog
+from app.user import User
+from app.offload import run_off_hub
+
+SNAPSHOT_MAGIC = b"CHATSNAP1\n"
+SNAPSHOT_SUFFIX = ".snap"
+
+def capture(users, friendships, friendrequests, chats) -> dict:
+    """Copies the stores into immutable plain data that can be pickled off the hub."""
+    return {
+        "taken_at": datetime.datetime.now(datetime.UTC),
+        "users": [(u.userId, u.name, u.email, u.username, u._password_hash, u.status, u.role.value, u.createdAt)
+                  for u in users],
+        "friendships": [(f.friendshipId, f.user1Id, f.user2Id, f.createdAt) for f in friendships],
+        "friend_requests": [(r.requestId, r.senderId, r.receiverId, r.status.value, r.createdAt)
+                            for r in friendrequests],
+        "chats": [(
+            chat.chat_id, chat.chat_type.value, chat.name, chat.created_at,
+            [(m.user_id, m.joined_at, m.last_read_seq, m.last_read_message_id, m.last_read_at)
+             for m in chat.members.values()],
+            dict(chat._unread_counts),
+            chat.messages.segment_paths(),
+            chat.messages.columns(),
+        ) for chat in chats.values()],
+    }
+
+def write_snapshot(state: dict, path: str):
+    """Writes a snapshot atomically: temp file, fsync, rename, fsync the directory."""
+    temp_path = path + ".tmp"
+    with open(temp_path, "wb") as snapshot:
+        snapshot.write(SNAPSHOT_MAGIC)
+        pickle.dump(state, snapshot, protocol=pickle.HIGHEST_PROTOCOL)
+        snapshot.flush()
+        os.fsync(snapshot.fileno())
+    os.replace(temp_path, path)
+    directory = os.open(os.path.dirname(path) or ".", os.O_RDONLY)
+    try:
+        os.fsync(directory)
+    finally:
+        os.close(directory)
+
+def read_snapshot(path: str) -> dict:
+    with open(path, "rb") as snapshot:
+        if snapshot.read(len(SNAPSHOT_MAGIC)) != SNAPSHOT_MAGIC:
+            raise ValueError(f"{path} is not a snapshot file.")
+        return pickle.load(snapshot)
+
+def load_into(state: dict, users, friendships, friendrequests, chats) -> dict:
+    """Fills empty stores from a snapshot. Returns counts of what was loaded."""
+    for (user_id, name, email, username, password_hash, status, role, created_at) in state["users"]:
+        users.add(User.restore(userId=user_id, name=name, email=email, username=username,
+                               password_hash=password_hash, status=status, role=role, createdAt=created_at))
+    for (friendship_id, user1_id, user2_id, created_at) in state["friendships"]:
+        friendships.add(Friendship(friendshipId=friendship_id, user1Id=user1_id, user2Id=user2_id,
+                                   createdAt=created_at))
+    for (request_id, sender_id, receiver_id, status, created_at) in state["friend_requests"]:
+        friendrequests.add(FriendRequest(requestId=request_id, senderId=sender_id, receiverId=receiver_id,
+                                         status=status, createdAt=created_at))
+
+    messages = 0
+    for (chat_id, chat_type, name, created_at, members, unread_counts, segment_paths, columns) in state["chats"]:
+        chat = Chat(ChatType(chat_type), name=name, chat_id=chat_id, created_at=created_at)
+        for (user_id, joined_at, last_read_seq, last_read_message_id, last_read_at) in members:
+            chat.restore_member(user_id, joined_at, last_read_seq, last_read_message_id, last_read_at)
+        chat.messages = MessageLog.from_columns(chat_id, *columns, segment_paths=segment_paths)
+        chat.finish_restore(unread_counts)
+        chats.add(chat)
+        messages += len(chat.messages)
+
+    return {"users": len(state["users"]), "friendships": len(state["friendships"]),
+            "friend_requests": len(state["friend_requests"]), "chats": len(state["chats"]),
+            "messages": messages}
+
+
+class Snapshotter:
+    """Takes snapshots of the given stores into `directory`, keeping the newest `keep`."""
+
+    def __init__(self, directory: str, users, friendships, friendrequests, chats, wal=None, keep: int = 2):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.stores = (users, friendships, friendrequests, chats)
+        self.wal = wal
+        self.keep = max(1, keep)
+
+    def paths(self) -> list:
+        """Snapshot files, oldest first."""
+        names = sorted(name for name in os.listdir(self.directory) if name.endswith(SNAPSHOT_SUFFIX))
+        return [os.path.join(self.directory, name) for name in names]
+
+    def take(self) -> str:
+        wal_segment = self.wal.roll() if self.wal is not None else 0
+        state = capture(*self.stores)
+        state["wal_segment"] = wal_segment
+        # Named <time>-<first log segment of the tail>, so pruning needs no reads
+        path = os.path.join(self.directory, f"{time.time_ns():020d}-{wal_segment:010d}{SNAPSHOT_SUFFIX}")
+        run_off_hub(write_snapshot, state, path)
+        self._prune()
+        return path
+
+    def _prune(self):
+        paths = self.paths()
+        for path in paths[:-self.keep]:
+            os.remove(path)
+        if self.wal is not None:
+            # The oldest kept snapshot still needs its tail, in case the newer ones are unreadable
+            oldest = os.path.basename(paths[-self.keep:][0])
+            self.wal.drop_segments_before(int(oldest[:-len(SNAPSHOT_SUFFIX)].split("-")[1]))
+
+    def restore_latest(self) -> Optional[dict]:
+        """
+        Loads the newest readable snapshot into the (empty) stores. Returns
+        its stats, including the log segment replay should start from, or
+        None if there is no usable snapshot.
+        """
+        for path in reversed(self.paths()):
+            try:
+                state = read_snapshot(path)
+            except Exception:
+                print(f"Snapshot: {path} is unreadable, trying an older one")
+                traceback.print_exc()
+                continue
+            stats = load_into(state, *self.stores)
+            stats["path"] = path
+            stats["wal_segment"] = state["wal_segment"]
+            return stats
+        return None
+
+    def run_periodically(self, interval: float):
+        """Background task: takes a snapshot every `interval` seconds."""
+        while True:
+            time.sleep(interval)
+            try:
+                started = time.perf_counter()
+                path = self.take()
+                print(f"Snapshot: wrote {path} in {time.perf_counter() - started:.2f}s")
+            except Exception:
+                print("Snapshot: taking a snapshot failed")
+                traceback.print_exc()
@@ -1,12 +1,12 @@
-from app.chat import Chat
+from app.chat import Chat, normalize_user_id
 from . import socketio
 
 from flask import request
 from flask_socketio import emit, join_room, leave_room
 from flask_jwt_extended import decode_token
 from app import socketio
-from app.database import chats
-from typing import Any, Dict
+from app.repositories import storage
+from typing import Any, Dict, Set
 import datetime
 
 def get_socketio():
@@ -14,14 +14,52 @@ def get_socketio():
     return socketio
 
 # Track online users: sid -> user_id
-online_users: Dict[str, str] = {}
+online_users: Dict[str, int] = {}
+# And the reverse: user_id -> sids of every device the user is connected from
+user_sessions: Dict[int, Set[str]] = {}
+
+def add_session(sid: str, user_id: int) -> bool:
+    """Registers a socket session. Returns True if it is the user's first one."""
+    online_users[sid] = user_id
+    sids = user_sessions.setdefault(user_id, set())
+    sids.add(sid)
+    return len(sids) == 1
+
+def remove_session(sid: str):
+    """
+    Forgets a socket session. Returns (user_id, went_offline); went_offline
+    is True when that was the user's last connected device.
+    """
+    user_id = online_users.pop(sid, None)
+    if user_id is None:
+        return None, False
+    sids = user_sessions.get(user_id)
+    if sids is not None:
+        sids.discard(sid)
+        if not sids:
+            del user_sessions[user_id]
+            return user_id, True
+    return user_id, False
+
+def member_room(chat_id: str) -> str:
+    """
+    Delivery room holding every connected session of a chat's members.
+    Unlike the plain chat_id room (joined and left by the client via
+    join_chat/leave_chat for typing and read receipts), sessions stay in
+    this room for as long as they are connected.
+    """
+    return f"members:{chat_id}"
+
+def _enter_member_room(chat: Chat, user_id: int):
+    """Chat store listener: puts an online user's sessions into a chat they just joined."""
+    for sid in user_sessions.get(user_id, ()):
+        socketio.server.enter_room(sid, member_room(chat.chat_id), namespace="/")
+
+storage.chats.add_member_listener(_enter_member_room)
 
 def list_for_user(user_id):
-    return [
-        chat
-        for chat in chats.values()
-        if any(member.user_id == user_id for member in chat.members)
-    ]
+    """Chats the user belongs to, straight from the chat repository's user index."""
+    return storage.chats.chats_for_user(user_id)
 
 @socketio.on("connect")
 def handle_connect(auth: Dict[str, Any]):
@@ -30,33 +68,39 @@ def handle_connect(auth: Dict[str, Any]):
     and broadcast presence update.
     """
 
-    user_id = auth.get('userId')
+    user_id = normalize_user_id((auth or {}).get('userId'))
+    if user_id is None:
+        return False  # Reject the connection
+
     sid = request.sid
-    online_users[sid] = user_id
+    first_session = add_session(sid, user_id)
 
     print(f'Client connected with id {user_id} and session id {sid}')
 
-    # Notify everyone that this user is online
-    emit(
-        "presence_update",
-        {"userId": user_id, "status": "online"},
-        broadcast=True,
-    )
+    # Notify everyone that this user is online (only for their first device)
+    if first_session:
+        emit(
+            "presence_update",
+            {"userId": user_id, "status": "online"},
+            broadcast=True,
+        )
 
     # auto-join every room the user belongs to:
     user_chats = list_for_user(user_id)
     for chat in user_chats:
         join_room(chat.chat_id)
+        join_room(member_room(chat.chat_id))
 
 
 @socketio.on("disconnect")
 def handle_disconnect():
     """
-    Remove from online map and broadcast offline presence.
+    Remove from online map and broadcast offline presence
+    once the user's last device disconnects.
     """
     sid = request.sid
-    user_id = online_users.pop(sid, None)
-    if user_id:
+    user_id, went_offline = remove_session(sid)
+    if went_offline:
         emit(
             "presence_update",
             {"userId": user_id, "status": "offline"},
@@ -73,20 +117,22 @@ def handle_join_chat(data: Dict[str, Any]):
     chat_id = data.get("chatId")
     sid = request.sid
     user_id = online_users.get(sid)
-    chat = chats.get(chat_id)
+    chat = storage.chats.get(chat_id)
 
-    if not chat or not any(m.user_id == user_id for m in chat.members):
+    if not chat or not chat.has_member(user_id):
         emit("error", {"message": "Invalid chat or not a member"})
         return
 
     # Mark all existing messages in that chat as seen by this user:
-    newly_seen = chat.mark_all_as_seen(user_id)
+    last_read = storage.messages.mark_all_read(chat, user_id)
 
-    # Broadcast a `mark_as_read` event to everyone in that chat:
-    for msg in newly_seen:
+    # Broadcast a single `mark_as_read` event for the new read watermark;
+    # everything up to `seq` counts as read:
+    if last_read:
         payload = {
           "chatId":   chat_id,
-          "messageId": msg.message_id,
+          "messageId": last_read.message_id,
+          "seq":       last_read.seq,
           "userId":    user_id,
         }
         socketio.emit("mark_as_read", payload, room=chat_id)
@@ -106,18 +152,20 @@ def handle_mark_as_read(data):
     chat_id    = data["chatId"]
     message_id = data["messageId"]
     user_id    = online_users.get(request.sid)
-    chat       = chats.get(chat_id)
+    chat       = storage.chats.get(chat_id)
 
-    if not chat or user_id not in {m.user_id for m in chat.members}:
+    if not chat or not chat.has_member(user_id):
         return emit("error", {"message": "Invalid chat or not a member"})
 
-    msg = chat.get_message_by_id(message_id)
-    if user_id not in msg.seen_by:
-        msg.seen_by.append(user_id)
+    msg = storage.messages.get_by_id(chat, message_id)
+    if not msg:
+        return emit("error", {"message": "Message not found"})
 
+    if storage.messages.mark_read(chat, user_id, msg):
         payload = {
         "chatId":    chat_id,
         "messageId": message_id,
+        "seq":       msg.seq,
         "userId":    user_id,
         }
         # broadcast to the entire chat room:
@@ -133,7 +181,7 @@ def handle_started_typing(data: Dict[str, Any]):
     chat_id = data.get("chatId")
     sid = request.sid
     user_id = online_users.get(sid)
-    if chat_id in chats:
+    if storage.chats.get(chat_id):
         emit(
             "typing",
             {"chatId": chat_id, "userId": user_id, "typing": True},
@@ -150,7 +198,7 @@ def handle_stopped_typing(data: Dict[str, Any]):
     chat_id = data.get("chatId")
     sid = request.sid
     user_id = online_users.get(sid)
-    if chat_id in chats:
+    if storage.chats.get(chat_id):
         emit(
             "typing",
             {"chatId": chat_id, "userId": user_id, "typing": False},
@@ -162,7 +210,7 @@ def handle_stopped_typing(data: Dict[str, Any]):
 @socketio.on("send_message")
 def handle_send_message(data: Dict[str, Any]):
     """
-    Receive a new message, persist it to in-memory store, then broadcast.
+    Receive a new message, persist it through the message repository, then broadcast.
     Payload may include an optional tempId for client-side optimistic UI.
     """
     print('Client sent a message')
@@ -171,7 +219,7 @@ def handle_send_message(data: Dict[str, Any]):
     temp_id = data.get("tempId")
     sid = request.sid
     user_id = online_users.get(sid)
-    chat = chats.get(chat_id)
+    chat = storage.chats.get(chat_id)
 
     if not user_id:
         emit("error", {"message": "Not authenticated"})
@@ -181,25 +229,50 @@ def handle_send_message(data: Dict[str, Any]):
         emit("error", {"message": "Chat not found"})
         return
     
-    if not any(m.user_id == user_id for m in chat.members):
+    if not chat.has_member(user_id):
         emit("error", {"message": "Not a member of chat"})
         return
 
+    if not isinstance(text, str):
+        emit("error", {"message": "text must be a string"})
+        return
+
     # Persist message
-    msg = chat.add_message(user_id, text)
-    payload = msg.to_dict()
+    msg = storage.messages.append(chat, user_id, text)
+    # seenBy is derived from read watermarks; the sender always counts
+    payload = chat.message_to_dict(msg)
     if temp_id is not None:
         payload["tempId"] = temp_id
 
-    # Automatically mark the message as read for the sender
-    msg.seen_by.append(int(user_id))
+    # One emit to the delivery room: the packet is encoded once and the same
+    # bytes are written to every connected session of every member
+    socketio.emit("message", payload, room=member_room(chat_id))
+
+
+@socketio.on("sync")
+def handle_sync(data: Dict[str, Any]):
+    """
+    Delta sync over the socket, same payload as POST /messaging-api/sync:
+    {"chats": {"<chatId>": {"lastSeq": n, "revision": r}}, "limit": 100}.
+    The result is emitted back to the requesting session only.
+    """
+    user_id = online_users.get(request.sid)
+    if not user_id:
+        emit("error", {"message": "Not authenticated"})
+        return
+
+    data = data or {}
+    limit = data.get("limit")
+    if limit is not None and (not isinstance(limit, int) or isinstance(limit, bool) or limit <= 0):
+        emit("error", {"message": "limit must be a positive integer"})
+        return
 
-    # Emit to every connected sid whose user is in that set
-    member_ids = {m.user_id for m in chat.members}
-    for sid, uid in online_users.items():
-        if uid in member_ids:
-            # “room=sid” targets exactly that socket
-            socketio.emit("message", payload, room=sid)
+    try:
+        result = storage.chats.sync_for_user(user_id, data.get("chats", {}), limit)
+    except ValueError as e:
+        emit("error", {"message": str(e)})
+        return
+    emit("sync", result)
 
 
 @socketio.on("force_refresh")
@@ -214,7 +287,7 @@ def handle_force_refresh(data: Dict[str, Any]):
 
     chat_id = data.get("chatId")
     sid = request.sid
-    user_id_str = online_users.get(sid)  # user_id from online_users is str
+    user_id_str = online_users.get(sid)
 
     # Authentication check: user must be connected and in online_users
     if not user_id_str:
@@ -226,19 +299,14 @@ def handle_force_refresh(data: Dict[str, Any]):
         emit("error", {"message": "chatId is required in payload"})
         return
 
-    chat: Chat = chats.get(chat_id)
+    chat: Chat = storage.chats.get(chat_id)
     
     # Validate chat existence
     if not chat:
         emit("error", {"message": "Chat not found"})
         return
     
-    member_ids = {m.user_id for m in chat.members}
-    for sid, uid in online_users.items():
-        print(member_ids)
-        if uid in member_ids:
-            # “room=sid” targets exactly that socket
-            socketio.emit("force_refresh", {"chatId": chat.chat_id}, room=sid)
+    socketio.emit("force_refresh", {"chatId": chat.chat_id}, room=member_room(chat.chat_id))
     
     # Validate membership of the sender in the chat.
     # Assuming chat.members store user_id as int, based on int(user_id)
@@ -0,0 +1,21 @@
+"""
+Times candidate password hash costs on this machine and prints the
+HASH_METHOD that fits a per-hash time budget (see app/passwords.py).
+
+    python -m app.tune_password_hash [--budget-ms 250] [--family scrypt|pbkdf2]
+"""
+import argparse
+
+from app.passwords import TUNING_CANDIDATES, hasher
+
+def main():
+    parser = argparse.ArgumentParser(description="Pick the strongest password hash cost that fits a time budget.")
+    parser.add_argument("--budget-ms", type=int, default=250, help="time one hash may take (default 250)")
+    parser.add_argument("--family", choices=sorted(TUNING_CANDIDATES), default="scrypt")
+    arguments = parser.parse_args()
+    for method, seconds in hasher.tune(arguments.budget_ms / 1000, arguments.family):
+        print(f"{method:<28} {seconds * 1000:8.1f} ms")
+    print(f"HASH_METHOD={hasher.method}")
+
+if __name__ == "__main__":
+    main()
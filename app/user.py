@@ -2,9 +2,8 @@ import datetime
 from enum import Enum
 from typing import Optional # For optional type hints
 
-# For password hashing (install with: pip install Werkzeug)
-# Alternatively, you can use bcrypt, passlib, or hashlib (with salt)
-from werkzeug.security import generate_password_hash, check_password_hash
+# Password hashing (Werkzeug), run off the eventlet hub by app/passwords.py
+from app.passwords import HashingBusy, hasher, method_of
 
 class Role(Enum):
     """
@@ -79,20 +78,39 @@ class User:
         self.createdAt: datetime.datetime = createdAt if createdAt else datetime.datetime.now()
 
     def _set_password(self, plain_password: str) -> str:
-        """Hashes the plain text password."""
-        return generate_password_hash(plain_password)
+        """Hashes the plain text password. Raises HashingBusy if the hashing pool is saturated."""
+        return hasher.hash(plain_password)
 
-    def check_password(self, plain_password: str) -> bool:
+    def check_password(self, plain_password: str, upgrade: bool = True) -> bool:
         """
         Checks if the provided plain text password matches the stored hash.
+        On a match, a hash made with an older method or cost than the
+        configured one is transparently replaced (unless `upgrade` is False);
+        compare hash_method before and after to know whether to save the user.
 
         Args:
             plain_password (str): The password to check.
+            upgrade (bool, optional): Rehash outdated hashes on a match. Defaults to True.
 
         Returns:
             bool: True if the password matches, False otherwise.
+
+        Raises:
+            HashingBusy: If the hashing pool is saturated.
         """
-        return check_password_hash(self._password_hash, plain_password)
+        if not hasher.check(self._password_hash, plain_password):
+            return False
+        if upgrade and hasher.needs_rehash(self._password_hash):
+            try:
+                self._password_hash = self._set_password(plain_password)
+            except HashingBusy:
+                pass  # The password was right; upgrade on a later login
+        return True
+
+    @property
+    def hash_method(self) -> str:
+        """The method and cost of the stored hash, e.g. "scrypt:32768:8:1"."""
+        return method_of(self._password_hash)
 
     @property
     def password(self):
@@ -128,6 +146,31 @@ class User:
             "createdAt": self.createdAt.isoformat() # ISO format for easy serialization
         }
 
+    @classmethod
+    def restore(cls,
+                userId: int,
+                name: str,
+                email: str,
+                username: str,
+                password_hash: str,
+                status: str,
+                role: Role,
+                createdAt: datetime.datetime) -> 'User':
+        """
+        Rebuilds a stored user from its already-hashed password, without
+        re-validating or re-hashing anything (used when loading persisted state).
+        """
+        user = cls.__new__(cls)
+        user.userId = userId
+        user.name = name
+        user.email = email
+        user.username = username
+        user._password_hash = password_hash
+        user.status = status
+        user.role = role if isinstance(role, Role) else Role.from_string(role)
+        user.createdAt = createdAt
+        return user
+
     @classmethod
     def from_dict(cls, data: dict) -> 'User':
         """Creates a User instance from a dictionary (e.g., from a database or API)."""
@@ -0,0 +1,370 @@
+"""
+Local append-only write-ahead log of store mutations.
+
+Every user, friendship and friend request saved or deleted, chat created,
+member joined / read watermark moved and message added is appended as a
+framed record (length, CRC32, JSON payload) to numbered segment files in
+one directory. Segments roll over at a size limit; the ones a snapshot
+already covers are deleted (see app/snapshot.py).
+
+Durability levels (WAL_DURABILITY):
+
+    none      records are handed to the OS by a background writer; no fsync
+    batched   group commit: the writer fsyncs once per batch, a batch being
+              at most `max_batch` records or `max_delay` seconds of traffic
+    every     each record is written and fsynced before append() returns
+
+`none` and `batched` never block the caller on disk I/O; `batched` loses at
+most the last `max_delay` seconds of writes on a power failure.
+"""
+
+import datetime
+import json
+import os
+import queue
+import struct
+import threading
+import time
+import traceback
+import zlib
+from typing import Iterator, Optional
+
+from app.chat import Chat, ChatType
+from app.friendrequest import FriendRequest, RequestStatus
+from app.friendship import Friendship
+from app.message_log import from_epoch_micros, to_epoch_micros
+from app.offload import run_off_hub
+from app.user import User
+
+DURABILITY_LEVELS = ("none", "batched", "every")
+
+_HEADER = struct.Struct("<II")  # payload length, CRC32 of the payload
+SEGMENT_SUFFIX = ".wal"
+
+def _micros(moment: Optional[datetime.datetime]) -> Optional[int]:
+    return to_epoch_micros(moment) if moment is not None else None
+
+def _moment(micros: Optional[int]) -> Optional[datetime.datetime]:
+    return from_epoch_micros(micros) if micros is not None else None
+
+def _fsync(fd: int):
+    run_off_hub(os.fsync, fd)
+
+def encode_record(record: dict) -> bytes:
+    payload = json.dumps(record, separators=(",", ":")).encode("utf-8")
+    return _HEADER.pack(len(payload), zlib.crc32(payload)) + payload
+
+def segment_paths(directory: str) -> list:
+    """Segment files in log order."""
+    names = sorted(name for name in os.listdir(directory) if name.endswith(SEGMENT_SUFFIX))
+    return [os.path.join(directory, name) for name in names]
+
+def read_segment(path: str) -> Iterator[tuple]:
+    """
+    Yields (end_offset, record) for every intact record of a segment and
+    stops at the first torn or corrupt one (a crash mid-write).
+    """
+    with open(path, "rb") as segment:
+        data = segment.read()
+    offset = 0
+    while offset + _HEADER.size <= len(data):
+        length, checksum = _HEADER.unpack_from(data, offset)
+        start, end = offset + _HEADER.size, offset + _HEADER.size + length
+        if end > len(data) or zlib.crc32(data[start:end]) != checksum:
+            return
+        offset = end
+        yield end, json.loads(data[start:end])
+
+def segment_number(path: str) -> int:
+    return int(os.path.basename(path)[:-len(SEGMENT_SUFFIX)])
+
+def read_records(directory: str, first_segment: int = 0) -> Iterator[dict]:
+    """Every intact record of the log from segment `first_segment` on, oldest first."""
+    for path in segment_paths(directory):
+        if segment_number(path) < first_segment:
+            continue
+        for _, record in read_segment(path):
+            yield record
+
+
+class WriteAheadLog:
+    """
+    Store observer (see app/database.py) that logs every store mutation.
+    Register it with add_observer() after replay_into(), so replayed
+    records are not logged a second time.
+    """
+
+    _STOP = object()
+
+    def __init__(self, directory: str, durability: str = "batched", segment_bytes: int = 64 * 1024 * 1024,
+                 max_batch: int = 1000, max_delay: float = 0.01):
+        if durability not in DURABILITY_LEVELS:
+            raise ValueError(f"Unknown WAL durability '{durability}'. Must be one of {', '.join(DURABILITY_LEVELS)}.")
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.durability = durability
+        self.segment_bytes = segment_bytes
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+
+        self._lock = threading.Lock()  # guards the open segment
+        self._segment = None
+        self._segment_index = 0
+        self._open_last_segment()
+
+        self._queue = None
+        if durability != "every":
+            self._queue = queue.Queue()
+            self._thread = threading.Thread(target=self._run, name="wal-writer", daemon=True)
+            self._thread.start()
+
+    # --- Segments ---
+
+    def _open_last_segment(self):
+        """Reopens the newest segment for appending, cutting off a torn tail left by a crash."""
+        paths = segment_paths(self.directory)
+        if not paths:
+            self._roll()
+            return
+        last = paths[-1]
+        self._segment_index = segment_number(last)
+        intact = 0
+        for intact, _ in read_segment(last):
+            pass
+        self._segment = open(last, "r+b")
+        self._segment.truncate(intact)
+        self._segment.seek(intact)
+
+    def _roll(self):
+        """Closes the current segment (fsynced, whatever the durability level) and starts the next one."""
+        if self._segment is not None:
+            self._segment.flush()
+            _fsync(self._segment.fileno())
+            self._segment.close()
+        self._segment_index += 1
+        path = os.path.join(self.directory, f"{self._segment_index:010d}{SEGMENT_SUFFIX}")
+        self._segment = open(path, "ab")
+
+    @property
+    def segment_index(self) -> int:
+        """Number of the segment currently appended to."""
+        return self._segment_index
+
+    def roll(self) -> int:
+        """Starts a new segment and returns its number; everything logged so far is in earlier segments."""
+        self.flush()
+        with self._lock:
+            self._roll()
+            return self._segment_index
+
+    def drop_segments_before(self, index: int):
+        """Deletes segments older than `index`, e.g. once a snapshot covers them."""
+        for path in segment_paths(self.directory):
+            if segment_number(path) < index:
+                os.remove(path)
+
+    def _write(self, frames: list, sync: bool):
+        with self._lock:
+            for frame in frames:
+                if self._segment.tell() + len(frame) > self.segment_bytes and self._segment.tell() > 0:
+                    self._roll()
+                self._segment.write(frame)
+            self._segment.flush()
+            if sync:
+                _fsync(self._segment.fileno())
+
+    # --- Appending ---
+
+    def append(self, record: dict):
+        frame = encode_record(record)
+        if self._queue is None:
+            self._write([frame], sync=True)
+        else:
+            self._queue.put(frame)
+
+    def flush(self):
+        """Blocks until every record appended so far is on disk (fsynced unless durability is none)."""
+        if self._queue is not None:
+            self._queue.join()
+
+    def close(self):
+        if self._queue is not None:
+            self._queue.put(self._STOP)
+            self._thread.join()
+        with self._lock:
+            self._segment.flush()
+            _fsync(self._segment.fileno())
+            self._segment.close()
+
+    def _run(self):
+        stopping = False
+        while not stopping:
+            first = self._queue.get()
+            if first is self._STOP:
+                self._queue.task_done()
+                return
+
+            batch = [first]
+            deadline = time.monotonic() + self.max_delay
+            while len(batch) < self.max_batch:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    frame = self._queue.get(timeout=timeout)
+                except queue.Empty:
+                    break
+                if frame is self._STOP:
+                    stopping = True
+                    self._queue.task_done()
+                    break
+                batch.append(frame)
+
+            try:
+                self._write(batch, sync=self.durability == "batched")
+            except Exception:
+                print(f"WAL: writing a batch of {len(batch)} records failed")
+                traceback.print_exc()
+            for _ in batch:
+                self._queue.task_done()
+
+    # --- Store observer interface ---
+
+    def user_saved(self, user: User):
+        self.append({"t": "user", "id": user.userId, "name": user.name, "email": user.email,
+                     "username": user.username, "hash": user._password_hash, "status": user.status,
+                     "role": user.role.value, "created": user.createdAt.isoformat()})
+
+    def user_deleted(self, user: User):
+        self.append({"t": "user_del", "id": user.userId})
+
+    def friendship_saved(self, friendship: Friendship):
+        self.append({"t": "friendship", "id": friendship.friendshipId, "user1": friendship.user1Id,
+                     "user2": friendship.user2Id, "created": friendship.createdAt.isoformat()})
+
+    def friendship_deleted(self, friendship: Friendship):
+        self.append({"t": "friendship_del", "id": friendship.friendshipId,
+                     "user1": friendship.user1Id, "user2": friendship.user2Id})
+
+    def friend_request_saved(self, friend_request: FriendRequest):
+        self.append({"t": "request", "id": friend_request.requestId, "sender": friend_request.senderId,
+                     "receiver": friend_request.receiverId, "status": friend_request.status.value,
+                     "created": friend_request.createdAt.isoformat()})
+
+    def friend_request_deleted(self, friend_request: FriendRequest):
+        self.append({"t": "request_del", "id": friend_request.requestId})
+
+    def chat_created(self, chat: Chat):
+        self.append({"t": "chat", "chat": chat.chat_id, "type": chat.chat_type.value,
+                     "name": chat.name, "created": _micros(chat.created_at)})
+
+    def member_saved(self, chat: Chat, member):
+        self.append({"t": "member", "chat": chat.chat_id, "user": member.user_id,
+                     "joined": _micros(member.joined_at), "seq": member.last_read_seq})
+
+    def message_added(self, chat: Chat, message):
+        self.append({"t": "msg", "chat": chat.chat_id, "id": message.message_id, "sender": message.sender_id,
+                     "text": message.text, "sent": _micros(message.sent_at)})
+
+    # --- Recovery ---
+
+    def replay_into(self, users, friendships, friendrequests, chats, first_segment: int = 0) -> int:
+        """
+        Re-applies logged records to the stores through their regular
+        methods, so observers registered at this point (e.g. the SQL
+        backend) receive whatever they are missing. Replay is idempotent:
+        records the stores already reflect are skipped and read watermarks
+        only move forward, so replaying a tail that overlaps a snapshot is
+        safe. Only segments from `first_segment` on are read. Returns the
+        number of records applied.
+        """
+        applied = 0
+        for record in read_records(self.directory, first_segment):
+            kind = record.get("t")
+            if kind in _ENTITY_REPLAY:
+                applied += _ENTITY_REPLAY[kind](record, users, friendships, friendrequests)
+                continue
+
+            chat = chats.get(record.get("chat"))
+            if kind == "chat":
+                if chat is None:
+                    chats.add(Chat(ChatType(record["type"]), name=record["name"], chat_id=record["chat"],
+                                   created_at=_moment(record["created"])))
+                    applied += 1
+            elif chat is None:
+                continue
+            elif kind == "member":
+                if chat.add_member(record["user"], joined_at=_moment(record["joined"])) is not None:
+                    applied += 1
+                if chat.mark_read_up_to(record["user"], record["seq"]):
+                    applied += 1
+            elif kind == "msg":
+                if chat.messages.position_of(record["id"]) is None:
+                    chat.replay_message(record["id"], record["sender"], record["text"], _moment(record["sent"]))
+                    applied += 1
+        return applied
+
+
+# --- Replay of user / friend records; each returns 1 if it changed the stores ---
+
+def _replay_user(record, users, friendships, friendrequests) -> int:
+    user = User.restore(userId=record["id"], name=record["name"], email=record["email"],
+                        username=record["username"], password_hash=record["hash"], status=record["status"],
+                        role=record["role"], createdAt=datetime.datetime.fromisoformat(record["created"]))
+    existing = users.get_by_id(user.userId)
+    if existing is not None:
+        if existing.to_dict() == user.to_dict() and existing._password_hash == user._password_hash:
+            return 0
+        users.remove(existing)
+    users.add(user)
+    return 1
+
+def _replay_user_deleted(record, users, friendships, friendrequests) -> int:
+    existing = users.get_by_id(record["id"])
+    if existing is None:
+        return 0
+    users.remove(existing)
+    return 1
+
+def _replay_friendship(record, users, friendships, friendrequests) -> int:
+    existing = friendships.find(record["user1"], record["user2"])
+    if existing is not None:
+        return 0
+    friendships.add(Friendship(friendshipId=record["id"], user1Id=record["user1"], user2Id=record["user2"],
+                               createdAt=datetime.datetime.fromisoformat(record["created"])))
+    return 1
+
+def _replay_friendship_deleted(record, users, friendships, friendrequests) -> int:
+    existing = friendships.find(record["user1"], record["user2"])
+    if existing is None or existing.friendshipId != record["id"]:
+        return 0
+    friendships.remove(existing)
+    return 1
+
+def _replay_request(record, users, friendships, friendrequests) -> int:
+    existing = friendrequests.get_by_id(record["id"])
+    if existing is None:
+        friendrequests.add(FriendRequest(requestId=record["id"], senderId=record["sender"],
+                                         receiverId=record["receiver"], status=record["status"],
+                                         createdAt=datetime.datetime.fromisoformat(record["created"])))
+        return 1
+    if existing.status.value == record["status"]:
+        return 0
+    existing.status = RequestStatus.from_string(record["status"])
+    return 1
+
+def _replay_request_deleted(record, users, friendships, friendrequests) -> int:
+    existing = friendrequests.get_by_id(record["id"])
+    if existing is None:
+        return 0
+    friendrequests.remove(existing)
+    return 1
+
+_ENTITY_REPLAY = {
+    "user": _replay_user,
+    "user_del": _replay_user_deleted,
+    "friendship": _replay_friendship,
+    "friendship_del": _replay_friendship_deleted,
+    "request": _replay_request,
+    "request_del": _replay_request_deleted,
+}
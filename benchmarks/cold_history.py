@@ -0,0 +1,64 @@
+"""
+Python-heap cost of chat history before and after sealing it to mmap segments.
+
+    python -m benchmarks.cold_history [chats] [messages_per_chat] [active_chats]
+
+Fills `chats` chats (default 100) with `messages_per_chat` messages each
+(default 2000), then seals every chat except the `active_chats` most recent
+ones (default 5) the way HistorySealer does for idle chats. Reports the
+traced heap before and after, and the cost of reading a page of 50 messages
+from the middle of a sealed vs. an in-memory history.
+"""
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from app.chat import Chat, ChatType
+from app.database import ChatStore
+from app.message_segment import HistorySealer
+
+PAGE = 50
+
+def page_read_micros(chat, repeats=2000):
+    middle = len(chat.messages) // 2
+    start = time.perf_counter()
+    for _ in range(repeats):
+        chat.get_messages(before=middle, limit=PAGE)
+    return (time.perf_counter() - start) / repeats * 1e6
+
+def main():
+    chats = int(sys.argv[1]) if len(sys.argv) > 1 else 100
+    per_chat = int(sys.argv[2]) if len(sys.argv) > 2 else 2000
+    active = int(sys.argv[3]) if len(sys.argv) > 3 else 5
+
+    tracemalloc.start()
+    store = ChatStore()
+    all_chats = []
+    for i in range(chats):
+        chat = Chat(ChatType.GROUP, name=f"bench {i}")
+        for user_id in range(1, 9):
+            chat.add_member(user_id)
+        store.add(chat)
+        for n in range(per_chat):
+            chat.messages.append(n % 8 + 1, f"benchmark message number {n} in chat {i}")
+        all_chats.append(chat)
+    before = tracemalloc.get_traced_memory()[0]
+
+    with tempfile.TemporaryDirectory() as directory:
+        sealer = HistorySealer(directory, store)
+        started = time.perf_counter()
+        for chat in all_chats[:-active]:
+            sealer.seal(chat)
+        sealing = time.perf_counter() - started
+        after = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+
+        print(f"{chats} chats x {per_chat:,} messages, {active} kept active")
+        print(f"  heap before sealing  {before / 2**20:>8.1f} MiB")
+        print(f"  heap after sealing   {after / 2**20:>8.1f} MiB  (sealed {chats - active} chats in {sealing:.2f}s)")
+        print(f"  page of {PAGE} from sealed history     {page_read_micros(all_chats[0]):>7.0f} us")
+        print(f"  page of {PAGE} from in-memory history  {page_read_micros(all_chats[-1]):>7.0f} us")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+"""
+Per-message CPU cost of delivering one chat message to a group.
+
+    python -m benchmarks.fanout [messages_per_size]
+
+Compares the old delivery (one socketio emit per recipient sid, which
+re-encodes the payload every time) with a single emit to the chat's
+delivery room (payload encoded once, same bytes written to every
+transport). Uses a real python-socketio Server; the Engine.IO transport
+is replaced by a stub that only encodes the packet, so the numbers are
+pure server-side CPU.
+"""
+import sys
+import time
+import uuid
+
+import socketio
+
+GROUP_SIZES = (2, 10, 100, 1000, 5000)
+NAMESPACE = "/"
+
+def encode_only(eio_sid, pkt):
+    """Stands in for the Engine.IO transport: encodes each packet as a real one would, sends nothing."""
+    pkt.encode()
+
+def build_server(group_size):
+    server = socketio.Server(async_mode="threading")
+    server.eio.send_packet = encode_only
+    room = f"members:{uuid.uuid4()}"
+    sids = []
+    for i in range(group_size):
+        sid = server.manager.connect(f"eio-{i}", NAMESPACE)
+        server.manager.enter_room(sid, NAMESPACE, room)
+        sids.append(sid)
+    return server, room, sids
+
+def sample_payload(seq):
+    return {
+        "messageId": str(uuid.uuid4()),
+        "chatId": str(uuid.uuid4()),
+        "seq": seq,
+        "senderId": 1,
+        "text": "See you at the usual place around eight?",
+        "sentAt": "2025-01-01T20:00:00+00:00",
+        "seenBy": [1],
+    }
+
+def per_sid(server, room, sids, payload):
+    for sid in sids:
+        server.emit("message", payload, room=sid)
+
+def per_room(server, room, sids, payload):
+    server.emit("message", payload, room=room)
+
+def measure(deliver, group_size, messages):
+    server, room, sids = build_server(group_size)
+    start = time.process_time()
+    for seq in range(messages):
+        deliver(server, room, sids, sample_payload(seq))
+    return (time.process_time() - start) / messages
+
+def main():
+    messages = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    print(f"CPU per message, averaged over {messages} messages")
+    print(f"  {'group':>6}  {'per-sid emit':>14}  {'room emit':>12}  {'speedup':>8}")
+    for group_size in GROUP_SIZES:
+        old = measure(per_sid, group_size, messages)
+        new = measure(per_room, group_size, messages)
+        print(f"  {group_size:>6}  {old * 1e6:>11.0f} us  {new * 1e6:>9.0f} us  {old / new:>7.1f}x")
+
+if __name__ == "__main__":
+    main()
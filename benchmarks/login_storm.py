@@ -0,0 +1,87 @@
+"""
+Socket message latency during a login storm.
+
+    python -m benchmarks.login_storm [logins] [concurrency] [small_queue]
+
+Under eventlet, a probe green thread stands in for the socket handlers: every
+10 ms it wakes up and sends a chat message, and records how late it ran.
+Meanwhile `concurrency` green threads (default 20) check `logins` passwords
+(default 40) in total. Runs four times: without logins, with hashing inline
+on the hub (HASH_WORKERS=0, as before), with the bounded pool, and with the
+pool and a queue of `small_queue` (default 4) to show the 503 refusals.
+"""
+import eventlet
+eventlet.monkey_patch()
+
+import statistics
+import sys
+import time
+
+from app.chat import Chat, ChatType
+from app.database import ChatStore
+from app.passwords import HashingBusy, hasher
+from app.user import User
+
+TICK = 0.01
+
+def percentile(samples, fraction):
+    return sorted(samples)[min(len(samples) - 1, int(len(samples) * fraction))]
+
+def run(label, user, logins, concurrency):
+    store = ChatStore()
+    chat = Chat(ChatType.GROUP, name="probe")
+    chat.add_member(1)
+    store.add(chat)
+    lateness = []
+    running = True
+
+    def probe():
+        while running:
+            started = time.perf_counter()
+            eventlet.sleep(TICK)
+            chat.add_message(1, "ping")
+            lateness.append((time.perf_counter() - started - TICK) * 1000)
+
+    refused = 0
+    def login_worker(count):
+        nonlocal refused
+        for _ in range(count):
+            try:
+                assert user.check_password("correct horse")
+            except HashingBusy:
+                refused += 1
+
+    prober = eventlet.spawn(probe)
+    started = time.perf_counter()
+    if logins:
+        pool = eventlet.GreenPool(concurrency)
+        for worker in range(concurrency):
+            pool.spawn(login_worker, logins // concurrency + (worker < logins % concurrency))
+        pool.waitall()
+    else:
+        eventlet.sleep(1)
+    elapsed = time.perf_counter() - started
+    running = False
+    prober.wait()
+
+    served = logins - refused
+    print(f"{label:<28} probe late p50 {statistics.median(lateness):7.1f} ms  p99 {percentile(lateness, 0.99):7.1f} ms  "
+          f"max {max(lateness):7.1f} ms   {served} logins in {elapsed:.1f}s, {refused} refused")
+
+def main():
+    logins = int(sys.argv[1]) if len(sys.argv) > 1 else 40
+    concurrency = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+    small_queue = int(sys.argv[3]) if len(sys.argv) > 3 else 4
+
+    hasher.configure(workers=0)
+    user = User(userId=1, name="Probe", email="probe@example.com", username="probe", password="correct horse")
+
+    run("no logins", user, 0, concurrency)
+    run("hashing inline on the hub", user, logins, concurrency)
+    hasher.configure()
+    run(f"pool of {hasher.workers}, queue {hasher.max_queue}", user, logins, concurrency)
+    hasher.configure(max_queue=small_queue)
+    run(f"pool of {hasher.workers}, queue {hasher.max_queue}", user, logins, concurrency)
+
+if __name__ == "__main__":
+    main()
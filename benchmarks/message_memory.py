@@ -0,0 +1,79 @@
+"""
+Bytes-per-message comparison of the message storage layouts.
+
+    python -m benchmarks.message_memory [count] [group_size]
+
+Compares the original layout (a __dict__ object per message with a UUID
+string, an aware datetime and a seen_by list filled by every reader),
+the __slots__ Message class, and the columnar MessageLog.
+"""
+import datetime
+import sys
+import tracemalloc
+import uuid
+
+from app.message import Message
+from app.message_log import MessageLog
+
+CHAT_ID = str(uuid.uuid4())
+TEXT = "See you at the usual place around eight?"
+
+class LegacyMessage:
+    """The pre-__slots__ layout, kept here only for comparison."""
+    def __init__(self, chat_id, sender_id, text):
+        self.message_id = str(uuid.uuid4())
+        self.chat_id = chat_id
+        self.sender_id = sender_id
+        self.text = text
+        self.sent_at = datetime.datetime.now(datetime.UTC)
+        self.seen_by = []
+
+def build_legacy(count, group_size):
+    messages = []
+    positions = {}
+    for i in range(count):
+        msg = LegacyMessage(CHAT_ID, i % group_size + 1, TEXT + str(i))
+        msg.seen_by.extend(range(1, group_size + 1))
+        positions[msg.message_id] = len(messages)
+        messages.append(msg)
+    return messages, positions
+
+def build_slots(count, group_size):
+    messages = []
+    positions = {}
+    for i in range(count):
+        msg = Message(CHAT_ID, i % group_size + 1, TEXT + str(i), seq=i + 1)
+        positions[msg.message_id] = len(messages)
+        messages.append(msg)
+    return messages, positions
+
+def build_columnar(count, group_size):
+    log = MessageLog(CHAT_ID)
+    for i in range(count):
+        log.append(i % group_size + 1, TEXT + str(i))
+    return log
+
+def measure(build, count, group_size):
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    data = build(count, group_size)
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del data
+    return (after - before) / count
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    group_size = int(sys.argv[2]) if len(sys.argv) > 2 else 8
+
+    print(f"{count} messages, group of {group_size}, text ~{len(TEXT)} chars")
+    baseline = None
+    for name, build in (("legacy (__dict__ + seen_by)", build_legacy),
+                        ("__slots__ Message", build_slots),
+                        ("columnar MessageLog", build_columnar)):
+        per_message = measure(build, count, group_size)
+        baseline = baseline or per_message
+        print(f"  {name:<28} {per_message:8.1f} bytes/message  ({per_message / baseline:5.1%} of legacy)")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+"""
+Message search latency and index cost.
+
+    python -m benchmarks.message_search [chats] [messages_per_chat] [queries]
+
+Fills `chats` chats (default 100) with `messages_per_chat` messages each
+(default 5000) drawn from a small vocabulary, all with one member whose
+searches are timed. Reports the time and traced heap to index everything
+on the first search, then the latency of `queries` (default 500) searches
+for one word (common or rare) and for two words, and the cost per message
+of keeping the index current while sending. Compares against scanning the
+texts, which is what a client has to do today.
+"""
+import random
+import statistics
+import sys
+import time
+import tracemalloc
+
+from app.chat import Chat, ChatType
+from app.database import ChatStore, add_observer, remove_observer
+from app.message_search import MessageSearchIndex
+
+COMMON = ["the", "a", "to", "and", "is", "you", "it", "for", "on", "that", "we", "this", "at", "be", "ok"]
+RARE = [f"word{n}" for n in range(5000)]
+LIMIT = 20
+
+def sentence(rng):
+    words = rng.choices(COMMON, k=rng.randint(3, 10))
+    words.insert(rng.randrange(len(words)), rng.choice(RARE))
+    return " ".join(words)
+
+def timed(function, repeats):
+    samples = []
+    for _ in range(repeats):
+        started = time.perf_counter()
+        function()
+        samples.append((time.perf_counter() - started) * 1000)
+    return samples
+
+def main():
+    chat_count = int(sys.argv[1]) if len(sys.argv) > 1 else 100
+    per_chat = int(sys.argv[2]) if len(sys.argv) > 2 else 5000
+    queries = int(sys.argv[3]) if len(sys.argv) > 3 else 500
+    rng = random.Random(7)
+
+    store = ChatStore()
+    index = MessageSearchIndex()
+    add_observer(index)
+    chats = []
+    for i in range(chat_count):
+        chat = Chat(ChatType.GROUP, name=f"bench {i}")
+        chat.add_member(1)
+        chat.add_member(2)
+        store.add(chat)
+        for _ in range(per_chat):
+            chat.messages.append(2, sentence(rng))
+        chats.append(chat)
+
+    started = time.perf_counter()
+    index.search(chats, "the", LIMIT)
+    building = time.perf_counter() - started
+    print(f"{chat_count} chats x {per_chat:,} messages indexed on first search in {building:.2f}s")
+
+    sample = chats[:10]
+    tracemalloc.start()
+    sample_index = MessageSearchIndex()
+    sample_index.search(sample, "the", LIMIT)
+    heap = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    print(f"  index heap: {heap / 2**20 / (len(sample) * per_chat) * 1e6:,.0f} MiB per million messages")
+
+    for label, make_query in [("common word", lambda: rng.choice(COMMON)),
+                              ("rare word", lambda: rng.choice(RARE)),
+                              ("two words", lambda: f"{rng.choice(COMMON)} {rng.choice(RARE)}")]:
+        samples = timed(lambda: index.search(chats, make_query(), LIMIT), queries)
+        print(f"  {label:<12} p50 {statistics.median(samples):7.3f} ms   "
+              f"p99 {sorted(samples)[int(len(samples) * 0.99)]:7.3f} ms")
+
+    next_page = index.search(chats, "the", LIMIT)["nextBefore"]
+    samples = timed(lambda: index.search(chats, "the", LIMIT, next_page), queries)
+    print(f"  {'second page':<12} p50 {statistics.median(samples):7.3f} ms")
+
+    def send_micros():
+        started = time.perf_counter()
+        for n in range(10_000):
+            chats[n % chat_count].add_message(1, sentence(rng))
+        return (time.perf_counter() - started) / 10_000 * 1e6
+    with_index = send_micros()
+    remove_observer(index)
+    print(f"sending: {with_index:.1f} us per message with the index current, {send_micros():.1f} us without")
+
+    needle = rng.choice(RARE)
+    started = time.perf_counter()
+    [m for chat in chats[:10] for m in chat.messages if needle in m.text.split()]
+    print(f"scanning 10 chats' texts: {(time.perf_counter() - started) * 1000:,.0f} ms")
+
+if __name__ == "__main__":
+    main()
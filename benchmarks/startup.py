@@ -0,0 +1,66 @@
+"""
+Startup time from a snapshot plus log tail.
+
+    python -m benchmarks.startup [messages] [chats] [tail_messages]
+
+Builds `messages` messages (default 2,000,000) spread over `chats` chats
+(default 1000) in the memory backend, takes a snapshot, sends
+`tail_messages` more (default 20,000) so they only exist in the
+write-ahead log, then starts a fresh process on the same directories and
+prints its startup report (snapshot load vs. log replay).
+"""
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+def build(directory, messages, chats, tail):
+    from app.chat import Chat, ChatType
+    from app.repositories import configure_storage
+
+    storage = configure_storage("memory", wal_dir=os.path.join(directory, "wal"),
+                                snapshot_dir=os.path.join(directory, "snap"), wal_durability="none")
+    started = time.perf_counter()
+    all_chats = []
+    for i in range(chats):
+        chat = Chat(ChatType.GROUP, name=f"bench {i}")
+        for user_id in range(1, 9):
+            chat.add_member(user_id)
+        # Bulk-fill the log directly: building the dataset is not what is measured
+        for n in range(messages // chats):
+            chat.messages.append(n % 8 + 1, f"benchmark message number {n} in chat {i}")
+        chat.finish_restore()
+        storage.chats.add(chat)
+        all_chats.append(chat)
+    print(f"built {messages:,} messages in {chats:,} chats in {time.perf_counter() - started:.1f}s")
+
+    started = time.perf_counter()
+    path = storage.snapshots.take()
+    print(f"snapshot of {os.path.getsize(path) / 2**20:,.0f} MiB taken in {time.perf_counter() - started:.2f}s")
+
+    for n in range(tail):
+        storage.messages.append(all_chats[n % chats], n % 8 + 1, f"tail message {n}")
+    storage.flush()
+
+def restore(directory):
+    from app.repositories import configure_storage
+
+    started = time.perf_counter()
+    configure_storage("memory", wal_dir=os.path.join(directory, "wal"), snapshot_dir=os.path.join(directory, "snap"))
+    print(f"fresh process ready in {time.perf_counter() - started:.2f}s")
+
+def main():
+    if len(sys.argv) > 1 and sys.argv[1] == "--restore":
+        restore(sys.argv[2])
+        return
+
+    messages = int(sys.argv[1]) if len(sys.argv) > 1 else 2_000_000
+    chats = int(sys.argv[2]) if len(sys.argv) > 2 else 1000
+    tail = int(sys.argv[3]) if len(sys.argv) > 3 else 20_000
+    with tempfile.TemporaryDirectory() as directory:
+        build(directory, messages, chats, tail)
+        subprocess.run([sys.executable, "-m", "benchmarks.startup", "--restore", directory], check=True)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,138 @@
+"""
+Throughput numbers for every storage backend.
+
+    python -m benchmarks.storage_backends [backend ...] [--ops N]
+
+Backends are memory, sqlite (a throwaway file in the temp dir) and postgres
+(only when DATABASE_URL points at a PostgreSQL database; it should be a
+scratch database, the script writes to it). Each backend runs in its own
+process, because storage is configured once per process like in the app:
+
+  1. the same workload is timed (register users, send messages, read pages,
+     mark read), including the final flush to durable storage,
+  2. for the SQL backends, a second process reloads the database and checks
+     that what the first one wrote survived the restart.
+
+The conformance checks of the repositories live in tests/test_repositories.py.
+"""
+import datetime
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+
+DEFAULT_OPS = 2000
+
+def _check(condition, message):
+    if not condition:
+        raise AssertionError(message)
+
+# --- Workload ---
+
+def run_workload(storage, ops):
+    from app.chat import Chat, ChatType
+    from app.user import Role, User
+
+    timings = {}
+    tag = uuid.uuid4().hex[:8]
+
+    start = time.perf_counter()
+    user_ids = []
+    for i in range(ops // 10):
+        user = User.restore(userId=storage.users.next_id(), name=f"Bench {i}", email=f"bench-{tag}-{i}@example.com",
+                            username=f"bench_{tag}_{i}", password_hash="-", status="active", role=Role.USER,
+                            createdAt=datetime.datetime.now())
+        storage.users.add(user)
+        user_ids.append(user.userId)
+    timings["register users"] = (len(user_ids), time.perf_counter() - start)
+
+    chat = Chat(ChatType.GROUP, name="Bench")
+    for user_id in user_ids[:50]:
+        chat.add_member(user_id)
+    storage.chats.add(chat)
+    members = chat.member_ids()
+
+    start = time.perf_counter()
+    messages = []
+    for i in range(ops):
+        messages.append(storage.messages.append(chat, members[i % len(members)], f"benchmark message {i}"))
+    timings["send messages"] = (ops, time.perf_counter() - start)
+
+    start = time.perf_counter()
+    for i in range(ops):
+        storage.messages.page(chat, before=(i % ops) + 1, limit=50)
+    timings["read pages of 50"] = (ops, time.perf_counter() - start)
+
+    start = time.perf_counter()
+    for i, message in enumerate(messages):
+        storage.messages.mark_read(chat, members[(i + 1) % len(members)], message)
+    timings["mark read"] = (ops, time.perf_counter() - start)
+
+    start = time.perf_counter()
+    storage.flush()
+    timings["flush to storage"] = (1, time.perf_counter() - start)
+    return chat, timings
+
+# --- Process entry points ---
+
+def child(mode, kind, database_url, ops, marker):
+    from app.repositories import configure_storage
+    storage = configure_storage(kind, database_url)
+
+    if mode == "verify":
+        chat = storage.chats.get(marker)
+        _check(chat is not None, "chat survived a restart")
+        _check([m.text for m in chat.messages] == [f"benchmark message {i}" for i in range(ops)],
+               "messages survived a restart")
+        last_reader = chat.member_ids()[ops % len(chat.member_ids())]
+        _check(chat.get_member(last_reader).last_read_seq == ops, "read state survived a restart")
+        print(f"  {kind}: reload OK")
+        return
+
+    chat, timings = run_workload(storage, ops)
+    for name, (count, seconds) in timings.items():
+        rate = f"{count / seconds:>12,.0f} ops/s" if count > 1 else f"{seconds * 1000:>10.1f} ms  "
+        print(f"  {kind:>8}  {name:<18} {rate}")
+    storage.flush()
+    print(f"MARKER {chat.chat_id}")
+
+def spawn(mode, kind, database_url, ops, marker=""):
+    result = subprocess.run(
+        [sys.executable, "-m", "benchmarks.storage_backends", "--child", mode, kind, database_url or "", str(ops), marker],
+        capture_output=True, text=True,
+    )
+    lines = [line for line in result.stdout.splitlines() if not line.startswith("MARKER ")]
+    print("\n".join(lines))
+    if result.returncode != 0:
+        print(result.stderr)
+        raise SystemExit(f"{kind}: {mode} failed")
+    markers = [line.split()[1] for line in result.stdout.splitlines() if line.startswith("MARKER ")]
+    return markers[0] if markers else None
+
+def main():
+    args = sys.argv[1:]
+    if args and args[0] == "--child":
+        mode, kind, database_url, ops, marker = args[1:6]
+        child(mode, kind, database_url or None, int(ops), marker)
+        return
+
+    ops = DEFAULT_OPS
+    if "--ops" in args:
+        ops = int(args[args.index("--ops") + 1])
+        del args[args.index("--ops"):args.index("--ops") + 2]
+
+    postgres_url = os.getenv("DATABASE_URL", "")
+    kinds = args or ["memory", "sqlite"] + (["postgres"] if postgres_url.startswith("postgres") else [])
+
+    with tempfile.TemporaryDirectory() as tmp:
+        urls = {"memory": None, "sqlite": f"sqlite:///{os.path.join(tmp, 'bench.db')}", "postgres": postgres_url}
+        for kind in kinds:
+            print(f"{kind}:")
+            marker = spawn("run", kind, urls[kind], ops)
+            if kind != "memory":
+                spawn("verify", kind, urls[kind], ops, marker)
+
+if __name__ == "__main__":
+    main()
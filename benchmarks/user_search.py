@@ -0,0 +1,92 @@
+"""
+Typeahead latency of /search-users on a large user base.
+
+    python -m benchmarks.user_search [users] [queries]
+
+Adds `users` users (default 1,000,000) with generated names to a UserStore,
+then times `queries` searches (default 2000) the way the route runs them:
+20 results, skipping the caller and their friends. Queries are prefixes
+of 2 to 6 characters taken from existing names and usernames, plus
+substrings from the middle of usernames. Compares against the linear scan
+the route used before the index on a sample of the same queries.
+"""
+import datetime
+import random
+import resource
+import statistics
+import sys
+import time
+from itertools import islice
+
+from app.database import UserStore
+from app.user import User
+
+SYLLABLES = ["an", "be", "chi", "da", "el", "fa", "go", "ha", "is", "jo", "ka", "li", "mo", "na", "ol",
+             "pe", "qu", "ra", "si", "ta", "ul", "vi", "wa", "xe", "yo", "za"]
+LIMIT = 20
+
+def word(rng):
+    return "".join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4)))
+
+def percentile(samples, fraction):
+    return sorted(samples)[int(len(samples) * fraction)]
+
+def linear_search(store, query, exclude):
+    query = query.lower()
+    return [user for user in store if not exclude(user.userId)
+            and (query in user.name.lower() or query in user.username.lower())]
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    queries = int(sys.argv[2]) if len(sys.argv) > 2 else 2000
+    rng = random.Random(42)
+    created_at = datetime.datetime.now()
+
+    store = UserStore()
+    started = time.perf_counter()
+    for user_id in range(1, count + 1):
+        first, last = word(rng), word(rng)
+        store.add(User.restore(userId=user_id, name=f"{first.title()} {last.title()}", email=f"user{user_id}@example.com",
+                               username=f"{first}{last[:3]}{user_id}", password_hash="", status="offline",
+                               role="user", createdAt=created_at))
+    store.search_index.merge_pending()  # what startup does once everyone is loaded
+    building = time.perf_counter() - started
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024  # KiB on Linux
+
+    samples = []
+    for _ in range(queries):
+        user = store.get_by_id(rng.randint(1, count))
+        kind = rng.random()
+        if kind < 0.4:
+            samples.append(user.username[:rng.randint(2, 6)])
+        elif kind < 0.8:
+            samples.append(rng.choice(user.name.split())[:rng.randint(2, 6)])
+        else:
+            start = rng.randint(1, 4)
+            samples.append(user.username[start:start + rng.randint(2, 5)])
+
+    caller = 1
+    friends = set(rng.sample(range(2, count + 1), 200))
+    exclude = lambda user_id: user_id == caller or user_id in friends
+
+    timings = []
+    for query in samples:
+        started = time.perf_counter()
+        matches = (user_id for user_id in store.search_index.search(query) if not exclude(user_id))
+        [store.get_by_id(user_id) for user_id in islice(matches, LIMIT)]
+        timings.append((time.perf_counter() - started) * 1000)
+
+    linear = []
+    for query in samples[:5]:
+        started = time.perf_counter()
+        linear_search(store, query, exclude)
+        linear.append((time.perf_counter() - started) * 1000)
+
+    print(f"{count:,} users indexed in {building:.1f}s, peak RSS {peak_rss:,.0f} MiB")
+    print(f"indexed search, {len(samples)} queries, top {LIMIT}:")
+    print(f"  p50 {statistics.median(timings):7.3f} ms   p99 {percentile(timings, 0.99):7.3f} ms   "
+          f"max {max(timings):7.3f} ms")
+    print(f"linear scan (before the index), {len(linear)} queries: mean {statistics.mean(linear):,.0f} ms")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,52 @@
+"""
+Write-ahead log throughput per durability level.
+
+    python -m benchmarks.wal_durability [messages] [directory]
+
+Logs `messages` chat messages (default 20000; `every` is capped at 2000
+because it fsyncs each one) into a fresh log under `directory` (default:
+the temp dir, which should sit on the disk you deploy to, not tmpfs) and
+reports two numbers per level:
+
+    caller    what handle_send_message pays per message (append only)
+    durable   messages per second until everything is on disk (append + flush)
+"""
+import os
+import sys
+import tempfile
+import time
+
+from app.chat import Chat, ChatType
+from app.wal import DURABILITY_LEVELS, WriteAheadLog, read_records
+
+EVERY_CAP = 2000
+
+def run(level, messages, directory):
+    chat = Chat(ChatType.GROUP, name="bench")
+    sample = [chat.messages.append(i % 8 + 1, f"benchmark message number {i}") for i in range(min(messages, 1000))]
+    wal = WriteAheadLog(directory, durability=level)
+
+    start = time.perf_counter()
+    for i in range(messages):
+        wal.message_added(chat, sample[i % len(sample)])
+    appended = time.perf_counter() - start
+    wal.flush()
+    durable = time.perf_counter() - start
+    wal.close()
+
+    logged = sum(1 for _ in read_records(directory))
+    assert logged == messages, f"{level}: expected {messages} records, read back {logged}"
+    return appended / messages, messages / durable
+
+def main():
+    messages = int(sys.argv[1]) if len(sys.argv) > 1 else 20_000
+    base = sys.argv[2] if len(sys.argv) > 2 else None
+    print(f"  {'level':>8}  {'messages':>8}  {'caller':>12}  {'durable':>14}")
+    for level in DURABILITY_LEVELS:
+        count = min(messages, EVERY_CAP) if level == "every" else messages
+        with tempfile.TemporaryDirectory(dir=base) as directory:
+            per_call, rate = run(level, count, os.path.join(directory, "wal"))
+        print(f"  {level:>8}  {count:>8}  {per_call * 1e6:>9.1f} us  {rate:>10,.0f} /s")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,50 @@
+"""Per-request authentication and the verified-token cache (app/auth.py)."""
+from types import SimpleNamespace
+
+import pytest
+from flask import Flask, jsonify
+from flask_jwt_extended import JWTManager, create_access_token, get_current_user, get_jwt_identity
+
+from app import auth
+from app.auth import TokenCache, authenticate_request
+from app.database import UserStore
+from app.user import User
+
+
+@pytest.fixture
+def client(monkeypatch):
+    users = UserStore()
+    users.add(User(userId=7, name="Token User", email="token@example.com", username="token_user",
+                   password="password123"))
+    monkeypatch.setattr(auth, "storage", SimpleNamespace(users=SimpleNamespace(get=users.get_by_id)))
+    monkeypatch.setattr(auth, "token_cache", TokenCache())
+
+    application = Flask(__name__)
+    application.config["JWT_SECRET_KEY"] = "test-secret-key-of-sufficient-length"
+    JWTManager(application)
+
+    @application.route("/me")
+    def me():
+        authenticate_request()
+        return jsonify({"identity": get_jwt_identity(), "username": get_current_user().username})
+
+    with application.app_context():
+        token = create_access_token(identity=7)
+    return application, {"Authorization": f"Bearer {token}"}
+
+def test_cache_hits_keep_the_library_accessors_working(client):
+    application, headers = client
+    test_client = application.test_client()
+    for _ in range(2):  # a verified miss, then a cache hit
+        response = test_client.get("/me", headers=headers)
+        assert response.status_code == 200
+        assert response.get_json() == {"identity": 7, "username": "token_user"}
+    assert (auth.token_cache.misses, auth.token_cache.hits) == (1, 1)
+
+def test_deleting_a_user_drops_their_cached_tokens(client):
+    application, headers = client
+    application.test_client().get("/me", headers=headers)
+    assert len(auth.token_cache) == 1
+    with application.app_context():
+        auth.token_cache.user_deleted(SimpleNamespace(userId=7))
+    assert len(auth.token_cache) == 0
@@ -0,0 +1,24 @@
+"""The columnar message history of a chat (app/message_log.py)."""
+import pytest
+
+from app.chat import Chat, ChatType
+from app.database import ChatStore
+
+
+def test_a_rejected_message_leaves_the_chat_intact():
+    store = ChatStore()
+    chat = Chat(ChatType.GROUP, name="Columns")
+    chat.add_member(1)
+    chat.add_member(2)
+    store.add(chat)
+    chat.add_message(1, "first")
+
+    for sender, text in ((1, 5), (1, b"bytes"), ("not a user", "text")):
+        with pytest.raises((ValueError, TypeError)):
+            chat.add_message(sender, text)
+
+    assert len(chat.messages) == 1
+    assert chat.get_unread_count(2) == 1
+    assert chat.add_message(2, "second").seq == 2
+    assert [m["text"] for m in chat.get_messages()] == ["first", "second"]
+    assert chat.to_dict(1)["lastMessage"]["text"] == "second"
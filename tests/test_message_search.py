@@ -0,0 +1,62 @@
+"""Message search and its nextBefore cursor (app/message_search.py)."""
+import datetime
+import uuid
+
+from app import message_search
+from app.chat import Chat, ChatType
+from app.database import ChatStore
+from app.message_search import MessageSearchIndex
+
+START = datetime.datetime(2024, 1, 1, tzinfo=datetime.UTC)
+
+def make_chat(store, name, minutes):
+    """A chat whose n-th message says "hello n" and was sent `minutes[n]` minutes after START."""
+    chat = Chat(ChatType.GROUP, name=name)
+    chat.add_member(1)
+    store.add(chat)
+    for n, minute in enumerate(minutes):
+        chat.messages.restore(str(uuid.uuid4()), 1, f"hello {name} {n}", START + datetime.timedelta(minutes=minute))
+    return chat
+
+def all_pages(index, chats, query, limit):
+    hits, before = [], None
+    while True:
+        page = index.search(chats, query, limit, before)
+        hits.extend((hit["chatId"], hit["seq"]) for hit in page["hits"])
+        before = page["nextBefore"]
+        if before is None:
+            return hits
+
+def test_pages_cover_every_hit_once_when_the_clock_steps_back():
+    store = ChatStore()
+    # The clock stepped back after the third message of "a" and the second of "b"
+    a = make_chat(store, "a", [10, 20, 30, 5, 6, 40, 50])
+    b = make_chat(store, "b", [15, 25, 1, 2, 3, 35, 45])
+    index = MessageSearchIndex()
+    expected = {(chat.chat_id, seq) for chat in (a, b) for seq in range(1, 8)}
+
+    for limit in (1, 2, 3, 5, 20):
+        hits = all_pages(index, [a, b], "hello", limit)
+        assert len(hits) == len(expected) and set(hits) == expected
+        for chat in (a, b):
+            assert [seq for chat_id, seq in hits if chat_id == chat.chat_id] == list(range(7, 0, -1))
+
+def test_new_messages_are_found_and_pages_stay_stable():
+    store = ChatStore()
+    chat = make_chat(store, "c", range(10))
+    index = MessageSearchIndex()
+    first = index.search([chat], "hello", 4)
+    chat.add_message(1, "hello there")
+    assert index.search([chat], "there", 4)["hits"][0]["seq"] == 11
+    second = index.search([chat], "hello", 4, first["nextBefore"])
+    assert [hit["seq"] for hit in second["hits"]] == [6, 5, 4, 3]
+
+def test_long_histories_are_indexed_in_chunks(monkeypatch):
+    yields = []
+    monkeypatch.setattr(message_search, "INDEX_CHUNK", 3)
+    monkeypatch.setattr(message_search, "yield_to_hub", lambda: yields.append(1))
+    store = ChatStore()
+    chat = make_chat(store, "d", range(10))
+    hits = MessageSearchIndex().search([chat], "d", 20)["hits"]
+    assert [hit["seq"] for hit in hits] == list(range(10, 0, -1))
+    assert len(yields) == 3
@@ -0,0 +1,43 @@
+"""Sealing chat history into memory-mapped segments (app/message_segment.py)."""
+import pytest
+
+from app.chat import Chat, ChatType
+from app.database import ChatStore
+from app.message_segment import HistorySealer, open_segments
+
+
+@pytest.fixture
+def max_open():
+    saved = open_segments.max_open
+    open_segments.max_open = 3
+    yield open_segments.max_open
+    open_segments.max_open = saved
+
+def test_segments_are_mapped_lazily_and_bounded(tmp_path, max_open):
+    store = ChatStore()
+    sealer = HistorySealer(str(tmp_path), store, min_messages=1)
+    chats = []
+    for i in range(10):
+        chat = Chat(ChatType.GROUP, name=f"chat {i}")
+        chat.add_member(1)
+        store.add(chat)
+        for n in range(50):
+            chat.add_message(1, f"{i}: message {n}")
+        assert sealer.seal(chat) == 50
+        chats.append(chat)
+    segments = [chat.messages._segments[0] for chat in chats]
+    assert not any(segment.is_open for segment in segments)
+
+    for _ in range(2):
+        for i, chat in enumerate(chats):
+            message = chat.messages[20]
+            assert message.text == f"{i}: message 20"
+            assert chat.get_message_by_id(message.message_id).seq == 21
+            assert len(open_segments) <= max_open
+    assert [segment.is_open for segment in segments] == [False] * 7 + [True] * 3
+
+    segments[-1].close()
+    assert chats[-1].messages[49].text == "9: message 49"
+    for segment in segments:
+        segment.close()
+    assert len(open_segments) == 0
@@ -0,0 +1,19 @@
+"""The write-behind queue of app/persistence.py."""
+from app.persistence import INSERT, WriteBehindQueue, messages_table
+
+
+def test_a_failing_operation_is_dropped_without_its_batch(capsys):
+    written = []
+
+    def write_batch(batch):
+        if any(row["text"] == "bad" for _, _, row in batch):
+            raise ValueError("value too long")
+        written.extend(row["seq"] for _, _, row in batch)
+
+    writer = WriteBehindQueue(write_batch, max_batch=10, max_delay=0.5, max_retries=1)
+    for seq in range(1, 8):
+        writer.put((INSERT, messages_table, {"chat_id": "c", "seq": seq, "text": "bad" if seq == 3 else "ok"}))
+    writer.close()
+
+    assert written == [1, 2, 4, 5, 6, 7]
+    assert "dropping insert on messages {'chat_id': 'c', 'seq': 3}" in capsys.readouterr().out
@@ -0,0 +1,212 @@
+"""
+Conformance suite for the repositories in app/repositories.py.
+
+Every test runs against each storage backend: memory, sqlite (a file in the
+test's temp dir) and postgres (only when DATABASE_URL points at a scratch
+PostgreSQL database, which the tests write to). The SQL backends also
+check that what was written reloads into fresh stores.
+"""
+import os
+import uuid
+
+import pytest
+
+from app import database
+from app.chat import Chat, ChatType
+from app.database import ChatStore, FriendRequestStore, FriendshipStore, UserStore
+from app.friendrequest import FriendRequest, RequestStatus
+from app.friendship import Friendship
+from app.message_search import MessageSearchIndex
+from app.persistence import SqlBackend
+from app.repositories import (ChatRepo, FriendRepo, MemoryChatRepo, MemoryFriendRepo, MemoryMessageRepo,
+                              MemoryUserRepo, MessageRepo, Storage, UserRepo)
+from app.sequence import IdSequence
+from app.user import Role, User
+
+POSTGRES_URL = os.getenv("DATABASE_URL", "")
+BACKEND_PARAMS = ["memory", "sqlite", pytest.param(
+    "postgres", marks=pytest.mark.skipif(not POSTGRES_URL.startswith("postgres"),
+                                         reason="DATABASE_URL does not point at PostgreSQL"))]
+
+
+def make_stores():
+    return UserStore(), FriendshipStore(), FriendRequestStore(), ChatStore()
+
+def make_storage(stores, ids) -> Storage:
+    users, friendships, friendrequests, chats = stores
+    storage = Storage()
+    storage.users = MemoryUserRepo(users, ids["users"])
+    storage.friends = MemoryFriendRepo(friendships, friendrequests, ids["friendships"], ids["friendrequests"])
+    storage.chats = MemoryChatRepo(chats)
+    storage.messages = MemoryMessageRepo(MessageSearchIndex())
+    return storage
+
+@pytest.fixture(params=BACKEND_PARAMS)
+def backend(request, tmp_path):
+    """(storage, reload): the repositories of one backend, and a function returning fresh stores reloaded from it."""
+    kind = request.param
+    url = {"sqlite": f"sqlite:///{tmp_path / 'conformance.db'}", "postgres": POSTGRES_URL}.get(kind)
+    ids = {name: IdSequence(name) for name in ("users", "friendships", "friendrequests")}
+    observers = []
+    if url:
+        sql = SqlBackend(url)
+        sql.bind_sequences(*ids.values())
+        observers.append(sql)
+    storage = make_storage(make_stores(), ids)
+    storage.backend = observers[0] if observers else None
+    observers.append(storage.messages.search_index)
+    for observer in observers:
+        database.add_observer(observer)
+
+    def reload():
+        storage.flush()
+        stores = make_stores()
+        SqlBackend(url).load(*stores)
+        return stores
+
+    yield storage, (reload if url else None)
+
+    for observer in observers:
+        database.remove_observer(observer)
+    if storage.backend is not None:
+        storage.backend.close()
+
+def new_user(storage, tag: str, **fields) -> User:
+    user = User(userId=storage.users.next_id(), name=fields.pop("name", "Conf User"),
+                email=f"conf-{tag}@example.com", username=f"Conf_{tag}", password="password123", **fields)
+    storage.users.add(user)
+    return user
+
+
+def test_interfaces_are_abstract():
+    for interface in (UserRepo, FriendRepo, ChatRepo, MessageRepo):
+        with pytest.raises(TypeError):
+            interface()
+
+def test_users(backend):
+    storage, reload = backend
+    tag = uuid.uuid4().hex[:8]
+    user = new_user(storage, tag, role=Role.USER)
+    assert storage.users.get(user.userId) is user
+    assert storage.users.get_by_username(f"conf_{tag}".upper()) is user
+    assert storage.users.get_by_email(f"CONF-{tag}@EXAMPLE.COM") is user
+
+    duplicate = User(userId=storage.users.next_id(), name="Dup", email=f"other-{tag}@example.com",
+                     username=f"conf_{tag}", password="password123")
+    with pytest.raises(ValueError):
+        storage.users.add(duplicate)
+
+    storage.users.rename(user, "Renamed User")
+    assert storage.users.get(user.userId).name == "Renamed User"
+    assert user in storage.users.all()
+    assert storage.users.search("renamed", 10) == [user]
+    assert storage.users.search("renamed", 10, exclude=lambda user_id: user_id == user.userId) == []
+
+    kept = new_user(storage, uuid.uuid4().hex[:8], name="Kept User")
+    storage.users.remove(user)
+    assert storage.users.get(user.userId) is None
+    assert storage.users.get_by_username(f"conf_{tag}") is None
+
+    if reload:
+        users = reload()[0]
+        assert users.get_by_id(user.userId) is None
+        assert users.get_by_id(kept.userId).username == kept.username
+        assert users.get_by_id(kept.userId).check_password("password123", upgrade=False)
+
+def test_friends(backend):
+    storage, reload = backend
+    a, b, c = 900_001, 900_002, 900_003
+    request = FriendRequest(requestId=storage.friends.next_request_id(), senderId=a, receiverId=b)
+    storage.friends.add_request(request)
+    assert storage.friends.get_request(request.requestId) is request
+    assert storage.friends.find_pending_request(b, a) is request
+    assert request in storage.friends.incoming(b)
+    assert request in storage.friends.outgoing(a)
+
+    request.accept()
+    assert storage.friends.find_pending_request(a, b) is None
+    assert request in storage.friends.incoming(b, RequestStatus.ACCEPTED)
+
+    friendship = Friendship(friendshipId=storage.friends.next_friendship_id(), user1Id=a, user2Id=b)
+    storage.friends.add_friendship(friendship)
+    storage.friends.add_friendship(Friendship(friendshipId=storage.friends.next_friendship_id(), user1Id=a, user2Id=c))
+    assert storage.friends.find_friendship(b, a) is friendship
+    assert storage.friends.friend_ids(a) == {b, c}
+
+    storage.friends.remove_friendship(friendship)
+    assert storage.friends.find_friendship(a, b) is None
+    if reload:
+        _, friendships, friendrequests, _ = reload()
+        assert friendships.friend_ids(a) == {c}
+        assert friendrequests.get_by_id(request.requestId).status == RequestStatus.ACCEPTED
+
+    storage.friends.remove_user(a)
+    assert not storage.friends.friend_ids(c)
+    assert storage.friends.get_request(request.requestId) is None
+
+def test_chats_and_messages(backend):
+    storage, reload = backend
+    a, b, c = 910_001, 910_002, 910_003
+    direct = Chat(ChatType.ONE_ON_ONE)
+    direct.add_member(a)
+    direct.add_member(b)
+    storage.chats.add(direct)
+    group = Chat(ChatType.GROUP, name="Conformance")
+    for user_id in (a, b, c):
+        group.add_member(user_id)
+    storage.chats.add(group)
+
+    assert storage.chats.get(direct.chat_id) is direct
+    assert storage.chats.find_one_on_one(str(b), a) is direct
+    assert {chat.chat_id for chat in storage.chats.chats_for_user(a)} == {direct.chat_id, group.chat_id}
+
+    first = storage.messages.append(direct, a, "hello")
+    storage.messages.append(group, b, "hi all")
+    second = storage.messages.append(direct, b, "hey")
+    assert (first.seq, second.seq) == (1, 2)
+    page, next_before = storage.chats.recent_chats_for_user(a, limit=1)
+    assert page == [direct]
+    assert storage.chats.recent_chats_for_user(a, limit=1, before=next_before) == ([group], None)
+
+    assert storage.messages.get_by_id(direct, first.message_id).text == "hello"
+    result = storage.messages.page(direct, before=3, limit=1)
+    assert [m["seq"] for m in result["messages"]] == [2] and result["hasMoreBefore"]
+
+    assert storage.messages.unread_count(direct, a) == 1
+    assert storage.messages.mark_read(direct, a, second)
+    assert not storage.messages.mark_read(direct, a, first)
+    assert storage.messages.unread_count(direct, a) == 0
+    assert storage.messages.mark_all_read(group, c).seq == 1
+
+    hits = storage.messages.search([direct, group], "HEY", 10)["hits"]
+    assert [(hit["chatId"], hit["seq"]) for hit in hits] == [(direct.chat_id, 2)]
+
+    sync = storage.chats.sync_for_user(b, {direct.chat_id: {"lastSeq": 1, "revision": 0}})
+    synced = {entry["chat"]["chatId"]: entry for entry in sync["chats"]}
+    assert [m["seq"] for m in synced[direct.chat_id]["messages"]] == [2]
+
+    if reload:
+        chats = reload()[3]
+        restored = chats.get(direct.chat_id)
+        assert [m.text for m in restored.messages] == ["hello", "hey"]
+        assert restored.get_unread_count(a) == 0 and restored.get_unread_count(b) == 1
+        assert chats.find_one_on_one(a, b) is restored
+
+def test_member_listeners(backend):
+    storage, _ = backend
+    joined = []
+    storage.chats.add_member_listener(lambda chat, user_id: joined.append((chat.chat_id, user_id)))
+    chat = Chat(ChatType.GROUP, name="Listeners")
+    chat.add_member(1)
+    storage.chats.add(chat)
+    chat.add_member("2")
+    assert joined == [(chat.chat_id, 1), (chat.chat_id, 2)]
+
+@pytest.mark.parametrize("cursor", [True, {"lastSeq": False}, {"lastSeq": 0, "revision": True}, {"lastSeq": "1"}])
+def test_sync_rejects_non_integer_cursors(backend, cursor):
+    storage, _ = backend
+    chat = Chat(ChatType.GROUP, name="Sync")
+    chat.add_member(1)
+    storage.chats.add(chat)
+    with pytest.raises(ValueError):
+        storage.chats.sync_for_user(1, {chat.chat_id: cursor})
@@ -0,0 +1,28 @@
+"""The typeahead index behind /search-users (app/search.py)."""
+from app.search import UserSearchIndex
+
+
+def make_index():
+    index = UserSearchIndex()
+    index.add(1, "zzbobq", "Alice Smith")
+    index.add(2, "robert", "Bob Lee")
+    index.add(3, "carol", "Carol Obi")
+    return index
+
+def test_prefix_matches_come_before_substring_matches():
+    index = make_index()
+    assert list(index.search("bo")) == [2, 1]
+    assert list(index.search("ob")) == [3, 1, 2]
+
+def test_two_character_queries_match_substrings():
+    index = make_index()
+    assert list(index.search("mi")) == [1]
+    assert list(index.search("ER")) == [2]
+    assert list(index.search("o")) == [3]  # one character: prefixes only
+
+def test_removed_and_renamed_users_stop_matching():
+    index = make_index()
+    index.remove(1)
+    index.add(3, "carol", "Carol Jones")
+    assert list(index.search("ob")) == [2]
+    assert list(index.search("jo")) == [3]
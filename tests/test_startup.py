@@ -0,0 +1,39 @@
+"""Startup configuration checks and the StartupReport timing summary."""
+import time
+
+import pytest
+
+from app.repositories import StartupReport, configure_storage
+
+
+def test_report_times_each_phase_in_order(capsys):
+    report = StartupReport("memory")
+    with report.phase("load"):
+        time.sleep(0.01)
+    with report.phase("replay"):
+        pass
+    report.details["replayed records"] = 3
+    report.print()
+
+    assert [name for name, _ in report.phases] == ["load", "replay"]
+    assert report.phases[0][1] >= 0.01
+    output = capsys.readouterr().out
+    assert output.startswith("Storage (memory) ready in ")
+    assert "load 0.0" in output and "replay 0.0" in output
+    assert "  replayed records: 3\n" in output
+
+def test_report_records_a_phase_that_fails():
+    report = StartupReport("memory")
+    with pytest.raises(RuntimeError):
+        with report.phase("load"):
+            raise RuntimeError("corrupt snapshot")
+    assert [name for name, _ in report.phases] == ["load"]
+
+def test_snapshots_require_a_write_ahead_log(tmp_path):
+    with pytest.raises(ValueError, match="write-ahead log"):
+        configure_storage("memory", snapshot_dir=str(tmp_path / "snapshots"))
+
+def test_snapshots_require_the_memory_backend(tmp_path):
+    with pytest.raises(ValueError, match="memory backend"):
+        configure_storage("sqlite", f"sqlite:///{tmp_path / 'app.db'}", wal_dir=str(tmp_path / "wal"),
+                          snapshot_dir=str(tmp_path / "snapshots"))